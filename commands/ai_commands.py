@@ -1,8 +1,9 @@
-import discord
 from discord.ext import commands
 
 from services.ai_service import get_ai_service
 from services.context_grabber import get_context_grabber
+from services.recent_messages import get_recent_messages
+from utils import tracing
 from utils.discord_helpers import get_guild_id, send_long_message
 from utils.logging import get_logger
 
@@ -12,6 +13,7 @@ logger = get_logger("commands")
 def setup_ai_commands(bot: commands.Bot):
   ai_service = get_ai_service()
   context_grabber = get_context_grabber()
+  recent_messages = get_recent_messages()
 
   @bot.command()
   async def chat(ctx, *, message: str):
@@ -26,9 +28,6 @@ def setup_ai_commands(bot: commands.Bot):
 
     logger.info(f"💬 Chat from {ctx.author.display_name}: {message[:50]}...")
 
-    messages_per_channel = 20
-    max_total_messages = 100
-
     system_msg = (
       "You are a chill, helpful bot in a Discord server. "
       "Keep responses SHORT and conversational - like texting a friend. "
@@ -38,61 +37,42 @@ def setup_ai_commands(bot: commands.Bot):
       "The chat history is just for context - don't summarize it or reference it explicitly."
     )
 
-    async with ctx.typing():
-      context_messages = []
-
-      # Gather messages from all text channels in the guild
-      for channel in ctx.guild.text_channels:
-        try:
-          if not channel.permissions_for(ctx.guild.me).read_message_history:
-            continue
-
-          async for ctx_msg in channel.history(limit=messages_per_channel):
-            if ctx_msg.author.bot:
-              continue
-            context_messages.append({
-              "timestamp": ctx_msg.created_at,
-              "channel": channel.name,
-              "author": ctx_msg.author.display_name,
-              "content": ctx_msg.content,
-            })
-
-        except discord.Forbidden:
-          continue
-
-      # Sort by timestamp and take the most recent
-      context_messages.sort(key=lambda x: x["timestamp"])
-      context_messages = context_messages[-max_total_messages:]
-
-      # Format for the prompt
-      chat_history = "\n".join(
-        f"[#{m['channel']}] {m['author']}: {m['content']}"
-        for m in context_messages
-      )
-
-      guild_id = get_guild_id(ctx)
-      server_context = await context_grabber.get_relevant_context(
-        message, guild_id=guild_id
-      )
-
-      prompt = (
-        f"Here is the recent message history from across the server:\n\n"
-        f"--- CHAT HISTORY ---\n"
-        f"{chat_history}\n"
-        f"--- END HISTORY ---\n\n"
-      )
-
-      if server_context:
-        prompt += f"{server_context}\n\n"
-
-      prompt += f"User message to respond to: {message}"
-
-      response = await ai_service.call_gemini_ai(
-        prompt, system_message=system_msg, use_search=True
-      )
-
-    logger.info(f"💬 Response sent to {ctx.author.display_name}")
-    await send_long_message(ctx, response)
+    with tracing.trace("chat"):
+      async with ctx.typing():
+        with tracing.span("recent"):
+          context_messages = await recent_messages.get_guild_recent(ctx.guild)
+
+        # Format for the prompt
+        chat_history = "\n".join(
+          f"[#{channel}] {m.author}: {m.content}" for channel, m in context_messages
+        )
+
+        guild_id = get_guild_id(ctx)
+        with tracing.span("context"):
+          server_context = await context_grabber.get_relevant_context(
+            message, guild_id=guild_id
+          )
+
+        prompt = (
+          f"Here is the recent message history from across the server:\n\n"
+          f"--- CHAT HISTORY ---\n"
+          f"{chat_history}\n"
+          f"--- END HISTORY ---\n\n"
+        )
+
+        if server_context:
+          prompt += f"{server_context}\n\n"
+
+        prompt += f"User message to respond to: {message}"
+
+        with tracing.span("gemini"):
+          response = await ai_service.call_gemini_ai(
+            prompt, system_message=system_msg, use_search=True
+          )
+
+      logger.info(f"💬 Response sent to {ctx.author.display_name}")
+      with tracing.span("send"):
+        await send_long_message(ctx, response)
 
   @bot.command()
   async def ai_status(ctx):
@@ -1,10 +1,19 @@
+import asyncio
+
 from discord.ext import commands
 
+from config import PROFILE_DIR
 from db import message_db
 from utils.logging import get_logger
+from utils.tracing import get_profiler
 
 logger = get_logger("utility")
 
+# Seconds between /reindex progress updates
+REINDEX_PROGRESS_INTERVAL = 5.0
+# Most requests a single /profile can arm
+PROFILE_MAX_REQUESTS = 20
+
 
 def setup_utility_commands(bot: commands.Bot):
   @bot.command()
@@ -37,10 +46,13 @@ def setup_utility_commands(bot: commands.Bot):
 `/greet_user [username]` - Greet a user
 `/reset_index [yes]` - Reset the message index (requires confirmation)
 `/index_stats` - Show indexing statistics
+`/reindex [full]` - Crawl older history, or start over with `full` (admin only)
+`/profile [n]` - Profile the next n AI replies, 0 to cancel (admin only)
 
 **Auto-Features:**
 - Messages are automatically indexed for context retrieval
-- When joining a server, the bot indexes up to 1000 recent messages
+- On startup and when joining a server, the bot crawls channel, thread and
+  forum history, going up to 1000 messages deeper per channel each time
 """
     await ctx.send(help_text)
 
@@ -73,6 +85,53 @@ def setup_utility_commands(bot: commands.Bot):
       f"💡 New messages will be indexed automatically"
     )
 
+  @bot.command()
+  async def reindex(ctx, mode: str = ""):
+    """Crawls this server's history further back (Admin only)."""
+    if not ctx.guild:
+      await ctx.send("This command can only be used in a server.")
+      return
+    if not ctx.author.guild_permissions.administrator:
+      await ctx.send("❌ You need administrator permissions to use this command.")
+      return
+
+    from services.auto_index_service import get_auto_index_service
+
+    auto_index = get_auto_index_service()
+    task = auto_index.start_crawl(ctx.guild, restart=mode == "full")
+    status = await ctx.send("🔄 Starting history crawl...")
+
+    while not task.done():
+      await asyncio.wait({task}, timeout=REINDEX_PROGRESS_INTERVAL)
+      progress = auto_index.progress.get(str(ctx.guild.id))
+      if progress:
+        await status.edit(content=progress.summary())
+
+    if task.cancelled():
+      await status.edit(content="⏹️ Crawl stopped, a full reindex started over")
+    elif task.exception():
+      await status.edit(content=f"❌ Crawl failed: {task.exception()}")
+
+  @bot.command()
+  async def profile(ctx, count: int = 1):
+    """Captures cProfile stats for the next few traced requests (Admin only)."""
+    if not ctx.guild:
+      await ctx.send("This command can only be used in a server.")
+      return
+    if not ctx.author.guild_permissions.administrator:
+      await ctx.send("❌ You need administrator permissions to use this command.")
+      return
+
+    count = max(0, min(count, PROFILE_MAX_REQUESTS))
+    get_profiler().arm(count)
+    logger.info(f"🔬 {ctx.author.display_name} armed profiling for {count} requests")
+    if count:
+      await ctx.send(
+        f"🔬 Profiling the next {count} AI replies; stats are logged and saved to `{PROFILE_DIR}`"
+      )
+    else:
+      await ctx.send("🔬 Profiling cancelled")
+
   @bot.command()
   async def index_stats(ctx):
     if not ctx.guild:
@@ -83,10 +142,38 @@ def setup_utility_commands(bot: commands.Bot):
     total_count = await message_db.get_message_count(guild_id=guild_id)
     total_all = await message_db.get_message_count()
 
+    from services.embedding_backfill import get_embedding_backfill_service
+    from services.search_service import get_search_service
+
+    cache_stats = get_search_service().cache_stats()
+    embeddings, results = cache_stats["query_embeddings"], cache_stats["results"]
+    backfill = await get_embedding_backfill_service().get_progress()
+    pending_jobs = await message_db.count_index_jobs()
+
+    from services.message_indexer import get_message_indexer
+
+    batching = get_message_indexer().batch_stats()
+
+    from services.index_maintenance import get_index_maintenance
+
+    maintenance = get_index_maintenance()
+
     await ctx.send(
       f"📊 **Index Statistics:**\n"
       f"📝 This server: {total_count} messages indexed\n"
-      f"🌐 All servers: {total_all} messages indexed"
+      f"🌐 All servers: {total_all} messages indexed\n"
+      f"📥 Waiting to be indexed: {pending_jobs} messages\n"
+      f"📦 Indexing batches: {batching['mean_batch_size']:.1f} messages on average, "
+      f"waited {batching['mean_wait']:.2f}s (p95 {batching['p95_wait']:.2f}s)\n"
+      f"🧩 Embedding backlog: {backfill['missing']} missing, "
+      f"{backfill['stale']} at an old size "
+      f"({backfill['backfilled'] + backfill['converted']} embedded by backfill"
+      f"{'' if backfill['running'] else ', paused'})\n"
+      f"✏️ Kept in sync: {maintenance.edited} edits, {maintenance.deleted} deletions\n"
+      f"🧠 Query embedding cache: {embeddings['hits']} hits / "
+      f"{embeddings['misses']} misses ({embeddings['size']} entries)\n"
+      f"🗂️ Search result cache: {results['hits']} hits / "
+      f"{results['misses']} misses ({results['size']} entries)"
     )
 
   @bot.command()
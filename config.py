@@ -10,17 +10,118 @@ GEMINI_MODEL = "gemini-3-flash-preview"
 
 DB_PATH = "data/messages.db"
 
+# SQLite connection pool (one writer plus DB_READER_POOL_SIZE readers, WAL mode)
+DB_READER_POOL_SIZE = 4
+DB_STATEMENT_CACHE_SIZE = 256
+DB_CACHE_SIZE_KB = 64 * 1024  # Page cache per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024
+
+# Prometheus metrics, served locally at http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108  # 0 = disabled
+
+# Request tracing: replies slower than this are logged with a per-stage breakdown
+SLOW_REQUEST_THRESHOLD = 5.0  # Seconds
+# Event-loop watchdog: logs what was running when the loop stalls this long
+LOOP_LAG_CHECK_INTERVAL = 0.25  # Seconds between heartbeats
+LOOP_LAG_THRESHOLD_MS = 100
+# /profile captures (cProfile stats of the next N requests)
+PROFILE_DIR = "data/profiles"
+PROFILE_TOP_FUNCTIONS = 25
+
+# CPU-bound work runs off the event loop. NumPy scoring releases the GIL, so
+# threads suffice; pure-Python work (hashing large batches) can use processes.
+CPU_THREAD_WORKERS = min(4, os.cpu_count() or 1)
+CPU_PROCESS_WORKERS = 0  # 0 = no process pool, use the thread pool instead
+
+# Embeddings live in per-guild memory-mapped files rather than in SQLite
+VECTOR_DIR = "data/vectors"
+# Storage codec for vector files: "float32", "float16" (2x smaller) or "int8"
+# (4x smaller). Existing files are re-encoded on startup when this changes.
+EMBEDDING_CODEC = "float32"
+# Quantized first-pass candidates re-scored at float32 precision per search
+SEARCH_RERANK_CANDIDATES = 200
+
+# Vector search: "exact" scans every embedding, "ivf" uses a per-guild
+# approximate index persisted under ANN_INDEX_DIR
+SEARCH_INDEX = "exact"
+ANN_INDEX_DIR = "data/ann"
+ANN_MIN_VECTORS = 20000  # Smaller guilds always use exact search
+ANN_NLIST = 0  # IVF lists per guild, 0 = sqrt(vector count)
+ANN_NPROBE = 16  # Lists scanned per query: higher = better recall, slower
+
+# Indexing batches start at INDEXING_BATCH_SIZE messages and grow toward
+# EMBEDDING_BATCH_SIZE while a backlog remains
 INDEXING_BATCH_SIZE = 10
-INDEXING_QUEUE_MAX_SIZE = 1000
+# Pending messages are stored in the index_jobs table; these bound how many
+# are also held in memory (the rest wait on disk)
+INDEXING_QUEUE_MAX_SIZE = 1000  # Live messages from on_message
+INDEXING_BULK_QUEUE_SIZE = 500  # History crawls
+INDEXING_EMBED_WORKERS = 2  # Batches embedded concurrently
+INDEXING_MAX_BATCH_AGE = 1.0  # Seconds a batch's oldest message may wait
+INDEXING_SHUTDOWN_TIMEOUT = 10.0  # Seconds to finish in-flight batches on exit
+INDEXING_RETRY_DELAY = 5.0  # Seconds before a failed batch is read back from disk
 EMBEDDING_BATCH_SIZE = 50
+# Embedding API quota shared by indexing, backfill and search (defaults match
+# the Gemini free tier). Throttled calls slow the rate down and are retried.
+EMBEDDING_REQUESTS_PER_MINUTE = 100
+EMBEDDING_TOKENS_PER_MINUTE = 30000
+EMBEDDING_MAX_CONCURRENCY = 4  # Batches in flight at once
+EMBEDDING_THROTTLE_RETRIES = 5
+# Failed embedding calls are retried with exponential backoff; after
+# EMBEDDING_BREAKER_THRESHOLD consecutive failures calls stop for
+# EMBEDDING_BREAKER_RESET_TIMEOUT seconds (search uses full-text only and new
+# messages are embedded later by the backfill)
+EMBEDDING_REQUEST_TIMEOUT = 20.0  # Seconds
+EMBEDDING_MAX_RETRIES = 3
+EMBEDDING_RETRY_BASE_DELAY = 0.5  # Seconds, doubled per retry
+EMBEDDING_BREAKER_THRESHOLD = 5
+EMBEDDING_BREAKER_RESET_TIMEOUT = 30.0  # Seconds
 
-# Auto-indexing on guild join
-AUTO_INDEX_LIMIT = 1000  # Total messages to index when joining a new server
+# History crawls (on startup, guild join and /reindex). Each crawl resumes
+# from per-channel checkpoints and goes AUTO_INDEX_LIMIT messages deeper.
+AUTO_INDEX_LIMIT = 1000  # Messages per channel or thread per crawl
+CRAWL_CONCURRENCY = 3  # Channels fetched at once, across all guilds
+CRAWL_PAGE_SIZE = 100  # Messages per history request (Discord's maximum)
+CATCH_UP_BATCH_SIZE = 500  # Missed messages queued per write when catching up
+CRAWL_ARCHIVED_THREADS = True  # Also crawl archived threads and forum posts
 
 DEFAULT_SEARCH_LIMIT = 10
+# "hybrid" fuses full-text (BM25) and vector results; "vector" or "lexical"
+# use one side only. Hybrid falls back to lexical if embedding the query fails.
+SEARCH_MODE = "hybrid"
+SEARCH_RRF_K = 60  # Reciprocal rank fusion damping constant
+SEARCH_EMBEDDING_TIMEOUT = 3.0  # Seconds to wait for a query embedding
+# Query text -> embedding, and per-guild search results (dropped as soon as
+# the guild's index changes)
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+QUERY_EMBEDDING_CACHE_TTL = 3600  # Seconds
+SEARCH_RESULT_CACHE_SIZE = 512
+SEARCH_RESULT_CACHE_TTL = 300  # Seconds
 DEFAULT_CONTEXT_LIMIT = 5
 
+# Recent messages kept in memory per channel for /chat history
+RECENT_MESSAGES_PER_CHANNEL = 20
+CHAT_CONTEXT_MAX_MESSAGES = 100
+
+# Reply chains followed when the bot is mentioned or replied to
+REPLY_CHAIN_MAX_DEPTH = 5
+REPLY_CHAIN_CACHE_SIZE = 2000  # Recently seen/sent messages kept for lookups
+
 EMBEDDING_MODEL = "gemini-embedding-001"
+# Output size requested from the embedding model (up to 3072). Messages stored
+# at another size are re-embedded in the background after this changes.
+EMBEDDING_DIM = 768
+# Background backfill embeds messages stored without an embedding (or at
+# another size), pausing while live messages are waiting to be indexed
+BACKFILL_BATCH_INTERVAL = 2.0  # Seconds between backfill batches
+BACKFILL_SCAN_INTERVAL = 600  # Seconds between passes over the backlog
+
+# Edits and deletions are buffered and applied in bulk
+INDEX_MAINTENANCE_INTERVAL = 2.0  # Seconds between applying buffered changes
+INDEX_COMPACT_INTERVAL = 3600  # Seconds between compaction passes
+TOMBSTONE_RETENTION = 7 * 24 * 3600  # Seconds deleted ids are remembered
+VECTOR_COMPACT_DEAD_FRACTION = 0.2  # Rewrite a vector file once this much is dead
 
 # LeetCode Configuration
 LEETCODE_API_URL = "https://leetcode.com/graphql"
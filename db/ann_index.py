@@ -0,0 +1,169 @@
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+ASSIGN_CHUNK_SIZE = 8192
+TRAINING_SAMPLES_PER_LIST = 40
+
+
+def assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+  """Nearest (highest cosine) centroid for each row.
+
+  Rows may be stored quantized: a positive per-row scale does not change which
+  centroid scores highest, so int8 codes can be assigned without decoding.
+  """
+  assignments = np.empty(len(vectors), dtype=np.int32)
+  for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+    chunk = np.asarray(vectors[start : start + ASSIGN_CHUNK_SIZE], dtype=np.float32)
+    assignments[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+  return assignments
+
+
+def train_centroids(
+  vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0
+) -> np.ndarray:
+  """Spherical k-means over a sample of the rows."""
+  rng = np.random.default_rng(seed)
+  sample_size = min(len(vectors), nlist * TRAINING_SAMPLES_PER_LIST)
+  sample = np.asarray(
+    vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))],
+    dtype=np.float32,
+  )
+  norms = np.linalg.norm(sample, axis=1)
+  sample = sample[norms > 0] / norms[norms > 0][:, None]
+  centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+  for _ in range(iterations):
+    assignments = assign_to_centroids(sample, centroids)
+    sums = np.zeros_like(centroids)
+    np.add.at(sums, assignments, sample)
+    norms = np.linalg.norm(sums, axis=1)
+    # Empty clusters keep their previous centroid.
+    filled = norms > 0
+    centroids[filled] = sums[filled] / norms[filled][:, None]
+
+  return centroids.astype(np.float32, copy=False)
+
+
+class IVFIndex:
+  """Inverted-file index over positions in a guild's embedding matrix.
+
+  Vectors are bucketed by their nearest k-means centroid; a query scores only
+  the `nprobe` buckets whose centroids are closest to it.
+  """
+
+  def __init__(self, centroids: np.ndarray, trained_size: int):
+    self.centroids = centroids
+    self.trained_size = trained_size
+    self.dirty = False
+    self._lists: List[List[np.ndarray]] = [[] for _ in range(len(centroids))]
+    self._assignments: List[np.ndarray] = []
+    # Searches read the lists from worker threads while the event loop adds.
+    self._lock = threading.Lock()
+
+  @property
+  def nlist(self) -> int:
+    return len(self.centroids)
+
+  @property
+  def dim(self) -> int:
+    return self.centroids.shape[1]
+
+  @classmethod
+  def build(cls, vectors: np.ndarray, nlist: int) -> "IVFIndex":
+    nlist = max(1, min(nlist, len(vectors)))
+    index = cls(train_centroids(vectors, nlist), trained_size=len(vectors))
+    index.add(np.arange(len(vectors)), assign_to_centroids(vectors, index.centroids))
+    return index
+
+  def assign(self, vectors: np.ndarray) -> np.ndarray:
+    return assign_to_centroids(vectors, self.centroids)
+
+  def add(self, positions: np.ndarray, assignments: np.ndarray):
+    if len(positions) == 0:
+      return
+    positions = np.asarray(positions, dtype=np.int64)
+    order = np.argsort(assignments, kind="stable")
+    sorted_lists = assignments[order]
+    bounds = np.flatnonzero(np.diff(sorted_lists)) + 1
+    with self._lock:
+      for group in np.split(order, bounds):
+        self._lists[int(assignments[group[0]])].append(positions[group])
+      self._assignments.append(np.stack([positions, assignments.astype(np.int64)]))
+      self.dirty = True
+
+  def _positions(self, list_id: int) -> np.ndarray:
+    chunks = self._lists[list_id]
+    if not chunks:
+      return np.empty(0, dtype=np.int64)
+    if len(chunks) > 1:
+      chunks[:] = [np.concatenate(chunks)]
+    return chunks[0]
+
+  def candidates(self, query_unit: np.ndarray, nprobe: int) -> np.ndarray:
+    nprobe = max(1, min(nprobe, self.nlist))
+    scores = self.centroids @ query_unit
+    probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+    with self._lock:
+      return np.concatenate([self._positions(int(list_id)) for list_id in probe])
+
+  def export(self, ids: np.ndarray, valid: Optional[np.ndarray] = None) -> dict:
+    """Snapshot centroids and per-row list assignments keyed by message row id.
+
+    Positions outside the `valid` mask, when given, are left out.
+    """
+    with self._lock:
+      assignments = np.concatenate(self._assignments, axis=1)
+    if valid is not None:
+      assignments = assignments[:, valid[assignments[0]]]
+    self.dirty = False
+    return {
+      "centroids": self.centroids,
+      "trained_size": np.int64(self.trained_size),
+      "ids": ids[assignments[0]],
+      "lists": assignments[1].astype(np.int32),
+    }
+
+  @staticmethod
+  def write(path: str, arrays: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+      np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+  @classmethod
+  def load(cls, path: str, ids: np.ndarray) -> Optional["IVFIndex"]:
+    """Load a persisted index and map its row ids onto current matrix positions.
+
+    Rows deleted since the save are dropped; rows added since are returned to
+    the caller as unassigned (positions missing from the index).
+    """
+    with np.load(path) as data:
+      centroids = data["centroids"]
+      trained_size = int(data["trained_size"])
+      saved_ids = data["ids"]
+      saved_lists = data["lists"]
+
+    if len(ids) == 0:
+      return None
+    # Map each saved id to its latest row; ids need not be sorted or unique
+    # because rewritten vectors are appended after the originals.
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    found = np.searchsorted(sorted_ids, saved_ids, side="right") - 1
+    found = np.maximum(found, 0)
+    present = sorted_ids[found] == saved_ids
+    positions = order[found]
+    index = cls(centroids, trained_size)
+    index.add(positions[present], saved_lists[present])
+    index.dirty = not present.all()
+    return index
+
+  def indexed_mask(self, size: int) -> np.ndarray:
+    mask = np.zeros(size, dtype=bool)
+    for chunk in self._assignments:
+      mask[chunk[0][chunk[0] < size]] = True
+    return mask
@@ -0,0 +1,143 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+import aiosqlite
+
+from config import (
+  DB_CACHE_SIZE_KB,
+  DB_MMAP_SIZE,
+  DB_PATH,
+  DB_READER_POOL_SIZE,
+  DB_STATEMENT_CACHE_SIZE,
+)
+from utils.logging import get_logger
+
+logger = get_logger("db")
+
+
+class ConnectionPool:
+  """Long-lived SQLite connections: one serialized writer plus a pool of readers.
+
+  The database runs in WAL mode so readers never block behind the writer and
+  each connection keeps its own prepared statement cache across calls.
+  """
+
+  def __init__(self, path: str = DB_PATH, reader_count: int = DB_READER_POOL_SIZE):
+    self.path = path
+    self.reader_count = max(1, reader_count)
+    self._writer: Optional[aiosqlite.Connection] = None
+    self._write_lock = asyncio.Lock()
+    self._idle_readers: asyncio.Queue = asyncio.Queue()
+    self._readers: List[aiosqlite.Connection] = []
+    self._closed = False
+
+  async def _connect(self, readonly: bool = False) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(
+      self.path, cached_statements=DB_STATEMENT_CACHE_SIZE
+    )
+    conn.row_factory = aiosqlite.Row
+    pragmas = [
+      "busy_timeout = 5000",
+      "synchronous = NORMAL",
+      f"cache_size = -{int(DB_CACHE_SIZE_KB)}",
+      f"mmap_size = {int(DB_MMAP_SIZE)}",
+      "temp_store = MEMORY",
+    ]
+    if readonly:
+      pragmas.append("query_only = ON")
+    for pragma in pragmas:
+      # Pragmas that report a value leave a statement open until the cursor is
+      # closed, which would hold a lock against the other connections.
+      async with conn.execute(f"PRAGMA {pragma}"):
+        pass
+    return conn
+
+  async def open(self):
+    db_dir = os.path.dirname(self.path)
+    if db_dir and not os.path.exists(db_dir):
+      os.makedirs(db_dir, exist_ok=True)
+
+    self._closed = False
+    self._idle_readers = asyncio.Queue()
+    self._writer = await self._connect()
+    # WAL is persisted in the database file, so setting it once on the writer
+    # is enough for every connection opened afterwards.
+    async with self._writer.execute("PRAGMA journal_mode = WAL"):
+      pass
+
+    for _ in range(self.reader_count):
+      reader = await self._connect(readonly=True)
+      self._readers.append(reader)
+      self._idle_readers.put_nowait(reader)
+
+    logger.info(f"SQLite pool opened: 1 writer, {self.reader_count} readers (WAL)")
+
+  async def close(self):
+    self._closed = True
+    async with self._write_lock:
+      if self._writer is not None:
+        await self._writer.close()
+        self._writer = None
+
+    for reader in self._readers:
+      await reader.close()
+    self._readers = []
+    # Wakes callers waiting for a reader; each passes the sentinel on.
+    self._idle_readers.put_nowait(None)
+
+  @asynccontextmanager
+  async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+    """Borrow a read-only connection for the duration of the block."""
+    if self._closed:
+      raise RuntimeError("Connection pool is closed")
+    conn = await self._idle_readers.get()
+    if conn is None:
+      self._idle_readers.put_nowait(None)
+      raise RuntimeError("Connection pool is closed")
+    try:
+      yield conn
+    finally:
+      if not self._closed:
+        self._idle_readers.put_nowait(conn)
+
+  @asynccontextmanager
+  async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+    """Hold the writer for one transaction, committing on success."""
+    async with self._write_lock:
+      if self._writer is None:
+        raise RuntimeError("Connection pool is closed")
+      try:
+        yield self._writer
+        await self._writer.commit()
+      except BaseException:
+        await self._writer.rollback()
+        raise
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def open_pool() -> ConnectionPool:
+  global _pool
+  async with _pool_lock:
+    if _pool is None:
+      pool = ConnectionPool()
+      await pool.open()
+      _pool = pool
+  return _pool
+
+
+def get_pool() -> Optional[ConnectionPool]:
+  return _pool
+
+
+async def close_pool():
+  global _pool
+  async with _pool_lock:
+    if _pool is not None:
+      await _pool.close()
+      _pool = None
+      logger.info("SQLite pool closed")
@@ -0,0 +1,105 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+import aiosqlite
+
+from db.connection import ConnectionPool
+from utils import metrics
+from utils.logging import get_logger
+
+logger = get_logger("db")
+
+COMMIT_SECONDS = metrics.histogram(
+  "db_group_commit_seconds", "Group commit transaction latency", ["writer"]
+)
+COMMIT_ITEMS = metrics.histogram(
+  "db_group_commit_items", "Items folded into one group commit", ["writer"], metrics.SIZE_BUCKETS
+)
+
+ApplyFn = Callable[[aiosqlite.Connection, List[Any]], Awaitable[List[Any]]]
+
+
+class GroupCommitWriter:
+  """Single writer task that folds concurrently submitted batches into one commit.
+
+  Callers submit a list of items and await their slice of the results. While a
+  transaction is in flight new submissions queue up, and the next transaction
+  takes all of them at once, so N concurrent batches cost one fsync.
+  """
+
+  def __init__(
+    self, pool_getter: Callable[[], Awaitable[ConnectionPool]], apply: ApplyFn,
+    max_items: int = 1000, name: str = "default",
+  ):
+    self.name = name
+    self._pool_getter = pool_getter
+    self._apply = apply
+    self._max_items = max_items
+    self._queue: asyncio.Queue = asyncio.Queue()
+    self._task: Optional[asyncio.Task] = None
+
+  async def submit(self, items: List[Any]) -> List[Any]:
+    return await self.enqueue(items)
+
+  def enqueue(self, items: List[Any]) -> asyncio.Future:
+    """Queue items without waiting; the future resolves to their results."""
+    future = asyncio.get_running_loop().create_future()
+    if not items:
+      future.set_result([])
+      return future
+    if self._task is None or self._task.done():
+      self._task = asyncio.create_task(self._run())
+    self._queue.put_nowait((items, future))
+    return future
+
+  async def close(self):
+    """Flush everything already submitted and stop the writer task."""
+    if self._task is None or self._task.done():
+      return
+    self._queue.put_nowait(None)
+    await self._task
+    self._task = None
+
+  async def _run(self):
+    while True:
+      job = await self._queue.get()
+      if job is None:
+        return
+
+      jobs = [job]
+      total = len(job[0])
+      stopping = False
+      while total < self._max_items and not self._queue.empty():
+        next_job = self._queue.get_nowait()
+        if next_job is None:
+          stopping = True
+          break
+        jobs.append(next_job)
+        total += len(next_job[0])
+
+      await self._commit(jobs)
+      if stopping:
+        return
+
+  async def _commit(self, jobs: list):
+    items = [item for job_items, _ in jobs for item in job_items]
+    COMMIT_ITEMS.observe(len(items), writer=self.name)
+    try:
+      pool = await self._pool_getter()
+      with COMMIT_SECONDS.time(writer=self.name):
+        async with pool.transaction() as db:
+          results = await self._apply(db, items)
+    except Exception as e:
+      logger.error(f"Group commit of {len(items)} rows failed: {e}")
+      for _, future in jobs:
+        if not future.done():
+          future.set_exception(e)
+      return
+
+    offset = 0
+    for job_items, future in jobs:
+      if not future.done():
+        future.set_result(results[offset : offset + len(job_items)])
+      offset += len(job_items)
+    if len(jobs) > 1:
+      logger.debug(f"Group commit: {len(jobs)} batches, {len(items)} rows")
@@ -1,24 +1,147 @@
-from typing import List, Optional, Tuple
+# Database module
+
+import heapq
+import itertools
+import re
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 
 import aiosqlite
 import numpy as np
 
-from config import DB_PATH
+from config import (
+  ANN_INDEX_DIR,
+  ANN_MIN_VECTORS,
+  ANN_NLIST,
+  ANN_NPROBE,
+  EMBEDDING_CODEC,
+  SEARCH_INDEX,
+  SEARCH_RERANK_CANDIDATES,
+  VECTOR_DIR,
+)
+from db.connection import ConnectionPool, close_pool, get_pool, open_pool
+from db.group_commit import GroupCommitWriter
+from db.vector_store import VectorStore, parse_store_key
+from utils import metrics
+from utils.executors import run_cpu
+from utils.logging import get_logger
+
+logger = get_logger("db")
+
+VECTOR_SEARCH_SECONDS = metrics.histogram(
+  "vector_search_seconds", "Vector similarity search latency across guild files"
+)
+LEXICAL_SEARCH_SECONDS = metrics.histogram(
+  "lexical_search_seconds", "FTS5 BM25 search latency"
+)
+
+MESSAGE_COLUMNS = (
+  "message_id",
+  "channel_id",
+  "guild_id",
+  "author_id",
+  "content",
+  "content_hash",
+  "embedding",
+  "message_url",
+)
+# The embedding itself goes to the guild's vector file, not the messages row.
+INSERT_COLUMNS = tuple(column for column in MESSAGE_COLUMNS if column != "embedding")
 
 
 async def init_db():
   import os
 
-  db_dir = os.path.dirname(DB_PATH)
-  if db_dir and not os.path.exists(db_dir):
-    os.makedirs(db_dir, exist_ok=True)
+  pool = await open_pool()
 
   schema_path = os.path.join(os.path.dirname(__file__), "schema.sql")
-  async with aiosqlite.connect(DB_PATH) as db:
-    with open(schema_path, "r") as f:
-      schema = f.read()
+  with open(schema_path, "r") as f:
+    schema = f.read()
+  async with pool.transaction() as db:
+    fts_existed = await _table_exists(db, "messages_fts")
     await db.executescript(schema)
-    await db.commit()
+    await _migrate_schema(db)
+    if not fts_existed:
+      # Index messages that were stored before the FTS table existed.
+      await db.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+  _vector_store.migrate_layout()
+  await _migrate_embedding_blobs(pool)
+  await _vector_store.migrate_codec()
+
+
+async def _table_exists(db: aiosqlite.Connection, name: str) -> bool:
+  async with db.execute(
+    "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+  ) as cursor:
+    return await cursor.fetchone() is not None
+
+
+async def _add_column(db: aiosqlite.Connection, table: str, column: str, decl: str):
+  async with db.execute(f"PRAGMA table_info({table})") as cursor:
+    columns = {row[1] for row in await cursor.fetchall()}
+  if column not in columns:
+    await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def _migrate_schema(db: aiosqlite.Connection):
+  await _add_column(db, "messages", "embedding_dim", "INTEGER")
+  await db.execute(
+    "CREATE INDEX IF NOT EXISTS idx_guild_embedding_dim ON messages(guild_id, embedding_dim)"
+  )
+  # Backfill pages through unembedded rows newest first.
+  await db.execute(
+    "CREATE INDEX IF NOT EXISTS idx_embedding_dim ON messages(embedding_dim, id)"
+  )
+
+
+async def _migrate_embedding_blobs(pool: ConnectionPool, batch_size: int = 1000):
+  """Move embeddings still stored as BLOBs in messages into the vector files."""
+  moved = 0
+  while True:
+    async with pool.reader() as db:
+      async with db.execute(
+        "SELECT id, guild_id, embedding FROM messages WHERE embedding IS NOT NULL ORDER BY id LIMIT ?",
+        (batch_size,),
+      ) as cursor:
+        rows = await cursor.fetchall()
+    if not rows:
+      break
+
+    stored = await _append_vectors(
+      [(row[1], row[0], np.frombuffer(row[2], dtype=np.float32)) for row in rows]
+    )
+    dims = {row_id: dim for row_id, (_, dim) in stored.items()}
+    try:
+      async with pool.transaction() as db:
+        await db.executemany(
+          "UPDATE messages SET embedding = NULL, embedding_dim = ? WHERE id = ?",
+          [(dims.get(row[0]), row[0]) for row in rows],
+        )
+    finally:
+      _confirm_vectors(stored)
+    moved += len(rows)
+
+  if moved:
+    logger.info(f"Moved {moved} embeddings from SQLite into {VECTOR_DIR}")
+    async with pool.transaction() as db:
+      await db.execute("VACUUM")
+
+
+async def close_db():
+  await _job_writer.close()
+  await _message_writer.close()
+  await _dim_writer.close()
+  await _vector_store.save_indexes()
+  await close_pool()
+
+
+async def _get_pool() -> ConnectionPool:
+  pool = get_pool()
+  if pool is None:
+    await init_db()
+    pool = get_pool()
+  return pool
 
 
 async def insert_message(
@@ -31,34 +154,245 @@ async def insert_message(
   embedding: Optional[bytes],
   message_url: str,
 ) -> bool:
-  async with aiosqlite.connect(DB_PATH) as db:
-    try:
-      await db.execute(
-        """
-                INSERT INTO messages 
-                (message_id, channel_id, guild_id, author_id, content, content_hash, embedding, message_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-        (
-          message_id,
-          channel_id,
-          guild_id,
-          author_id,
-          content,
-          content_hash,
-          embedding,
-          message_url,
-        ),
-      )
-      await db.commit()
-      return True
-    except aiosqlite.IntegrityError:
-      return False
+  results = await insert_messages_bulk(
+    [
+      {
+        "message_id": message_id,
+        "channel_id": channel_id,
+        "guild_id": guild_id,
+        "author_id": author_id,
+        "content": content,
+        "content_hash": content_hash,
+        "embedding": embedding,
+        "message_url": message_url,
+      }
+    ]
+  )
+  return results[0]
+
+
+async def insert_messages_bulk(rows: List[Dict]) -> List[bool]:
+  """Insert many messages in one group-committed transaction.
+
+  Each row is a dict keyed by MESSAGE_COLUMNS, plus an optional "job_id" of
+  the index_jobs row it completes. Returns, per row, whether it was inserted
+  (False when the message_id was already indexed or has been deleted).
+  """
+  if not rows:
+    return []
+  row_ids = await _message_writer.submit(rows)
+  try:
+    await _store_vectors(
+      [
+        (row["guild_id"], row_id, np.frombuffer(row["embedding"], dtype=np.float32))
+        for row, row_id in zip(rows, row_ids, strict=True)
+        if row_id is not None and row["embedding"] is not None
+      ]
+    )
+  except Exception as e:
+    # The rows stay unembedded, so the backfill embeds them again.
+    logger.error(f"Error storing vectors for {len(rows)} new messages: {e}")
+  _bump_index_version(
+    row["guild_id"] for row, row_id in zip(rows, row_ids, strict=True) if row_id is not None
+  )
+  return [row_id is not None for row_id in row_ids]
+
+
+# Per-guild versions, taken from one increasing counter after every committed
+# change to a guild's index so callers can key caches on them. The None entry
+# tracks changes anywhere, "*" the last reset of every guild.
+_index_versions: Dict[Optional[str], int] = {}
+_index_version_counter = itertools.count(1)
+
+
+def _bump_index_version(guild_ids: Iterable[Optional[str]]):
+  changed = set(guild_ids)
+  if changed:
+    version = next(_index_version_counter)
+    _index_versions.update((guild_id, version) for guild_id in changed | {None})
+
+
+def get_index_version(guild_id: Optional[str] = None) -> int:
+  """Changes when the guild's searchable messages do (any guild for None)."""
+  return max(_index_versions.get(guild_id, 0), _index_versions.get("*", 0))
+
+
+async def _append_vectors(
+  entries: List[Tuple[str, int, np.ndarray]],
+) -> Dict[int, Tuple[str, int]]:
+  """Append (guild_id, row id, vector) entries to the vector files.
+
+  Returns {row id: (guild_id, dim)} for the vectors that were stored. Never
+  call this while holding the writer: appends wait for the guild's vector
+  lock, and opening a guild's view under that lock reads the database.
+  """
+  groups: Dict[Tuple[str, int], Tuple[List[int], List[np.ndarray]]] = {}
+  for guild_id, row_id, vector in entries:
+    ids, vectors = groups.setdefault((guild_id, len(vector)), ([], []))
+    ids.append(row_id)
+    vectors.append(vector)
+
+  stored = {}
+  for (guild_id, dim), (ids, vectors) in groups.items():
+    kept = await _vector_store.append(guild_id, np.array(ids), np.stack(vectors))
+    stored.update((int(row_id), (guild_id, dim)) for row_id in kept)
+  return stored
+
+
+def _confirm_vectors(stored: Dict[int, Tuple[str, int]]):
+  groups: Dict[Tuple[str, int], List[int]] = {}
+  for row_id, key in stored.items():
+    groups.setdefault(key, []).append(row_id)
+  for (guild_id, dim), ids in groups.items():
+    _vector_store.confirm(guild_id, dim, np.array(ids, dtype=np.int64))
+
+
+async def _store_vectors(entries: List[Tuple[str, int, np.ndarray]]) -> Dict[int, int]:
+  """Append vectors for committed rows, then record their dims.
+
+  A row only counts as embedded once its vector is in the file, so a crash in
+  between leaves it for the backfill. Returns {row id: dim} of stored vectors.
+  """
+  stored = await _append_vectors(entries)
+  try:
+    await _dim_writer.submit([(dim, row_id) for row_id, (_, dim) in stored.items()])
+  finally:
+    _confirm_vectors(stored)
+  return {row_id: dim for row_id, (_, dim) in stored.items()}
+
+
+async def _set_embedding_dims(
+  db: aiosqlite.Connection, entries: List[Tuple[Optional[int], int]]
+) -> List[None]:
+  """Apply (dim, row id) pairs; a None dim marks the row as unembedded."""
+  await db.executemany("UPDATE messages SET embedding_dim = ? WHERE id = ?", entries)
+  return [None] * len(entries)
+
+
+async def _insert_rows(
+  db: aiosqlite.Connection, rows: List[Dict]
+) -> List[Optional[int]]:
+  message_ids = [row["message_id"] for row in rows]
+  seen = set()
+  for i in range(0, len(message_ids), 500):
+    chunk = message_ids[i : i + 500]
+    placeholders = ",".join("?" * len(chunk))
+    async with db.execute(
+      f"SELECT message_id FROM messages WHERE message_id IN ({placeholders}) "
+      f"UNION ALL SELECT message_id FROM message_tombstones "
+      f"WHERE message_id IN ({placeholders})",
+      chunk * 2,
+    ) as cursor:
+      seen.update(row[0] for row in await cursor.fetchall())
+
+  inserted = []
+  for message_id in message_ids:
+    inserted.append(message_id not in seen)
+    seen.add(message_id)
+
+  columns = ", ".join(INSERT_COLUMNS)
+  placeholders = ", ".join("?" * len(INSERT_COLUMNS))
+  await db.executemany(
+    f"INSERT INTO messages ({columns}) VALUES ({placeholders}) "
+    "ON CONFLICT(message_id) DO NOTHING",
+    [
+      tuple(row[column] for column in INSERT_COLUMNS)
+      for row, is_new in zip(rows, inserted, strict=True)
+      if is_new
+    ],
+  )
+
+  new_ids = [mid for mid, is_new in zip(message_ids, inserted, strict=True) if is_new]
+  row_ids = {}
+  for i in range(0, len(new_ids), 500):
+    chunk = new_ids[i : i + 500]
+    placeholders = ",".join("?" * len(chunk))
+    async with db.execute(
+      f"SELECT id, message_id FROM messages WHERE message_id IN ({placeholders})",
+      chunk,
+    ) as cursor:
+      row_ids.update({row[1]: row[0] for row in await cursor.fetchall()})
+
+  results = [
+    row_ids.get(mid) if is_new else None
+    for mid, is_new in zip(message_ids, inserted, strict=True)
+  ]
+
+  job_ids = [(row["job_id"],) for row in rows if row.get("job_id")]
+  if job_ids:
+    await db.executemany("DELETE FROM index_jobs WHERE id = ?", job_ids)
+  # Vectors are appended by insert_messages_bulk once this has committed.
+  return results
+
+
+async def _live_vector_ids(guild_id: str, dim: int, file_ids: np.ndarray) -> np.ndarray:
+  """Row ids embedded at `dim` for a guild, reconciled against its vector file.
+
+  Rows marked embedded whose vector never reached the file are queued to be
+  reset to unembedded so they can be embedded again. This runs under the
+  guild's vector lock, so it must not wait on the writer.
+  """
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    async with db.execute(
+      "SELECT id FROM messages WHERE guild_id = ? AND embedding_dim = ?",
+      (guild_id, dim),
+    ) as cursor:
+      rows = await cursor.fetchall()
+  live = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+
+  missing = live[~np.isin(live, file_ids)]
+  if len(missing):
+    logger.warning(f"{len(missing)} rows in guild {guild_id} lost their {dim}-dim vectors")
+    reset = _dim_writer.enqueue([(None, int(row_id)) for row_id in missing])
+    # The writer logs failures; the next open finds the rows again.
+    reset.add_done_callback(lambda future: future.cancelled() or future.exception())
+    live = live[np.isin(live, file_ids)]
+  return live
+
+
+INDEX_JOB_COLUMNS = (
+  "priority",
+  "message_id",
+  "channel_id",
+  "guild_id",
+  "author_id",
+  "author_name",
+  "content",
+  "content_hash",
+  "message_url",
+)
+
+
+async def _insert_jobs(db: aiosqlite.Connection, jobs: List[Dict]) -> List[int]:
+  columns = ", ".join(INDEX_JOB_COLUMNS)
+  placeholders = ", ".join("?" * len(INDEX_JOB_COLUMNS))
+  await db.executemany(
+    f"INSERT INTO index_jobs ({columns}) VALUES ({placeholders})",
+    [tuple(job[column] for column in INDEX_JOB_COLUMNS) for job in jobs],
+  )
+  # The single writer makes this transaction's AUTOINCREMENT ids consecutive.
+  async with db.execute("SELECT last_insert_rowid()") as cursor:
+    last_id = (await cursor.fetchone())[0]
+  return list(range(last_id - len(jobs) + 1, last_id + 1))
+
+
+_message_writer = GroupCommitWriter(_get_pool, _insert_rows, name="messages")
+_job_writer = GroupCommitWriter(_get_pool, _insert_jobs, name="index_jobs")
+_dim_writer = GroupCommitWriter(_get_pool, _set_embedding_dims, name="embedding_dims")
+_vector_store = VectorStore(
+  VECTOR_DIR,
+  _live_vector_ids,
+  codec=EMBEDDING_CODEC,
+  index_dir=ANN_INDEX_DIR if SEARCH_INDEX == "ivf" else None,
+  ann_min_vectors=ANN_MIN_VECTORS,
+  ann_nlist=ANN_NLIST,
+)
 
 
 async def get_message_by_hash(content_hash: str) -> Optional[dict]:
-  async with aiosqlite.connect(DB_PATH) as db:
-    db.row_factory = aiosqlite.Row
+  pool = await _get_pool()
+  async with pool.reader() as db:
     async with db.execute(
       "SELECT * FROM messages WHERE content_hash = ?", (content_hash,)
     ) as cursor:
@@ -72,7 +406,8 @@ async def get_existing_hashes(content_hashes: List[str]) -> set:
   if not content_hashes:
     return set()
 
-  async with aiosqlite.connect(DB_PATH) as db:
+  pool = await _get_pool()
+  async with pool.reader() as db:
     placeholders = ",".join("?" * len(content_hashes))
     async with db.execute(
       f"SELECT content_hash FROM messages WHERE content_hash IN ({placeholders})",
@@ -82,62 +417,186 @@ async def get_existing_hashes(content_hashes: List[str]) -> set:
       return {row[0] for row in rows}
 
 
+async def get_embeddings_by_hash(content_hashes: List[str], dim: int) -> Dict[str, bytes]:
+  """Stored `dim` embeddings for content already indexed anywhere, by content hash.
+
+  Identical text embeds identically, so a vector stored for one message can be
+  reused for any other message with the same hash, in any guild.
+  """
+  if not content_hashes:
+    return {}
+
+  pool = await _get_pool()
+  sources: Dict[str, Dict[int, str]] = {}
+  unique_hashes = list(dict.fromkeys(content_hashes))
+  async with pool.reader() as db:
+    for i in range(0, len(unique_hashes), 500):
+      chunk = unique_hashes[i : i + 500]
+      placeholders = ",".join("?" * len(chunk))
+      async with db.execute(
+        f"SELECT content_hash, guild_id, id FROM messages "
+        f"WHERE content_hash IN ({placeholders}) AND embedding_dim = ?",
+        (*chunk, dim),
+      ) as cursor:
+        for content_hash, guild_id, row_id in await cursor.fetchall():
+          sources.setdefault(guild_id, {})[row_id] = content_hash
+
+  embeddings = {}
+  for guild_id, hashes_by_row in sources.items():
+    guild_vectors = await _vector_store.get(guild_id, dim)
+    if guild_vectors is None:
+      continue
+    vectors = await run_cpu(guild_vectors.vectors_for, list(hashes_by_row))
+    for row_id, vector in vectors.items():
+      embeddings.setdefault(hashes_by_row[row_id], vector.tobytes())
+  return embeddings
+
+
 async def get_all_embeddings_with_content(
   guild_id: Optional[str] = None,
 ) -> List[Tuple[int, bytes, str, str]]:
-  """Returns list of (id, embedding, message_url, content)."""
-  async with aiosqlite.connect(DB_PATH) as db:
-    if guild_id:
-      async with db.execute(
-        "SELECT id, embedding, message_url, content FROM messages WHERE guild_id = ? AND embedding IS NOT NULL",
-        (guild_id,),
-      ) as cursor:
-        rows = await cursor.fetchall()
-    else:
-      async with db.execute(
-        "SELECT id, embedding, message_url, content FROM messages WHERE embedding IS NOT NULL"
-      ) as cursor:
-        rows = await cursor.fetchall()
+  """Returns list of (id, embedding, message_url, content).
 
-    return [(row[0], row[1], row[2], row[3]) for row in rows]
+  Embeddings come back as unit-length float32 bytes from the vector files.
+  Prefer iter_embeddings_with_content, which holds one chunk at a time.
+  """
+  results = []
+  async for chunk in iter_embeddings_with_content(guild_id):
+    results.extend(chunk)
+  return results
+
+
+async def iter_embeddings_with_content(
+  guild_id: Optional[str] = None, chunk_size: int = 500
+) -> AsyncIterator[List[Tuple[int, bytes, str, str]]]:
+  """Yield (id, embedding, message_url, content) rows `chunk_size` at a time."""
+  guild_ids = [guild_id] if guild_id else _vector_store.guild_ids()
+  for gid in guild_ids:
+    for dim in _vector_store.dims(gid):
+      guild_vectors = await _vector_store.get(gid, dim)
+      if guild_vectors is None:
+        continue
+      live_rows = guild_vectors.live_rows()
+      for i in range(0, len(live_rows), chunk_size):
+        chunk = live_rows[i : i + chunk_size]
+        decoded = await run_cpu(guild_vectors.decoded, [position for position, _ in chunk])
+        rows = await _get_url_and_content([row_id for _, row_id in chunk])
+        yield [
+          (row_id, decoded[j].tobytes(), rows[row_id][0], rows[row_id][1])
+          for j, (_, row_id) in enumerate(chunk)
+          if row_id in rows
+        ]
 
 
 async def search_similar_messages(
-  query_embedding: np.ndarray, guild_id: Optional[str] = None, limit: int = 10
+  query_embedding: np.ndarray,
+  guild_id: Optional[str] = None,
+  limit: int = 10,
+  exact: bool = False,
 ) -> List[Tuple[str, str, float]]:
-  """Returns list of (message_url, content, similarity_score)."""
-  embeddings_data = await get_all_embeddings_with_content(guild_id)
+  """Returns list of (message_url, content, similarity_score).
 
-  if not embeddings_data:
-    return []
-
-  similarities = []
+  Uses the guild's IVF index when SEARCH_INDEX is "ivf" and one is ready;
+  `exact=True` forces the brute-force scan.
+  """
+  query_embedding = np.asarray(query_embedding, dtype=np.float32)
   query_norm = np.linalg.norm(query_embedding)
 
   if query_norm == 0:
     return []
 
-  for _, embedding_blob, message_url, content in embeddings_data:
-    stored_embedding = np.frombuffer(embedding_blob, dtype=np.float32)
+  start = time.perf_counter()
+  query_unit = query_embedding / query_norm
+  nprobe = None if exact or SEARCH_INDEX != "ivf" else ANN_NPROBE
+  # Only vectors of the query's own dimension are comparable with it.
+  dim = query_unit.shape[0]
+  guild_ids = [guild_id] if guild_id else _vector_store.guild_ids(dim)
+
+  # Running top-k across guilds; content is fetched only for the winners.
+  hits: List[Tuple[int, float]] = []
+  for gid in guild_ids:
+    guild_vectors = await _vector_store.get(gid, dim)
+    if guild_vectors is not None:
+      guild_hits = await run_cpu(
+        guild_vectors.search,
+        query_unit,
+        limit,
+        nprobe=nprobe,
+        rerank=SEARCH_RERANK_CANDIDATES,
+      )
+      hits = heapq.nlargest(limit, hits + guild_hits, key=lambda hit: hit[1])
+  VECTOR_SEARCH_SECONDS.observe(time.perf_counter() - start)
+
+  if not hits:
+    return []
+
+  rows = await _get_url_and_content([row_id for row_id, _ in hits])
+  return [
+    (rows[row_id][0], rows[row_id][1], score)
+    for row_id, score in hits
+    if row_id in rows
+  ]
 
-    dot_product = np.dot(query_embedding, stored_embedding)
-    stored_norm = np.linalg.norm(stored_embedding)
 
-    if stored_norm == 0:
-      continue
+async def _get_url_and_content(row_ids: List[int]) -> Dict[int, Tuple[str, str]]:
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    placeholders = ",".join("?" * len(row_ids))
+    async with db.execute(
+      f"SELECT id, message_url, content FROM messages WHERE id IN ({placeholders})",
+      row_ids,
+    ) as cursor:
+      return {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
 
-    similarity = dot_product / (query_norm * stored_norm)
-    similarities.append((message_url, content, float(similarity)))
 
-  similarities.sort(key=lambda x: x[2], reverse=True)
-  return similarities[:limit]
+def _fts_query(text: str) -> str:
+  """Turn free text into an FTS5 query matching any of its words."""
+  terms = re.findall(r"\w+", text.lower())
+  return " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+
+
+async def search_lexical(
+  query: str, guild_id: Optional[str] = None, limit: int = 10
+) -> List[Tuple[str, str, float]]:
+  """BM25 full-text search. Returns list of (message_url, content, score).
+
+  Scores are relative to the best match (1.0) so they read like percentages.
+  """
+  match = _fts_query(query)
+  if not match:
+    return []
+
+  sql = (
+    "SELECT m.message_url, m.content, bm25(messages_fts) AS rank "
+    "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+    "WHERE messages_fts MATCH ?"
+  )
+  params: list = [match]
+  if guild_id:
+    sql += " AND m.guild_id = ?"
+    params.append(guild_id)
+  sql += " ORDER BY rank LIMIT ?"
+  params.append(limit)
+
+  pool = await _get_pool()
+  with LEXICAL_SEARCH_SECONDS.time():
+    async with pool.reader() as db:
+      async with db.execute(sql, params) as cursor:
+        rows = await cursor.fetchall()
+
+  if not rows:
+    return []
+  # bm25() is negative with better matches more negative; rows come best first.
+  best = rows[0][2] or -1.0
+  return [(row[0], row[1], row[2] / best) for row in rows]
 
 
 async def get_message_urls(message_ids: List[int]) -> List[str]:
   if not message_ids:
     return []
 
-  async with aiosqlite.connect(DB_PATH) as db:
+  pool = await _get_pool()
+  async with pool.reader() as db:
     placeholders = ",".join("?" * len(message_ids))
     async with db.execute(
       f"SELECT message_url FROM messages WHERE id IN ({placeholders})",
@@ -148,21 +607,30 @@ async def get_message_urls(message_ids: List[int]) -> List[str]:
 
 
 async def reset_database(guild_id: Optional[str] = None) -> int:
-  async with aiosqlite.connect(DB_PATH) as db:
-    if guild_id:
-      async with db.execute(
-        "DELETE FROM messages WHERE guild_id = ?", (guild_id,)
-      ) as cursor:
-        await db.commit()
-        return cursor.rowcount
-    else:
-      async with db.execute("DELETE FROM messages") as cursor:
-        await db.commit()
-        return cursor.rowcount
+  pool = await _get_pool()
+  try:
+    async with pool.transaction() as db:
+      # Crawl checkpoints describe what is indexed, so they go with the rows.
+      if guild_id:
+        await db.execute(
+          "DELETE FROM crawl_checkpoints WHERE guild_id = ?", (guild_id,)
+        )
+        async with db.execute(
+          "DELETE FROM messages WHERE guild_id = ?", (guild_id,)
+        ) as cursor:
+          return cursor.rowcount
+      else:
+        await db.execute("DELETE FROM crawl_checkpoints")
+        async with db.execute("DELETE FROM messages") as cursor:
+          return cursor.rowcount
+  finally:
+    await _vector_store.remove(guild_id)
+    _bump_index_version([guild_id or "*"])
 
 
 async def get_message_count(guild_id: Optional[str] = None) -> int:
-  async with aiosqlite.connect(DB_PATH) as db:
+  pool = await _get_pool()
+  async with pool.reader() as db:
     if guild_id:
       async with db.execute(
         "SELECT COUNT(*) FROM messages WHERE guild_id = ?", (guild_id,)
@@ -176,37 +644,388 @@ async def get_message_count(guild_id: Optional[str] = None) -> int:
 
 
 async def get_messages_without_embeddings(
-  guild_id: Optional[str] = None, limit: Optional[int] = None
+  guild_id: Optional[str] = None,
+  limit: Optional[int] = None,
+  before_id: Optional[int] = None,
 ) -> List[dict]:
-  async with aiosqlite.connect(DB_PATH) as db:
-    db.row_factory = aiosqlite.Row
-    query = "SELECT id, message_id, content FROM messages WHERE embedding IS NULL"
+  """Unembedded messages, newest first; `before_id` pages past earlier results."""
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    query = (
+      "SELECT id, message_id, content, content_hash FROM messages "
+      "WHERE embedding_dim IS NULL"
+    )
     params = []
-    
+
     if guild_id:
       query += " AND guild_id = ?"
       params.append(guild_id)
-    
-    query += " ORDER BY created_at DESC"
-    
+
+    if before_id is not None:
+      query += " AND id < ?"
+      params.append(before_id)
+
+    query += " ORDER BY id DESC"
+
     if limit:
       query += " LIMIT ?"
       params.append(limit)
-    
+
     async with db.execute(query, params) as cursor:
       rows = await cursor.fetchall()
       return [dict(row) for row in rows]
 
 
+async def count_messages_without_embeddings(guild_id: Optional[str] = None) -> int:
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    if guild_id:
+      async with db.execute(
+        "SELECT COUNT(*) FROM messages WHERE embedding_dim IS NULL AND guild_id = ?",
+        (guild_id,),
+      ) as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+    else:
+      async with db.execute(
+        "SELECT COUNT(*) FROM messages WHERE embedding_dim IS NULL"
+      ) as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+
 async def update_message_embedding(message_id: str, embedding: bytes) -> bool:
-  async with aiosqlite.connect(DB_PATH) as db:
-    try:
-      await db.execute(
-        "UPDATE messages SET embedding = ? WHERE message_id = ?",
-        (embedding, message_id),
-      )
-      await db.commit()
-      return True
-    except Exception as e:
-      print(f"Error updating embedding for message {message_id}: {e}")
-      return False
+  return await update_message_embeddings([(message_id, embedding)]) == 1
+
+
+async def update_message_embeddings(entries: List[Tuple[str, bytes]]) -> int:
+  """Store new embeddings for existing messages in one transaction.
+
+  Takes (message_id, embedding bytes) pairs; returns how many were stored.
+  """
+  if not entries:
+    return 0
+
+  pool = await _get_pool()
+  embeddings = dict(entries)
+  try:
+    async with pool.reader() as db:
+      message_ids = list(embeddings)
+      rows = []
+      for i in range(0, len(message_ids), 500):
+        chunk = message_ids[i : i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        async with db.execute(
+          f"SELECT id, guild_id, message_id FROM messages WHERE message_id IN ({placeholders})",
+          chunk,
+        ) as cursor:
+          rows.extend(await cursor.fetchall())
+
+    stored = await _store_vectors(
+      [
+        (row[1], row[0], np.frombuffer(embeddings[row[2]], dtype=np.float32))
+        for row in rows
+      ]
+    )
+    _bump_index_version(row[1] for row in rows if row[0] in stored)
+    return len(stored)
+  except Exception as e:
+    logger.error(f"Error updating {len(entries)} embeddings: {e}")
+    return 0
+
+
+async def get_messages_to_reembed(
+  dim: int, limit: int, before_id: Optional[int] = None
+) -> List[dict]:
+  """Newest messages whose stored embedding has a dimension other than `dim`."""
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    async with db.execute(
+      "SELECT id, message_id, content, content_hash FROM messages "
+      "WHERE embedding_dim IS NOT NULL AND embedding_dim != ? AND id < ? "
+      "ORDER BY id DESC LIMIT ?",
+      (dim, before_id if before_id is not None else 2**63 - 1, limit),
+    ) as cursor:
+      return [dict(row) for row in await cursor.fetchall()]
+
+
+async def count_messages_to_reembed(dim: int) -> int:
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    async with db.execute(
+      "SELECT COUNT(*) FROM messages WHERE embedding_dim IS NOT NULL AND embedding_dim != ?",
+      (dim,),
+    ) as cursor:
+      row = await cursor.fetchone()
+      return row[0] if row else 0
+
+
+async def prune_vector_files(dim: int) -> int:
+  """Delete vector files at other dimensions that no message points at any more."""
+  pool = await _get_pool()
+  removed = 0
+  for key in _vector_store.keys():
+    guild_id, key_dim = parse_store_key(key)
+    if key_dim == dim:
+      continue
+    async with pool.reader() as db:
+      async with db.execute(
+        "SELECT 1 FROM messages WHERE guild_id = ? AND embedding_dim = ? LIMIT 1",
+        (guild_id, key_dim),
+      ) as cursor:
+        in_use = await cursor.fetchone()
+    if not in_use:
+      await _vector_store.remove(guild_id, key_dim)
+      removed += 1
+  return removed
+
+
+async def save_conversation_turns(turns: List[Dict]):
+  """Upsert turns keyed by message_id, channel_id, author_id, author_name,
+  content and reply_to_id."""
+  if not turns:
+    return
+  pool = await _get_pool()
+  async with pool.transaction() as db:
+    await db.executemany(
+      "INSERT INTO conversation_turns "
+      "(message_id, channel_id, author_id, author_name, content, reply_to_id) "
+      "VALUES (:message_id, :channel_id, :author_id, :author_name, :content, :reply_to_id) "
+      "ON CONFLICT(message_id) DO UPDATE SET content = excluded.content",
+      turns,
+    )
+
+
+async def get_conversation_turn(message_id: str) -> Optional[dict]:
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    async with db.execute(
+      "SELECT * FROM conversation_turns WHERE message_id = ?", (message_id,)
+    ) as cursor:
+      row = await cursor.fetchone()
+      return dict(row) if row else None
+
+
+async def enqueue_index_jobs(jobs: List[Dict]) -> List[int]:
+  """Durably queue messages for indexing (group-committed); returns job ids.
+
+  Each job is a dict keyed by INDEX_JOB_COLUMNS. Jobs are deleted when the
+  message row is stored (see insert_messages_bulk's "job_id").
+  """
+  return await _job_writer.submit(jobs)
+
+
+async def get_index_jobs(priority: int, after_id: int, limit: int) -> List[dict]:
+  """Pending jobs of one priority in queue order, starting after `after_id`."""
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    async with db.execute(
+      "SELECT * FROM index_jobs WHERE priority = ? AND id > ? ORDER BY id LIMIT ?",
+      (priority, after_id, limit),
+    ) as cursor:
+      return [dict(row) for row in await cursor.fetchall()]
+
+
+async def update_index_job_contents(
+  edits: List[Tuple[str, str, str]],
+) -> Dict[str, List[int]]:
+  """Apply (message_id, content, content_hash) edits to messages still waiting
+  in index_jobs, so they get indexed with their new text.
+
+  Returns the ids of the updated jobs by message id.
+  """
+  if not edits:
+    return {}
+
+  pool = await _get_pool()
+  jobs: Dict[str, List[int]] = {}
+  async with pool.transaction() as db:
+    await db.executemany(
+      "UPDATE index_jobs SET content = ?, content_hash = ? WHERE message_id = ?",
+      [(content, content_hash, message_id) for message_id, content, content_hash in edits],
+    )
+    message_ids = [message_id for message_id, _, _ in edits]
+    for i in range(0, len(message_ids), 500):
+      chunk = message_ids[i : i + 500]
+      placeholders = ",".join("?" * len(chunk))
+      async with db.execute(
+        f"SELECT id, message_id FROM index_jobs WHERE message_id IN ({placeholders})",
+        chunk,
+      ) as cursor:
+        for job_id, message_id in await cursor.fetchall():
+          jobs.setdefault(message_id, []).append(job_id)
+  return jobs
+
+
+async def count_index_jobs() -> int:
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    async with db.execute("SELECT COUNT(*) FROM index_jobs") as cursor:
+      row = await cursor.fetchone()
+      return row[0] if row else 0
+
+
+async def get_crawl_checkpoints(guild_id: str) -> Dict[str, dict]:
+  """Crawl checkpoints for a guild's channels and threads, keyed by channel_id."""
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    async with db.execute(
+      "SELECT * FROM crawl_checkpoints WHERE guild_id = ?", (guild_id,)
+    ) as cursor:
+      return {row["channel_id"]: dict(row) for row in await cursor.fetchall()}
+
+
+async def save_crawl_checkpoint(
+  channel_id: str,
+  guild_id: str,
+  oldest_id: Optional[str],
+  newest_id: Optional[str],
+  complete: bool,
+):
+  pool = await _get_pool()
+  async with pool.transaction() as db:
+    await db.execute(
+      "INSERT INTO crawl_checkpoints "
+      "(channel_id, guild_id, oldest_id, newest_id, complete, updated_at) "
+      "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP) "
+      "ON CONFLICT(channel_id) DO UPDATE SET oldest_id = excluded.oldest_id, "
+      "newest_id = excluded.newest_id, complete = excluded.complete, "
+      "updated_at = excluded.updated_at",
+      (channel_id, guild_id, oldest_id, newest_id, int(complete)),
+    )
+
+
+async def clear_crawl_checkpoints(guild_id: str) -> int:
+  pool = await _get_pool()
+  async with pool.transaction() as db:
+    async with db.execute(
+      "DELETE FROM crawl_checkpoints WHERE guild_id = ?", (guild_id,)
+    ) as cursor:
+      return cursor.rowcount
+
+
+async def get_channel_id_ranges(
+  guild_id: str, before_id: Optional[int] = None
+) -> Dict[str, Tuple[int, int]]:
+  """Oldest and newest indexed message id per channel, ignoring ids >= `before_id`."""
+  pool = await _get_pool()
+  async with pool.reader() as db:
+    query = (
+      "SELECT channel_id, MIN(CAST(message_id AS INTEGER)), "
+      "MAX(CAST(message_id AS INTEGER)) FROM messages WHERE guild_id = ?"
+    )
+    params: list = [guild_id]
+    if before_id is not None:
+      query += " AND CAST(message_id AS INTEGER) < ?"
+      params.append(before_id)
+    async with db.execute(query + " GROUP BY channel_id", params) as cursor:
+      return {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+
+
+async def delete_messages(message_ids: List[str]) -> int:
+  """Remove deleted Discord messages from the index in one transaction.
+
+  Each id gets a tombstone so queued jobs cannot re-insert it; the vectors
+  stay in their files, masked out, until compaction drops them. Returns how
+  many indexed messages were removed.
+  """
+  if not message_ids:
+    return 0
+
+  pool = await _get_pool()
+  rows = []
+  async with pool.transaction() as db:
+    await db.executemany(
+      "INSERT OR IGNORE INTO message_tombstones (message_id) VALUES (?)",
+      [(message_id,) for message_id in message_ids],
+    )
+    for i in range(0, len(message_ids), 500):
+      chunk = message_ids[i : i + 500]
+      placeholders = ",".join("?" * len(chunk))
+      async with db.execute(
+        f"SELECT id, guild_id FROM messages WHERE message_id IN ({placeholders})",
+        chunk,
+      ) as cursor:
+        rows.extend(await cursor.fetchall())
+      await db.execute(f"DELETE FROM messages WHERE message_id IN ({placeholders})", chunk)
+      await db.execute(f"DELETE FROM index_jobs WHERE message_id IN ({placeholders})", chunk)
+
+  by_guild: Dict[str, List[int]] = {}
+  for row_id, guild_id in rows:
+    by_guild.setdefault(guild_id, []).append(row_id)
+  for guild_id, row_ids in by_guild.items():
+    _vector_store.discard(guild_id, np.array(row_ids, dtype=np.int64))
+  _bump_index_version(by_guild)
+  return len(rows)
+
+
+async def update_message_contents(
+  edits: List[Tuple[str, str, str]],
+) -> Tuple[List[dict], List[str]]:
+  """Apply (message_id, content, content_hash) edits to indexed messages.
+
+  Only messages whose content hash changed are touched: their content is
+  replaced and their vector masked out until they are re-embedded. Returns
+  those rows (id, message_id, guild_id, content, content_hash) and the ids of
+  edited messages that are not indexed.
+  """
+  if not edits:
+    return [], []
+
+  pool = await _get_pool()
+  new_content = {
+    message_id: (content, content_hash) for message_id, content, content_hash in edits
+  }
+  changed = []
+  found = set()
+  async with pool.transaction() as db:
+    message_ids = list(new_content)
+    for i in range(0, len(message_ids), 500):
+      chunk = message_ids[i : i + 500]
+      placeholders = ",".join("?" * len(chunk))
+      async with db.execute(
+        f"SELECT id, message_id, guild_id, content_hash FROM messages "
+        f"WHERE message_id IN ({placeholders})",
+        chunk,
+      ) as cursor:
+        for row in await cursor.fetchall():
+          found.add(row["message_id"])
+          content, content_hash = new_content[row["message_id"]]
+          if content_hash != row["content_hash"]:
+            changed.append(
+              {
+                "id": row["id"],
+                "message_id": row["message_id"],
+                "guild_id": row["guild_id"],
+                "content": content,
+                "content_hash": content_hash,
+              }
+            )
+    await db.executemany(
+      "UPDATE messages SET content = ?, content_hash = ?, embedding_dim = NULL WHERE id = ?",
+      [(row["content"], row["content_hash"], row["id"]) for row in changed],
+    )
+
+  by_guild: Dict[str, List[int]] = {}
+  for row in changed:
+    by_guild.setdefault(row["guild_id"], []).append(row["id"])
+  for guild_id, row_ids in by_guild.items():
+    _vector_store.discard(guild_id, np.array(row_ids, dtype=np.int64))
+  _bump_index_version(by_guild)
+  return changed, [message_id for message_id in new_content if message_id not in found]
+
+
+async def compact_index(tombstone_retention: float, min_dead_fraction: float) -> Tuple[int, int]:
+  """Drop tombstones older than `tombstone_retention` seconds and rewrite vector
+  files that are at least `min_dead_fraction` dead rows.
+
+  Returns (tombstones removed, vector files compacted).
+  """
+  pool = await _get_pool()
+  async with pool.transaction() as db:
+    async with db.execute(
+      "DELETE FROM message_tombstones WHERE deleted_at < datetime('now', ?)",
+      (f"-{int(tombstone_retention)} seconds",),
+    ) as cursor:
+      removed = cursor.rowcount
+  return removed, await _vector_store.compact(min_dead_fraction)
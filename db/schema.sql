@@ -6,7 +6,8 @@ CREATE TABLE IF NOT EXISTS messages (
     author_id TEXT NOT NULL,
     content TEXT NOT NULL,
     content_hash TEXT NOT NULL,
-    embedding BLOB,
+    embedding BLOB, -- legacy; vectors now live in VECTOR_DIR files
+    embedding_dim INTEGER, -- set once the vector is stored
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     message_url TEXT NOT NULL
 );
@@ -15,3 +16,75 @@ CREATE INDEX IF NOT EXISTS idx_content_hash ON messages(content_hash);
 CREATE INDEX IF NOT EXISTS idx_guild_id ON messages(guild_id);
 CREATE INDEX IF NOT EXISTS idx_created_at ON messages(created_at);
 CREATE INDEX IF NOT EXISTS idx_message_id ON messages(message_id);
+
+-- Full-text index over message content, kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content='messages',
+    content_rowid='id',
+    tokenize="unicode61 tokenchars '_'"
+);
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+END;
+
+-- Bot conversation turns (the bot's replies and the messages that prompted
+-- them), so reply chains can be rebuilt without fetching from Discord
+CREATE TABLE IF NOT EXISTS conversation_turns (
+    message_id TEXT PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    author_id TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    reply_to_id TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Messages waiting to be indexed; rows are removed in the same transaction
+-- that stores the message, and replayed on startup
+CREATE TABLE IF NOT EXISTS index_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    priority INTEGER NOT NULL,
+    message_id TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    guild_id TEXT NOT NULL,
+    author_id TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    content TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    message_url TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_index_jobs_priority ON index_jobs(priority, id);
+-- Edits to messages that are still waiting to be indexed
+CREATE INDEX IF NOT EXISTS idx_index_jobs_message ON index_jobs(message_id);
+
+-- History crawl progress per channel or thread: the oldest and newest message
+-- ids queued so far; `complete` once the crawl reached the channel's start
+CREATE TABLE IF NOT EXISTS crawl_checkpoints (
+    channel_id TEXT PRIMARY KEY,
+    guild_id TEXT NOT NULL,
+    oldest_id TEXT,
+    newest_id TEXT,
+    complete INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_crawl_checkpoints_guild ON crawl_checkpoints(guild_id);
+
+-- Deleted message ids, kept for a while so queued index jobs and re-crawls
+-- cannot bring deleted messages back; old tombstones are compacted away
+CREATE TABLE IF NOT EXISTS message_tombstones (
+    message_id TEXT PRIMARY KEY,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,244 @@
+import os
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"LCJVEC01"
+HEADER_FORMAT = "<8sII"  # magic, dim, codec id
+HEADER_SIZE = 64
+CODECS = {0: "float32", 1: "float16", 2: "int8"}
+CODEC_IDS = {codec: code for code, codec in CODECS.items()}
+CODEC_DTYPES = {
+  "float32": np.dtype("<f4"),
+  "float16": np.dtype("<f2"),
+  "int8": np.dtype("i1"),
+}
+
+# Compacted copies are written as `<name>.vec.compact` etc.; `<name>.compacted`
+# marks them complete and ready to replace the originals.
+COMPACT_SUFFIX = ".compact"
+COMPACT_MARKER = ".compacted"
+
+
+def _finish_compaction(base_path: str):
+  """Swap in a finished compaction, or discard one a crash left half-written."""
+  marker = f"{base_path}{COMPACT_MARKER}"
+  complete = os.path.exists(marker)
+  for suffix in (".vec", ".ids", ".scale"):
+    compacted = f"{base_path}{suffix}{COMPACT_SUFFIX}"
+    if not os.path.exists(compacted):
+      continue
+    if complete:
+      os.replace(compacted, f"{base_path}{suffix}")
+    else:
+      os.remove(compacted)
+  if complete:
+    os.remove(marker)
+
+
+def encode(vectors: np.ndarray, codec: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+  """Encode float32 rows; int8 uses a per-row scale so max |x| maps to 127."""
+  vectors = np.asarray(vectors, dtype=np.float32)
+  if codec != "int8":
+    return vectors.astype(CODEC_DTYPES[codec]), None
+  scales = np.abs(vectors).max(axis=1) / 127.0
+  scales[scales == 0] = 1.0
+  codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+  return codes, scales.astype(np.float32)
+
+
+def decode(rows: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+  decoded = np.asarray(rows, dtype=np.float32)
+  if scales is not None:
+    decoded = decoded * np.asarray(scales, dtype=np.float32)[:, None]
+  return decoded
+
+
+class VectorFile:
+  """Append-only, memory-mapped embedding file for one guild.
+
+  `<name>.vec` holds a fixed header (dim, codec) followed by fixed-stride
+  vector rows; `<name>.ids` holds the parallel messages.id rowids and, for the
+  int8 codec, `<name>.scale` the per-row float32 scales. Readers get zero-copy
+  np.memmap views, so opening a file costs no load time and only the pages a
+  search touches are resident.
+  """
+
+  def __init__(self, base_path: str, dim: int, codec: str = "float32"):
+    self.base_path = base_path
+    self.dim = dim
+    self.codec = codec
+    self.dtype = CODEC_DTYPES[codec]
+    self.count = 0
+    self._view: Optional[Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]] = None
+
+  @property
+  def vec_path(self) -> str:
+    return f"{self.base_path}.vec"
+
+  @property
+  def ids_path(self) -> str:
+    return f"{self.base_path}.ids"
+
+  @property
+  def scale_path(self) -> str:
+    return f"{self.base_path}.scale"
+
+  @property
+  def has_scales(self) -> bool:
+    return self.codec == "int8"
+
+  @property
+  def row_bytes(self) -> int:
+    return self.dim * self.dtype.itemsize
+
+  @classmethod
+  def open(cls, base_path: str) -> Optional["VectorFile"]:
+    _finish_compaction(base_path)
+    if not os.path.exists(f"{base_path}.vec"):
+      return None
+    with open(f"{base_path}.vec", "rb") as f:
+      magic, dim, codec_id = struct.unpack_from(HEADER_FORMAT, f.read(HEADER_SIZE))
+    if magic != MAGIC or codec_id not in CODECS:
+      raise ValueError(f"{base_path}.vec is not a vector file")
+    vector_file = cls(base_path, dim, CODECS[codec_id])
+    vector_file._recover()
+    return vector_file
+
+  @classmethod
+  def create(cls, base_path: str, dim: int, codec: str = "float32") -> "VectorFile":
+    os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+    vector_file = cls(base_path, dim, codec)
+    vector_file._write_header(vector_file.vec_path)
+    with open(vector_file.ids_path, "wb"):
+      pass
+    if vector_file.has_scales:
+      with open(vector_file.scale_path, "wb"):
+        pass
+    return vector_file
+
+  def _write_header(self, path: str):
+    header = struct.pack(HEADER_FORMAT, MAGIC, self.dim, CODEC_IDS[self.codec])
+    with open(path, "wb") as f:
+      f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+  def _recover(self):
+    """Drop a torn trailing row left by a crash between the two appends."""
+    vec_rows = (os.path.getsize(self.vec_path) - HEADER_SIZE) // self.row_bytes
+    id_rows = os.path.getsize(self.ids_path) // 8 if os.path.exists(self.ids_path) else 0
+    self.count = min(vec_rows, id_rows)
+    if self.has_scales:
+      scale_rows = (
+        os.path.getsize(self.scale_path) // 4 if os.path.exists(self.scale_path) else 0
+      )
+      self.count = min(self.count, scale_rows)
+      with open(self.scale_path, "ab") as f:
+        f.truncate(self.count * 4)
+    os.truncate(self.vec_path, HEADER_SIZE + self.count * self.row_bytes)
+    with open(self.ids_path, "ab") as f:
+      f.truncate(self.count * 8)
+
+  def append(self, ids: np.ndarray, vectors: np.ndarray):
+    """Encode float32 rows with the file's codec and append them."""
+    if len(ids) == 0:
+      return
+    if vectors.shape[1] != self.dim:
+      raise ValueError(f"Vector dim {vectors.shape[1]} does not match file dim {self.dim}")
+    rows, scales = encode(vectors, self.codec)
+    # Ids last: a crash before the ids write leaves a row _recover() drops.
+    with open(self.vec_path, "ab") as f:
+      f.write(np.ascontiguousarray(rows).tobytes())
+    if scales is not None:
+      with open(self.scale_path, "ab") as f:
+        f.write(scales.astype("<f4").tobytes())
+    with open(self.ids_path, "ab") as f:
+      f.write(np.ascontiguousarray(ids, dtype="<i8").tobytes())
+    self.count += len(ids)
+    self._view = None
+
+  def view(self) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """Zero-copy (ids, encoded rows, int8 scales or None) memmaps."""
+    if self._view is None:
+      if self.count == 0:
+        self._view = (
+          np.empty(0, dtype=np.int64),
+          np.empty((0, self.dim), dtype=self.dtype),
+          np.empty(0, dtype=np.float32) if self.has_scales else None,
+        )
+      else:
+        ids = np.memmap(self.ids_path, dtype="<i8", mode="r", shape=(self.count,))
+        vectors = np.memmap(
+          self.vec_path,
+          dtype=self.dtype,
+          mode="r",
+          offset=HEADER_SIZE,
+          shape=(self.count, self.dim),
+        )
+        scales = None
+        if self.has_scales:
+          scales = np.memmap(self.scale_path, dtype="<f4", mode="r", shape=(self.count,))
+        self._view = (ids, vectors, scales)
+    return self._view
+
+  def reencode(self, codec: str, chunk_rows: int = 16384):
+    """Rewrite the rows with another codec, swapping the files in atomically."""
+    if codec == self.codec:
+      return
+    _, rows, scales = self.view()
+    target = VectorFile(self.base_path, self.dim, codec)
+    tmp_vec, tmp_scale = f"{self.vec_path}.tmp", f"{self.scale_path}.tmp"
+    target._write_header(tmp_vec)
+    with open(tmp_vec, "ab") as vec_out, open(tmp_scale, "wb") as scale_out:
+      for start in range(0, self.count, chunk_rows):
+        chunk_scales = None if scales is None else scales[start : start + chunk_rows]
+        decoded = decode(rows[start : start + chunk_rows], chunk_scales)
+        new_rows, new_scales = encode(decoded, codec)
+        vec_out.write(np.ascontiguousarray(new_rows).tobytes())
+        if new_scales is not None:
+          scale_out.write(new_scales.astype("<f4").tobytes())
+
+    self._view = None
+    if target.has_scales:
+      os.replace(tmp_scale, self.scale_path)
+    else:
+      os.remove(tmp_scale)
+    os.replace(tmp_vec, self.vec_path)
+    if not target.has_scales and os.path.exists(self.scale_path):
+      os.remove(self.scale_path)
+    self.codec = codec
+    self.dtype = CODEC_DTYPES[codec]
+
+  def compact(self, keep: np.ndarray, chunk_rows: int = 16384):
+    """Rewrite the files with only the rows where `keep` is True.
+
+    The compacted files are written beside the originals and swapped in once
+    a marker file records that they are complete, so a crash mid-swap is
+    rolled forward on the next open rather than pairing rows with wrong ids.
+    """
+    ids, rows, scales = self.view()
+    positions = np.flatnonzero(keep[: self.count])
+    self._write_header(f"{self.vec_path}{COMPACT_SUFFIX}")
+    with open(f"{self.vec_path}{COMPACT_SUFFIX}", "ab") as vec_out, open(
+      f"{self.ids_path}{COMPACT_SUFFIX}", "wb"
+    ) as ids_out, open(f"{self.scale_path}{COMPACT_SUFFIX}", "wb") as scale_out:
+      for start in range(0, len(positions), chunk_rows):
+        chunk = positions[start : start + chunk_rows]
+        vec_out.write(np.ascontiguousarray(rows[chunk]).tobytes())
+        ids_out.write(np.ascontiguousarray(ids[chunk], dtype="<i8").tobytes())
+        if scales is not None:
+          scale_out.write(np.ascontiguousarray(scales[chunk], dtype="<f4").tobytes())
+    if scales is None:
+      os.remove(f"{self.scale_path}{COMPACT_SUFFIX}")
+
+    with open(f"{self.base_path}{COMPACT_MARKER}", "wb"):
+      pass
+    self._view = None
+    _finish_compaction(self.base_path)
+    self.count = len(positions)
+
+  def delete(self):
+    self._view = None
+    for path in (self.vec_path, self.ids_path, self.scale_path):
+      if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,540 @@
+import asyncio
+import glob
+import math
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from db.ann_index import IVFIndex
+from db.vector_file import VectorFile, decode
+from utils import metrics
+from utils.executors import run_cpu
+from utils.logging import get_logger
+
+logger = get_logger("vectors")
+
+SCAN_ROWS = metrics.histogram(
+  "vector_scan_rows", "Vectors scored per guild search", ["index"], metrics.SIZE_BUCKETS
+)
+VECTORS_STORED = metrics.gauge(
+  "vectors_stored", "Rows in open vector files, by whether they are still current", ["state"]
+)
+
+# Given a guild, a dim and the row ids found in its vector file, return the ids
+# the database still considers embedded at that dim. Called with the guild's
+# lock held, so it must only read.
+LiveIds = Callable[[str, int, np.ndarray], Awaitable[np.ndarray]]
+
+# Rows converted to float32 at a time when scanning float16/int8 files.
+SCAN_CHUNK_ROWS = 16384
+
+# Retrain a guild's IVF centroids once it has grown this much since training.
+ANN_RETRAIN_GROWTH = 4
+
+
+def normalize_rows(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  """Return (unit-length rows, mask of rows that had a non-zero norm)."""
+  vectors = np.asarray(vectors, dtype=np.float32)
+  norms = np.linalg.norm(vectors, axis=1)
+  mask = norms > 0
+  unit = vectors[mask] / norms[mask][:, None]
+  return unit.astype(np.float32, copy=False), mask
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+  """Indices of the k highest scores, best first."""
+  if k <= 0 or scores.size == 0:
+    return np.empty(0, dtype=np.int64)
+  if k < scores.size:
+    candidates = np.argpartition(-scores, k - 1)[:k]
+  else:
+    candidates = np.arange(scores.size)
+  return candidates[np.argsort(-scores[candidates])]
+
+
+def last_occurrence_mask(ids: np.ndarray) -> np.ndarray:
+  """True for the last row written for each id (later rows supersede earlier)."""
+  mask = np.zeros(len(ids), dtype=bool)
+  if len(ids):
+    _, first_in_reversed = np.unique(ids[::-1], return_index=True)
+    mask[len(ids) - 1 - first_in_reversed] = True
+  return mask
+
+
+def current_mask(ids: np.ndarray, live: np.ndarray) -> np.ndarray:
+  """True for the latest row of each id the database still has embedded."""
+  return last_occurrence_mask(ids) & np.isin(ids, live)
+
+
+class GuildVectors:
+  """Search view over a guild's vector file: memmapped unit rows plus row ids.
+
+  Rows superseded by a later write for the same id, or whose message is gone
+  from the database, are masked out rather than rewritten.
+  """
+
+  def __init__(self, vector_file: VectorFile, valid: np.ndarray):
+    self.file = vector_file
+    self.dim = vector_file.dim
+    self._ids, self._matrix, self._scales = vector_file.view()
+    self._valid = valid
+    self._all_valid = bool(valid.all())
+    self.ann: Optional[IVFIndex] = None
+
+  @property
+  def size(self) -> int:
+    return len(self._ids)
+
+  @property
+  def ids(self) -> np.ndarray:
+    return self._ids
+
+  @property
+  def matrix(self) -> np.ndarray:
+    """Stored rows in the file's codec; see `decoded` for float32 values."""
+    return self._matrix
+
+  def decoded(self, positions) -> np.ndarray:
+    scales = None if self._scales is None else self._scales[positions]
+    return decode(self._matrix[positions], scales)
+
+  def live_rows(self) -> List[Tuple[int, int]]:
+    """(position, row id) of every row that is still current."""
+    positions = np.flatnonzero(self._valid)
+    return list(zip(positions.tolist(), self._ids[positions].tolist(), strict=True))
+
+  def vectors_for(self, ids: List[int]) -> Dict[int, np.ndarray]:
+    """Current float32 vector for each of `ids` that has one."""
+    wanted = np.isin(self._ids, ids)
+    if not self._all_valid:
+      wanted &= self._valid
+    positions = np.flatnonzero(wanted)
+    decoded = self.decoded(positions)
+    return {
+      int(row_id): decoded[i] for i, row_id in enumerate(self._ids[positions].tolist())
+    }
+
+  @property
+  def valid(self) -> np.ndarray:
+    """Per-row mask of rows that are still current."""
+    return self._valid
+
+  @property
+  def dead(self) -> int:
+    """Rows masked out (superseded, deleted or edited) but still in the file."""
+    return 0 if self._all_valid else self.size - int(np.count_nonzero(self._valid))
+
+  def discard(self, ids: np.ndarray):
+    """Mask out rows for ids that no longer belong in this view."""
+    dropped = np.isin(self._ids, ids)
+    if dropped.any():
+      self._valid = self._valid & ~dropped
+      self._all_valid = False
+
+  def refresh(self, new_ids: np.ndarray):
+    """Pick up rows the file gained since this view was taken."""
+    old_size = self.size
+    self._ids, self._matrix, self._scales = self.file.view()
+    if self.size == old_size:
+      return
+
+    superseded = np.flatnonzero(np.isin(self._ids[:old_size], new_ids))
+    valid = np.concatenate([self._valid, last_occurrence_mask(self._ids[old_size:])])
+    valid[superseded] = False
+    self._valid = valid
+    self._all_valid = bool(valid.all())
+    if self.ann is not None:
+      self.ann.add(
+        np.arange(old_size, self.size), self.ann.assign(self._matrix[old_size:])
+      )
+
+  def _scan(
+    self, query_unit: np.ndarray, keep: int, positions: Optional[np.ndarray] = None
+  ) -> Tuple[np.ndarray, np.ndarray]:
+    """First-pass scores off the stored codes, keeping a running top `keep`.
+
+    Rows are scored SCAN_CHUNK_ROWS at a time and merged into the running
+    best set, so temporary memory stays bounded whatever the guild size.
+    Returns (positions, scores) of the survivors, best first.
+    """
+    best_positions = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    count = self.size if positions is None else len(positions)
+
+    for start in range(0, count, SCAN_CHUNK_ROWS):
+      stop = min(start + SCAN_CHUNK_ROWS, count)
+      if positions is None:
+        rows = np.arange(start, stop)
+        block = self._matrix[start:stop]
+      else:
+        rows = positions[start:stop]
+        block = self._matrix[rows]
+
+      scores = np.asarray(block, dtype=np.float32) @ query_unit
+      if self._scales is not None:
+        scores *= self._scales[rows]
+      if not self._all_valid:
+        scores[~self._valid[rows]] = -np.inf
+
+      merged_positions = np.concatenate([best_positions, rows])
+      merged_scores = np.concatenate([best_scores, scores])
+      top = top_k(merged_scores, keep)
+      best_positions, best_scores = merged_positions[top], merged_scores[top]
+
+    finite = np.isfinite(best_scores)
+    return best_positions[finite], best_scores[finite]
+
+  def _rescore(self, query_unit: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Float32 cosine against the decoded rows, correcting quantization norm drift."""
+    decoded = self.decoded(positions)
+    norms = np.linalg.norm(decoded, axis=1)
+    norms[norms == 0] = 1.0
+    return (decoded @ query_unit) / norms
+
+  def search(
+    self,
+    query_unit: np.ndarray,
+    limit: int,
+    nprobe: Optional[int] = None,
+    rerank: int = 0,
+  ) -> List[Tuple[int, float]]:
+    """Top matches by cosine.
+
+    Scans only `nprobe` IVF lists when indexed. For quantized files the best
+    `rerank` first-pass candidates are re-scored at float32 precision.
+    Runs on a worker thread: appends only ever replace the arrays with longer
+    ones, so positions taken here stay valid while the event loop refreshes.
+    """
+    if self.size == 0 or query_unit.shape[0] != self.dim:
+      return []
+
+    positions = None
+    if self.ann is not None and nprobe:
+      positions = self.ann.candidates(query_unit, nprobe)
+    SCAN_ROWS.observe(
+      self.size if positions is None else len(positions),
+      index="exact" if positions is None else "ivf",
+    )
+
+    quantized = self.file.codec != "float32"
+    keep = max(limit, rerank) if quantized else limit
+    positions, scores = self._scan(query_unit, keep, positions)
+
+    if quantized and len(positions):
+      scores = self._rescore(query_unit, positions)
+      best = top_k(scores, limit)
+      positions, scores = positions[best], scores[best]
+
+    return [
+      (int(self._ids[position]), float(score))
+      for position, score in zip(positions, scores, strict=True)
+    ]
+
+
+def store_key(guild_id: str, dim: int) -> str:
+  return f"{guild_id}.{dim}"
+
+
+def parse_store_key(key: str) -> Tuple[str, int]:
+  guild_id, dim = key.rsplit(".", 1)
+  return guild_id, int(dim)
+
+
+class VectorStore:
+  """Per-guild, per-dimension vector files, opened lazily on first search.
+
+  Each (guild, dim) pair has its own file, so vectors of different sizes are
+  never compared. Opening is near-instant because rows stay on disk behind
+  memmaps; appends go straight to the file and are visible to the cached view
+  immediately.
+  """
+
+  def __init__(
+    self,
+    directory: str,
+    live_ids: LiveIds,
+    codec: str = "float32",
+    index_dir: Optional[str] = None,
+    ann_min_vectors: int = 0,
+    ann_nlist: int = 0,
+  ):
+    self.directory = directory
+    self._live_ids = live_ids
+    self.codec = codec
+    self._guilds: Dict[str, GuildVectors] = {}
+    self._files: Dict[str, VectorFile] = {}
+    self._locks: Dict[str, asyncio.Lock] = {}
+    # Ids appended but not yet recorded as embedded in the database; views
+    # opened in between count them as live.
+    self._pending: Dict[str, set] = {}
+    self.index_dir = index_dir
+    self.ann_min_vectors = ann_min_vectors
+    self.ann_nlist = ann_nlist
+    self._indexing: Dict[str, asyncio.Task] = {}
+    VECTORS_STORED.track(
+      lambda: sum(view.size - view.dead for view in self._guilds.values()), state="live"
+    )
+    VECTORS_STORED.track(
+      lambda: sum(view.dead for view in self._guilds.values()), state="dead"
+    )
+
+  def _base_path(self, key: str) -> str:
+    return os.path.join(self.directory, key)
+
+  def _lock(self, key: str) -> asyncio.Lock:
+    return self._locks.setdefault(key, asyncio.Lock())
+
+  def _file(self, key: str) -> Optional[VectorFile]:
+    if key not in self._files:
+      vector_file = VectorFile.open(self._base_path(key))
+      if vector_file is None:
+        return None
+      self._files[key] = vector_file
+    return self._files[key]
+
+  def migrate_layout(self):
+    """Rename files from the one-file-per-guild layout to `<guild>.<dim>`."""
+    for path in glob.glob(os.path.join(self.directory, "*.vec")):
+      name = os.path.splitext(os.path.basename(path))[0]
+      if "." in name:
+        continue
+      vector_file = VectorFile.open(self._base_path(name))
+      key = store_key(name, vector_file.dim)
+      for suffix in (".vec", ".ids", ".scale"):
+        if os.path.exists(self._base_path(name) + suffix):
+          os.replace(self._base_path(name) + suffix, self._base_path(key) + suffix)
+      if self.index_dir and os.path.exists(self._index_path(name)):
+        os.replace(self._index_path(name), self._index_path(key))
+
+  async def get(self, guild_id: str, dim: int) -> Optional[GuildVectors]:
+    key = store_key(guild_id, dim)
+    if key in self._guilds:
+      return self._guilds[key]
+
+    async with self._lock(key):
+      if key in self._guilds:
+        return self._guilds[key]
+      vector_file = self._file(key)
+      if vector_file is None:
+        return None
+
+      ids = vector_file.view()[0]
+      live = await self._live_ids(guild_id, dim, np.array(ids))
+      pending = self._pending.get(key)
+      if pending:
+        live = np.union1d(live, np.fromiter(pending, dtype=np.int64, count=len(pending)))
+      valid = await run_cpu(current_mask, ids, live)
+      guild_vectors = GuildVectors(vector_file, valid)
+      self._guilds[key] = guild_vectors
+      logger.info(f"Opened {guild_vectors.size} vectors for {key}")
+      self._maybe_index(key, guild_vectors)
+      return guild_vectors
+
+  async def append(self, guild_id: str, ids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """Write committed rows to the guild's file for their dim.
+
+    Returns the ids actually stored; rows with a zero norm are skipped. They
+    count as live until `confirm` is called for them.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+      return ids
+
+    key = store_key(guild_id, vectors.shape[1])
+    async with self._lock(key):
+      vector_file = self._file(key)
+      if vector_file is None:
+        vector_file = VectorFile.create(self._base_path(key), vectors.shape[1], self.codec)
+        self._files[key] = vector_file
+
+      unit, mask = await run_cpu(normalize_rows, vectors)
+      ids = ids[mask]
+      await asyncio.to_thread(vector_file.append, ids, unit)
+      self._pending.setdefault(key, set()).update(ids.tolist())
+
+      guild_vectors = self._guilds.get(key)
+      if guild_vectors is not None:
+        guild_vectors.refresh(ids)
+        self._maybe_index(key, guild_vectors)
+
+    # A row re-embedded at this dim is no longer current at any other dim.
+    for other_key, other_vectors in self._guilds.items():
+      other_guild, other_dim = parse_store_key(other_key)
+      if other_guild == guild_id and other_dim != vectors.shape[1]:
+        other_vectors.discard(ids)
+    return ids
+
+  def confirm(self, guild_id: str, dim: int, ids: np.ndarray):
+    """The database now records `ids` as embedded at `dim` (or gave up on it)."""
+    key = store_key(guild_id, dim)
+    pending = self._pending.get(key)
+    if pending is not None:
+      pending.difference_update(np.asarray(ids).tolist())
+      if not pending:
+        del self._pending[key]
+
+  async def migrate_codec(self):
+    """Re-encode every vector file whose codec differs from the configured one."""
+    for key in self.keys():
+      async with self._lock(key):
+        vector_file = self._file(key)
+        if vector_file is None or vector_file.codec == self.codec:
+          continue
+        logger.info(
+          f"Re-encoding {vector_file.count} vectors for {key}: "
+          f"{vector_file.codec} -> {self.codec}"
+        )
+        self._guilds.pop(key, None)
+        await asyncio.to_thread(vector_file.reencode, self.codec)
+
+  def discard(self, guild_id: str, ids: np.ndarray):
+    """Mask rows out of the guild's open views (the ANN index included).
+
+    Views opened later leave them out anyway, since the database no longer
+    counts them as embedded.
+    """
+    for key, guild_vectors in self._guilds.items():
+      if parse_store_key(key)[0] == guild_id:
+        guild_vectors.discard(ids)
+
+  async def compact(self, min_dead_fraction: float) -> int:
+    """Rewrite open vector files in which at least `min_dead_fraction` of the
+    rows are masked out, dropping those rows. Returns how many were rewritten.
+
+    The ANN index is saved keyed by row id first and remapped onto the new
+    positions when the view is reopened.
+    """
+    compacted = 0
+    for key in list(self._guilds):
+      async with self._lock(key):
+        guild_vectors = self._guilds.get(key)
+        if guild_vectors is None or guild_vectors.dead == 0:
+          continue
+        if guild_vectors.dead < min_dead_fraction * guild_vectors.size:
+          continue
+
+        logger.info(
+          f"Compacting {key}: dropping {guild_vectors.dead} of "
+          f"{guild_vectors.size} vectors"
+        )
+        task = self._indexing.pop(key, None)
+        if task is not None:
+          task.cancel()
+        if guild_vectors.ann is not None:
+          arrays = guild_vectors.ann.export(guild_vectors.ids, guild_vectors.valid)
+          await asyncio.to_thread(IVFIndex.write, self._index_path(key), arrays)
+        await asyncio.to_thread(guild_vectors.file.compact, guild_vectors.valid)
+        self._guilds.pop(key, None)
+        compacted += 1
+    return compacted
+
+  def invalidate(self, guild_id: Optional[str] = None):
+    """Forget cached views so the next search re-validates against the database."""
+    for key in list(self._guilds):
+      if guild_id is None or parse_store_key(key)[0] == guild_id:
+        self._guilds.pop(key, None)
+
+  async def remove(self, guild_id: Optional[str] = None, dim: Optional[int] = None):
+    """Delete vector files (and ANN indexes) for a guild, a guild/dim, or all."""
+    for key in self.keys():
+      key_guild, key_dim = parse_store_key(key)
+      if guild_id is not None and key_guild != guild_id:
+        continue
+      if dim is not None and key_dim != dim:
+        continue
+      async with self._lock(key):
+        self._guilds.pop(key, None)
+        self._pending.pop(key, None)
+        vector_file = self._file(key)
+        if vector_file is not None:
+          vector_file.delete()
+        self._files.pop(key, None)
+        if self.index_dir and os.path.exists(self._index_path(key)):
+          os.remove(self._index_path(key))
+
+  def keys(self) -> List[str]:
+    """`<guild>.<dim>` names of every vector file on disk."""
+    return sorted(
+      os.path.splitext(os.path.basename(path))[0]
+      for path in glob.glob(os.path.join(self.directory, "*.*.vec"))
+    )
+
+  def guild_ids(self, dim: Optional[int] = None) -> List[str]:
+    guild_ids = set()
+    for key in self.keys():
+      key_guild, key_dim = parse_store_key(key)
+      if dim is None or key_dim == dim:
+        guild_ids.add(key_guild)
+    return sorted(guild_ids)
+
+  def dims(self, guild_id: str) -> List[int]:
+    return sorted(
+      key_dim
+      for key_guild, key_dim in map(parse_store_key, self.keys())
+      if key_guild == guild_id
+    )
+
+  def _index_path(self, key: str) -> str:
+    return os.path.join(self.index_dir, f"{key}.ivf.npz")
+
+  def _maybe_index(self, key: str, guild_vectors: GuildVectors):
+    if not self.index_dir or guild_vectors.size < self.ann_min_vectors:
+      return
+    if key in self._indexing:
+      return
+    ann = guild_vectors.ann
+    if ann is not None and guild_vectors.size <= ANN_RETRAIN_GROWTH * ann.trained_size:
+      return
+    self._indexing[key] = asyncio.create_task(
+      self._attach_index(key, guild_vectors)
+    )
+
+  async def _attach_index(self, key: str, guild_vectors: GuildVectors):
+    """Load or (re)train the guild's IVF index off the event loop, then attach it.
+
+    Exact search keeps serving the guild until the index is attached.
+    """
+    path = self._index_path(key)
+    try:
+      index = None
+      if guild_vectors.ann is None and os.path.exists(path):
+        try:
+          index = await asyncio.to_thread(IVFIndex.load, path, guild_vectors.ids.copy())
+        except Exception as e:
+          logger.warning(f"Discarding unreadable ANN index {path}: {e}")
+
+      stale = index is None or index.dim != guild_vectors.dim or (
+        guild_vectors.size > ANN_RETRAIN_GROWTH * index.trained_size
+      )
+      if stale:
+        size = guild_vectors.size
+        nlist = self.ann_nlist or int(math.sqrt(size))
+        logger.info(f"Training IVF index for {key}: {size} vectors, {nlist} lists")
+        index = await run_cpu(IVFIndex.build, guild_vectors.matrix[:size], nlist)
+
+      if self._guilds.get(key) is not guild_vectors:
+        return
+
+      # Rows appended while training or since the index was saved.
+      missing = np.flatnonzero(~index.indexed_mask(guild_vectors.size))
+      if len(missing):
+        index.add(missing, index.assign(guild_vectors.matrix[missing]))
+      guild_vectors.ann = index
+
+      if index.dirty:
+        arrays = index.export(guild_vectors.ids)
+        await asyncio.to_thread(IVFIndex.write, path, arrays)
+    except Exception as e:
+      logger.error(f"Failed to build ANN index for {key}: {e}")
+    finally:
+      self._indexing.pop(key, None)
+
+  async def save_indexes(self):
+    """Persist ANN indexes that picked up rows since they were last written."""
+    for task in list(self._indexing.values()):
+      task.cancel()
+    for key, guild_vectors in self._guilds.items():
+      if guild_vectors.ann is not None and guild_vectors.ann.dirty:
+        arrays = guild_vectors.ann.export(guild_vectors.ids)
+        await asyncio.to_thread(IVFIndex.write, self._index_path(key), arrays)
@@ -1,22 +1,64 @@
-import asyncio
+import time
 
 import discord
 from discord.ext import commands
 
 from commands import ai_commands, message_commands, utility_commands
-from config import GEMINI_API_KEY, TOKEN
+from config import GEMINI_API_KEY, METRICS_HOST, METRICS_PORT, TOKEN
 from db import message_db
 from services.auto_index_service import get_auto_index_service
+from services.embedding_backfill import get_embedding_backfill_service
+from services.index_maintenance import get_index_maintenance
 from services.message_indexer import get_message_indexer
+from services.recent_messages import get_recent_messages
+from services.reply_chain import get_reply_chain_resolver
+from utils import metrics, tracing
+from utils.executors import shutdown_executors
 from utils.logging import get_logger, setup_logging
 
 # Initialize logging
 setup_logging()
 logger = get_logger("main")
 
+COMMAND_SECONDS = metrics.histogram(
+  "command_seconds", "Prefix command latency", ["command", "outcome"]
+)
+GATEWAY_LATENCY = metrics.gauge(
+  "discord_gateway_latency_seconds", "Heartbeat round trip to the Discord gateway"
+)
+
+
+class Bot(commands.Bot):
+  async def close(self):
+    await super().close()
+    # Pending index jobs are durable; this only lets in-flight batches land.
+    await get_message_indexer().close()
+    await get_index_maintenance().close()
+    get_embedding_backfill_service().stop()
+    await message_db.close_db()
+    shutdown_executors()
+    tracing.get_loop_monitor().stop()
+    await metrics.stop_server()
+
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="/", intents=intents, help_command=None)
+bot = Bot(command_prefix="/", intents=intents, help_command=None)
+GATEWAY_LATENCY.track(lambda: bot.latency)
+
+
+@bot.before_invoke
+async def start_command_timer(ctx: commands.Context):
+  ctx.started_at = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_command_time(ctx: commands.Context):
+  COMMAND_SECONDS.observe(
+    time.perf_counter() - ctx.started_at,
+    command=ctx.command.qualified_name,
+    outcome="error" if ctx.command_failed else "ok",
+  )
 
 
 @bot.event
@@ -26,16 +68,22 @@ async def on_ready():
   await message_db.init_db()
   logger.info("Database initialized")
 
+  if METRICS_PORT:
+    await metrics.start_server(METRICS_HOST, METRICS_PORT)
+  tracing.get_loop_monitor().start()
+
   indexer = get_message_indexer()
   indexer.start()
   logger.info("Message indexer started")
 
-  # Auto-index existing guilds on startup if they have no indexed messages
+  get_embedding_backfill_service().start()
+  get_index_maintenance().start()
+
+  # Resume history crawls for existing guilds from their checkpoints
   auto_index_service = get_auto_index_service()
   for guild in bot.guilds:
     logger.info(f"Connected to guild: {guild.name} (ID: {guild.id})")
-    # Start indexing in background task for each guild
-    asyncio.create_task(auto_index_service.auto_index_guild(guild))
+    auto_index_service.start_crawl(guild)
     
   # Initialize scheduled tasks
   from services.scheduled_tasks import setup_scheduled_tasks
@@ -47,9 +95,77 @@ async def on_guild_join(guild: discord.Guild):
   """Auto-index messages when bot joins a new server."""
   logger.info(f"🎉 Joined new guild: {guild.name} (ID: {guild.id})")
 
-  # Run auto-indexing in background task
-  auto_index_service = get_auto_index_service()
-  asyncio.create_task(auto_index_service.auto_index_guild(guild))
+  get_auto_index_service().start_crawl(guild)
+
+
+async def respond_to_mention(
+  message: discord.Message,
+  content: str,
+  parent: list,
+  is_reply_to_bot: bool,
+):
+  """Answer a mention or a reply to the bot, traced stage by stage."""
+  reply_chain_resolver = get_reply_chain_resolver(bot)
+  with tracing.span("reply_chain"):
+    reply_chain = await reply_chain_resolver.resolve(message) if parent else []
+  logger.info(f"💬 {'Reply' if is_reply_to_bot else 'Mention'} from {message.author.display_name}: {content[:50]}...")
+
+  ctx = await bot.get_context(message)
+  if not ctx.guild:
+    return
+
+  from services.ai_service import get_ai_service
+  from services.context_grabber import get_context_grabber
+
+  ai_service = get_ai_service()
+  context_grabber = get_context_grabber()
+
+  async with message.channel.typing():
+    guild_id = str(ctx.guild.id)
+    
+    # Only fetch server context (RAG) if this is NOT a reply chain, 
+    # OR if the user specifically asks for it/search is implied.
+    # For direct replies, we prioritize the conversation flow.
+    server_context = ""
+    if not is_reply_to_bot:
+      with tracing.span("context"):
+        server_context = await context_grabber.get_relevant_context(content, guild_id=guild_id)
+
+    system_msg = (
+      "You are a chill, helpful bot in a Discord server. "
+      "Keep responses SHORT and conversational - like texting a friend. "
+      "Don't lecture, don't give unsolicited advice, don't be preachy. "
+      "Just answer what's asked. Use casual language."
+    )
+
+    prompt = content
+
+    # Build thread history string
+    if reply_chain:
+      thread_history = "\n".join([f"{m.author_name}: {m.content}" for m in reply_chain])
+      prompt = f"--- CONVERSATION HISTORY ---\n{thread_history}\n--- END HISTORY ---\n\nUser's new message: {content}"
+
+    if server_context:
+      prompt = f"{server_context}\n\n{prompt}"
+
+    with tracing.span("gemini"):
+      response = await ai_service.call_gemini_ai(prompt, system_message=system_msg, use_search=True)
+
+  # Send response as a reply to maintain the thread
+  with tracing.span("send"):
+    if len(response) > 2000:
+      chunks = [response[i : i + 2000] for i in range(0, len(response), 2000)]
+      for i, chunk in enumerate(chunks):
+        if i == 0:
+          reply = await message.reply(chunk)
+        else:
+          await message.channel.send(chunk)
+    else:
+      reply = await message.reply(response)
+
+  await reply_chain_resolver.record_turn(message, reply, response)
+
+  logger.info(f"💬 Replied to {message.author.display_name}")
 
 
 @bot.event
@@ -58,29 +174,17 @@ async def on_message(message: discord.Message):
   if message.author.bot:
     return
 
+  if message.guild:
+    get_recent_messages().record(message)
+
+  reply_chain_resolver = get_reply_chain_resolver(bot)
+  reply_chain_resolver.remember(message)
+
   # Check if this is a reply to the bot's message
-  is_reply_to_bot = False
-  reply_chain = []
-  
-  if message.reference and message.reference.message_id:
-    try:
-      # Recursively fetch up to 5 previous messages in the chain to build context
-      curr_msg = message
-      for _ in range(5):
-        if not curr_msg.reference or not curr_msg.reference.message_id:
-          break
-        
-        prev_msg = await message.channel.fetch_message(curr_msg.reference.message_id)
-        reply_chain.append(prev_msg)
-        curr_msg = prev_msg
-        
-        # Check if the original message was replying to the bot
-        if curr_msg.author == bot.user and curr_msg.id == message.reference.message_id:
-            is_reply_to_bot = True
-
-      reply_chain.reverse() # Oldest to newest
-    except discord.NotFound:
-      pass
+  resolve_started = time.perf_counter()
+  parent = await reply_chain_resolver.resolve(message, max_depth=1)
+  resolve_seconds = time.perf_counter() - resolve_started
+  is_reply_to_bot = bool(parent and bot.user and parent[0].author_id == bot.user.id)
 
   # Check if bot was mentioned OR if it's a reply to the bot
   should_respond = (
@@ -94,57 +198,9 @@ async def on_message(message: discord.Message):
       content = content.replace(f"<@{bot.user.id}>", "").replace(f"<@!{bot.user.id}>", "").strip()
 
     if content:
-      logger.info(f"💬 {'Reply' if is_reply_to_bot else 'Mention'} from {message.author.display_name}: {content[:50]}...")
-
-      ctx = await bot.get_context(message)
-      if ctx.guild:
-        from services.ai_service import get_ai_service
-        from services.context_grabber import get_context_grabber
-
-        ai_service = get_ai_service()
-        context_grabber = get_context_grabber()
-
-        async with message.channel.typing():
-          guild_id = str(ctx.guild.id)
-          
-          # Only fetch server context (RAG) if this is NOT a reply chain, 
-          # OR if the user specifically asks for it/search is implied.
-          # For direct replies, we prioritize the conversation flow.
-          server_context = ""
-          if not is_reply_to_bot:
-             server_context = await context_grabber.get_relevant_context(content, guild_id=guild_id)
-
-          system_msg = (
-            "You are a chill, helpful bot in a Discord server. "
-            "Keep responses SHORT and conversational - like texting a friend. "
-            "Don't lecture, don't give unsolicited advice, don't be preachy. "
-            "Just answer what's asked. Use casual language."
-          )
-
-          prompt = content
-
-          # Build thread history string
-          if reply_chain:
-            thread_history = "\n".join([f"{m.author.display_name}: {m.content}" for m in reply_chain])
-            prompt = f"--- CONVERSATION HISTORY ---\n{thread_history}\n--- END HISTORY ---\n\nUser's new message: {content}"
-
-          if server_context:
-            prompt = f"{server_context}\n\n{prompt}"
-
-          response = await ai_service.call_gemini_ai(prompt, system_message=system_msg, use_search=True)
-
-        # Send response as a reply to maintain the thread
-        if len(response) > 2000:
-          chunks = [response[i : i + 2000] for i in range(0, len(response), 2000)]
-          for i, chunk in enumerate(chunks):
-            if i == 0:
-              await message.reply(chunk)
-            else:
-              await message.channel.send(chunk)
-        else:
-          await message.reply(response)
-
-        logger.info(f"💬 Replied to {message.author.display_name}")
+      with tracing.trace("mention") as trace:
+        trace.record("reply_parent", resolve_seconds)
+        await respond_to_mention(message, content, parent, is_reply_to_bot)
     return
 
   await bot.process_commands(message)
@@ -162,6 +218,31 @@ async def on_message(message: discord.Message):
   await indexer.queue_message(message)
 
 
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+  message = payload.message
+  if not message.guild or message.author.bot:
+    return
+  get_recent_messages().edit(message.channel.id, message.id, message.content)
+  get_index_maintenance().queue_edit(message)
+
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+  if payload.guild_id is None:
+    return
+  get_recent_messages().forget(payload.channel_id, [payload.message_id])
+  get_index_maintenance().queue_deletes([payload.message_id])
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+  if payload.guild_id is None:
+    return
+  get_recent_messages().forget(payload.channel_id, payload.message_ids)
+  get_index_maintenance().queue_deletes(payload.message_ids)
+
+
 # Setup commands directly without unnecessary re-assignment
 ai_commands.setup_ai_commands(bot)
 message_commands.setup_message_commands(bot)
@@ -179,5 +260,3 @@ if __name__ == "__main__":
     bot.run(TOKEN, log_handler=None)  # Disable default discord.py logging
   except KeyboardInterrupt:
     logger.info("Bot shutting down...")
-    indexer = get_message_indexer()
-    indexer.stop()
@@ -1,14 +1,20 @@
 import asyncio
+import time
 from typing import Optional
 
 from google import genai
 from google.genai import types
 
 from config import GEMINI_API_KEY, GEMINI_MODEL
+from utils import metrics
 from utils.logging import get_logger
 
 logger = get_logger("ai")
 
+AI_REQUEST_SECONDS = metrics.histogram(
+  "ai_request_seconds", "Gemini generate_content latency", ["outcome"]
+)
+
 
 class AIService:
   def __init__(self):
@@ -30,6 +36,8 @@ class AIService:
 
     logger.info(f"🤖 AI request: {prompt[:80]}...")
 
+    start = time.perf_counter()
+    outcome = "error"
     try:
       # Build config with optional Google Search grounding
       tools = []
@@ -49,14 +57,18 @@ class AIService:
       )
 
       result = response.text if response.text else "No response from Gemini"
+      outcome = "ok" if response.text else "empty"
       logger.info(f"🤖 AI response: {result[:80]}...")
       return result
     except asyncio.TimeoutError:
+      outcome = "timeout"
       logger.error("AI request timed out")
       return "Error: Request timed out"
     except Exception as e:
       logger.error(f"AI error: {e}")
       return f"Error calling Gemini API: {str(e)}"
+    finally:
+      AI_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
 
 
 _ai_service: Optional[AIService] = None
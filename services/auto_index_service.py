@@ -1,97 +1,276 @@
 import asyncio
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
 
 import discord
 
-from config import AUTO_INDEX_LIMIT
+from config import (
+  AUTO_INDEX_LIMIT,
+  CATCH_UP_BATCH_SIZE,
+  CRAWL_ARCHIVED_THREADS,
+  CRAWL_CONCURRENCY,
+  CRAWL_PAGE_SIZE,
+)
 from db import message_db
 from services.message_indexer import get_message_indexer
 from utils.logging import get_logger
 
 logger = get_logger("auto_index")
 
+Crawlable = Union[discord.TextChannel, discord.Thread]
+
+
+class CrawlProgress:
+  """Live counters for one guild crawl, read by /reindex."""
+
+  def __init__(self, guild_name: str):
+    self.guild_name = guild_name
+    self.channels_total = 0
+    self.channels_done = 0
+    self.messages_queued = 0
+    self.channels_skipped = 0
+    self.finished = False
+
+  def summary(self) -> str:
+    state = "✅ Done" if self.finished else "🔄 Crawling"
+    return (
+      f"{state}: {self.channels_done}/{self.channels_total} channels, "
+      f"{self.messages_queued} messages queued"
+      + (f", {self.channels_skipped} skipped" if self.channels_skipped else "")
+    )
+
 
 class AutoIndexService:
-  """Automatically indexes messages when bot joins a new guild."""
+  """Crawls guild history into the indexer, a few channels at a time.
+
+  Every channel and thread keeps a checkpoint of the oldest and newest
+  message queued. A crawl first catches up on messages posted after the
+  newest one (e.g. while the bot was offline), then goes up to
+  AUTO_INDEX_LIMIT messages deeper into channels that have not been read to
+  the start yet, so an interrupted crawl resumes where it stopped.
+  """
 
   def __init__(self):
     self.indexer = get_message_indexer()
+    self.crawls: Dict[str, asyncio.Task] = {}
+    self.progress: Dict[str, CrawlProgress] = {}
+    # Shared by all guilds; discord.py itself waits out HTTP 429s.
+    self._channel_slots = asyncio.Semaphore(CRAWL_CONCURRENCY)
 
-  async def should_auto_index(self, guild_id: str) -> bool:
-    """Check if guild has no indexed messages."""
-    count = await message_db.get_message_count(guild_id=guild_id)
-    return count == 0
+  def start_crawl(self, guild: discord.Guild, restart: bool = False) -> asyncio.Task:
+    """Start (or join) a background crawl of the guild's history.
 
-  async def auto_index_guild(self, guild: discord.Guild) -> dict:
-    """Index messages for a guild in the background."""
+    A restart cancels a crawl already running and starts over once it has
+    stopped, so its checkpoints are not written after they were cleared.
+    """
     guild_id = str(guild.id)
+    task = self.crawls.get(guild_id)
+    if task is not None and not task.done():
+      if not restart:
+        return task
+      task.cancel()
+      task = asyncio.create_task(self._restart_crawl(guild, task))
+    else:
+      task = asyncio.create_task(self._crawl_guild(guild, restart))
+    self.crawls[guild_id] = task
+    return task
 
-    if not await self.should_auto_index(guild_id):
-      logger.info(f"Guild {guild.name} already indexed, skipping")
-      return {"status": "skipped", "reason": "already_indexed"}
+  async def _restart_crawl(self, guild: discord.Guild, previous: asyncio.Task) -> dict:
+    await asyncio.wait({previous})
+    logger.info(f"🔄 Restarting crawl of {guild.name} from the newest messages")
+    return await self._crawl_guild(guild, restart=True)
 
-    logger.info(f"🔄 Starting auto-index for: {guild.name}")
+  async def _crawl_targets(self, guild: discord.Guild) -> List[Crawlable]:
+    """Text channels plus active and (optionally) archived threads and forum posts."""
+    targets: List[Crawlable] = [
+      channel
+      for channel in guild.text_channels
+      if channel.permissions_for(guild.me).read_message_history
+    ]
+    threads = {thread.id: thread for thread in guild.threads}
 
-    total_queued = 0
-    total_skipped = 0
-    channels_processed = 0
-    messages_remaining = AUTO_INDEX_LIMIT
-
-    for channel in guild.text_channels:
-      if messages_remaining <= 0:
-        break
+    if CRAWL_ARCHIVED_THREADS:
+      for parent in [*targets, *guild.forums]:
+        try:
+          async for thread in parent.archived_threads(limit=None):
+            threads.setdefault(thread.id, thread)
+        except discord.HTTPException:
+          logger.debug(f"Skipping archived threads in #{parent.name}")
 
-      try:
-        if not channel.permissions_for(guild.me).read_message_history:
-          logger.debug(f"Skipping #{channel.name} (no permissions)")
-          continue
-
-        channel_queued = 0
-
-        async for message in channel.history(limit=min(100, messages_remaining)):
-          if message.author.bot:
-            continue
+    targets.extend(
+      thread
+      for thread in threads.values()
+      if thread.permissions_for(guild.me).read_message_history
+    )
+    return targets
 
-          if not message.content or not message.content.strip():
-            continue
+  async def _crawl_guild(self, guild: discord.Guild, restart: bool) -> dict:
+    guild_id = str(guild.id)
+    progress = self.progress[guild_id] = CrawlProgress(guild.name)
 
-          if message.content.startswith("/"):
-            continue
+    if restart:
+      await message_db.clear_crawl_checkpoints(guild_id)
+    # Anything newer than this reaches the indexer through on_message.
+    live_since = discord.utils.time_snowflake(discord.utils.utcnow())
+    checkpoints = await message_db.get_crawl_checkpoints(guild_id)
+    # A full recrawl starts from the newest message, whatever is indexed already.
+    indexed = (
+      {} if restart
+      else await message_db.get_channel_id_ranges(guild_id, before_id=live_since)
+    )
 
-          queued = await self.indexer.queue_message(message)
-          if queued:
-            channel_queued += 1
-            messages_remaining -= 1
-          else:
-            total_skipped += 1
+    targets = await self._crawl_targets(guild)
+    progress.channels_total = len(targets)
+    logger.info(f"🔄 Crawling {len(targets)} channels in {guild.name}")
+    await asyncio.gather(
+      *(
+        self._crawl_channel(
+          channel,
+          self._checkpoint(channel, checkpoints.get(str(channel.id)), indexed),
+          live_since,
+          progress,
+        )
+        for channel in targets
+      )
+    )
+    progress.finished = True
 
-          if messages_remaining <= 0:
-            break
+    logger.info(
+      f"✅ Auto-index complete: {progress.messages_queued} queued, "
+      f"{progress.channels_done} channels, {progress.channels_skipped} skipped"
+    )
+    return {
+      "status": "completed",
+      "total_queued": progress.messages_queued,
+      "total_skipped": progress.channels_skipped,
+      "channels_processed": progress.channels_done,
+    }
 
-        total_queued += channel_queued
-        channels_processed += 1
-        logger.info(f"  📂 #{channel.name}: {channel_queued} messages queued")
+  def _checkpoint(
+    self,
+    channel: Crawlable,
+    saved: Optional[dict],
+    indexed: Dict[str, Tuple[int, int]],
+  ) -> dict:
+    """The saved checkpoint, widened by whatever the messages table already holds."""
+    checkpoint = {
+      "channel_id": str(channel.id),
+      "guild_id": str(channel.guild.id),
+      "oldest_id": saved["oldest_id"] if saved else None,
+      "newest_id": saved["newest_id"] if saved else None,
+      "complete": bool(saved and saved["complete"]),
+    }
+    if str(channel.id) in indexed:
+      oldest, newest = indexed[str(channel.id)]
+      if checkpoint["oldest_id"] is None:
+        checkpoint["oldest_id"] = str(oldest)
+      if checkpoint["newest_id"] is None or newest > int(checkpoint["newest_id"]):
+        checkpoint["newest_id"] = str(newest)
+    return checkpoint
 
-        await asyncio.sleep(0.3)
+  async def _crawl_channel(
+    self,
+    channel: Crawlable,
+    checkpoint: dict,
+    live_since: int,
+    progress: CrawlProgress,
+  ):
+    """Catch up on messages missed while offline, then crawl further back."""
+    queued = 0
+    async with self._channel_slots:
+      try:
+        queued += await self._catch_up(channel, checkpoint, live_since)
+        if not checkpoint["complete"]:
+          queued += await self._crawl_back(channel, checkpoint)
+        progress.channels_done += 1
+        if queued:
+          logger.info(f"  📂 #{channel.name}: {queued} messages queued")
 
       except discord.Forbidden:
+        progress.channels_skipped += 1
         logger.debug(f"Skipping #{channel.name} (forbidden)")
-        continue
       except Exception as e:
+        progress.channels_skipped += 1
         logger.error(f"Error in #{channel.name}: {e}")
-        continue
+      finally:
+        progress.messages_queued += queued
 
-    logger.info(
-      f"✅ Auto-index complete: {total_queued} queued, "
-      f"{total_skipped} skipped, {channels_processed} channels"
-    )
+  async def _catch_up(self, channel: Crawlable, checkpoint: dict, live_since: int) -> int:
+    """Queue messages posted after the newest indexed one, oldest first."""
+    if checkpoint["newest_id"] is None and not checkpoint["complete"]:
+      return 0  # Never crawled; _crawl_back starts from the newest message
+    # A channel crawled to the start while empty catches up from its first message.
+    newest_id = int(checkpoint["newest_id"] or 0)
+    last_message_id = channel.last_message_id
+    if last_message_id is not None and last_message_id <= newest_id:
+      return 0
 
-    return {
-      "status": "completed",
-      "total_queued": total_queued,
-      "total_skipped": total_skipped,
-      "channels_processed": channels_processed,
-    }
+    queued = 0
+    batch: List[discord.Message] = []
+    async for message in channel.history(
+      limit=None,
+      after=discord.Object(id=newest_id),
+      before=discord.Object(id=live_since),
+      oldest_first=True,
+    ):
+      batch.append(message)
+      if len(batch) >= CATCH_UP_BATCH_SIZE:
+        queued += await self._queue_page(channel, checkpoint, batch, newest=batch[-1])
+        batch = []
+    if batch:
+      queued += await self._queue_page(channel, checkpoint, batch, newest=batch[-1])
+    return queued
+
+  async def _crawl_back(self, channel: Crawlable, checkpoint: dict) -> int:
+    """Page backwards from the oldest queued message, up to AUTO_INDEX_LIMIT."""
+    budget = AUTO_INDEX_LIMIT
+    queued = 0
+    while budget > 0:
+      oldest_id = checkpoint["oldest_id"]
+      page = [
+        message
+        async for message in channel.history(
+          limit=min(CRAWL_PAGE_SIZE, budget),
+          before=discord.Object(id=int(oldest_id)) if oldest_id else None,
+        )
+      ]
+      budget -= len(page)
+      # A short page means the channel's first message has been reached.
+      checkpoint["complete"] = len(page) < min(CRAWL_PAGE_SIZE, budget + len(page))
+      if not page:
+        await message_db.save_crawl_checkpoint(**checkpoint)
+        break
+
+      queued += await self._queue_page(channel, checkpoint, page, oldest=page[-1])
+      if checkpoint["complete"]:
+        break
+    return queued
+
+  async def _queue_page(
+    self,
+    channel: Crawlable,
+    checkpoint: dict,
+    page: List[discord.Message],
+    oldest: Optional[discord.Message] = None,
+    newest: Optional[discord.Message] = None,
+  ) -> int:
+    """Queue a page for indexing, then move the checkpoint past it."""
+    queued = await self.indexer.queue_messages(
+      [
+        message
+        for message in page
+        if not message.author.bot
+        and message.content
+        and message.content.strip()
+        and not message.content.startswith("/")
+      ],
+      live=False,
+    )
+    if oldest is not None:
+      checkpoint["oldest_id"] = str(oldest.id)
+    if newest is not None or checkpoint["newest_id"] is None:
+      checkpoint["newest_id"] = str((newest or page[0]).id)
+    await message_db.save_crawl_checkpoint(**checkpoint)
+    return queued
 
 
 _auto_index_service: Optional[AutoIndexService] = None
@@ -0,0 +1,180 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+
+from config import (
+  BACKFILL_BATCH_INTERVAL,
+  BACKFILL_SCAN_INTERVAL,
+  EMBEDDING_BATCH_SIZE,
+  EMBEDDING_DIM,
+)
+from db import message_db
+from services.embedding_service import get_embedding_service
+from services.message_indexer import get_message_indexer
+from utils.circuit_breaker import CircuitBreaker
+from utils.logging import get_logger
+
+logger = get_logger("backfill")
+
+# Attempts at a page that embeds nothing before the pass skips past it.
+MAX_FAILED_BATCHES = 3
+
+FetchPage = Callable[[Optional[int]], Awaitable[List[dict]]]
+
+
+class EmbeddingBackfillService:
+  """Embeds indexed messages that have no usable embedding.
+
+  Covers rows stored without one (the embedding call failed at index time)
+  and rows stored at a dimension other than EMBEDDING_DIM. Each pass pages
+  through the backlog newest first so recent history becomes searchable
+  soonest, then the worker sleeps until the next pass. Batches are spaced
+  out and wait for the live indexing lane to drain, leaving embedding quota
+  for interactive traffic; a history crawl's bulk lane does not hold them up.
+  """
+
+  def __init__(self):
+    self.embedding_service = get_embedding_service()
+    self.worker_task: Optional[asyncio.Task] = None
+    self.running = False
+    self.backfilled = 0
+    self.converted = 0
+    self.reused = 0
+
+  def start(self):
+    if not self.running:
+      self.running = True
+      self.worker_task = asyncio.create_task(self._worker())
+
+  def stop(self):
+    self.running = False
+    if self.worker_task:
+      self.worker_task.cancel()
+
+  async def _worker(self):
+    while self.running:
+      try:
+        missing = await message_db.count_messages_without_embeddings()
+        stale = await message_db.count_messages_to_reembed(EMBEDDING_DIM)
+        if missing or stale:
+          logger.info(
+            f"🔁 Embedding backlog: {missing} missing, "
+            f"{stale} stored at another size (target {EMBEDDING_DIM})"
+          )
+
+        converted = await self._run_pass(
+          lambda before_id: message_db.get_messages_to_reembed(
+            EMBEDDING_DIM, limit=EMBEDDING_BATCH_SIZE, before_id=before_id
+          ),
+          counter="converted",
+        )
+        backfilled = await self._run_pass(
+          lambda before_id: message_db.get_messages_without_embeddings(
+            limit=EMBEDDING_BATCH_SIZE, before_id=before_id
+          ),
+          counter="backfilled",
+        )
+
+        removed = await message_db.prune_vector_files(EMBEDDING_DIM)
+        if converted or backfilled or removed:
+          logger.info(
+            f"✅ Backfill pass complete: {backfilled} embedded, {converted} "
+            f"re-embedded, {removed} old vector files removed"
+          )
+        await asyncio.sleep(BACKFILL_SCAN_INTERVAL)
+
+      except asyncio.CancelledError:
+        break
+      except Exception as e:
+        logger.error(f"Backfill error: {e}")
+        await asyncio.sleep(60)
+
+    self.running = False
+
+  async def _run_pass(self, fetch_page: FetchPage, counter: str) -> int:
+    """Embed every row `fetch_page` yields, adding progress to `counter`.
+
+    Returns how many embeddings were stored.
+    """
+    stored_total = 0
+    failed_batches = 0
+    before_id = None
+
+    while self.running:
+      rows = await fetch_page(before_id)
+      if not rows:
+        break
+
+      await self._wait_for_live_queue()
+      stored = await self.embed_rows(rows)
+      if stored == 0:
+        failed_batches += 1
+        if self.embedding_service.circuit_breaker.state == CircuitBreaker.OPEN:
+          logger.warning("Embedding API unavailable, backfill paused until the next pass")
+          break
+        if failed_batches < MAX_FAILED_BATCHES:
+          await asyncio.sleep(60)  # Back off and retry the same page
+          continue
+        # Leave the page for the next pass rather than stall every page after it.
+        logger.warning(
+          f"Skipping {len(rows)} messages that failed to embed "
+          f"{failed_batches} times (ids {rows[-1]['id']}-{rows[0]['id']})"
+        )
+      else:
+        stored_total += stored
+        setattr(self, counter, getattr(self, counter) + stored)
+
+      failed_batches = 0
+      before_id = min(row["id"] for row in rows)
+      await asyncio.sleep(BACKFILL_BATCH_INTERVAL)
+
+    return stored_total
+
+  async def _wait_for_live_queue(self):
+    indexer = get_message_indexer()
+    while self.running and indexer.live_backlog:
+      await asyncio.sleep(1)
+
+  async def embed_rows(self, rows: List[dict]) -> int:
+    """Embed rows (reusing stored vectors for identical content) in one update."""
+    embeddings_by_hash = await message_db.get_embeddings_by_hash(
+      [row["content_hash"] for row in rows], EMBEDDING_DIM
+    )
+    to_embed = [row for row in rows if row["content_hash"] not in embeddings_by_hash]
+    self.reused += len(rows) - len(to_embed)
+
+    if to_embed:
+      embeddings = await self.embedding_service.generate_embeddings_batch(
+        [row["content"] for row in to_embed]
+      )
+      for row, embedding in zip(to_embed, embeddings, strict=True):
+        if embedding is not None and len(embedding) == EMBEDDING_DIM:
+          embeddings_by_hash[row["content_hash"]] = (
+            self.embedding_service.embedding_to_bytes(embedding)
+          )
+
+    entries = [
+      (row["message_id"], embeddings_by_hash[row["content_hash"]])
+      for row in rows
+      if row["content_hash"] in embeddings_by_hash
+    ]
+    return await message_db.update_message_embeddings(entries)
+
+  async def get_progress(self) -> dict:
+    return {
+      "running": self.running,
+      "backfilled": self.backfilled,
+      "converted": self.converted,
+      "reused": self.reused,
+      "missing": await message_db.count_messages_without_embeddings(),
+      "stale": await message_db.count_messages_to_reembed(EMBEDDING_DIM),
+    }
+
+
+_embedding_backfill_service: Optional[EmbeddingBackfillService] = None
+
+
+def get_embedding_backfill_service() -> EmbeddingBackfillService:
+  global _embedding_backfill_service
+  if _embedding_backfill_service is None:
+    _embedding_backfill_service = EmbeddingBackfillService()
+  return _embedding_backfill_service
@@ -1,25 +1,141 @@
 import asyncio
+import random
+import re
+import time
 from typing import List, Optional
 
 import numpy as np
 from google import genai
+from google.genai import errors, types
 
-from config import EMBEDDING_BATCH_SIZE, EMBEDDING_MODEL, GEMINI_API_KEY
+from config import (
+  EMBEDDING_BATCH_SIZE,
+  EMBEDDING_BREAKER_RESET_TIMEOUT,
+  EMBEDDING_BREAKER_THRESHOLD,
+  EMBEDDING_DIM,
+  EMBEDDING_MAX_CONCURRENCY,
+  EMBEDDING_MAX_RETRIES,
+  EMBEDDING_MODEL,
+  EMBEDDING_REQUEST_TIMEOUT,
+  EMBEDDING_REQUESTS_PER_MINUTE,
+  EMBEDDING_RETRY_BASE_DELAY,
+  EMBEDDING_THROTTLE_RETRIES,
+  EMBEDDING_TOKENS_PER_MINUTE,
+  GEMINI_API_KEY,
+)
+from utils import metrics
+from utils.circuit_breaker import CircuitBreaker
+from utils.logging import get_logger
+from utils.rate_limiter import AdaptiveRateLimiter
+
+logger = get_logger("embeddings")
+
+EMBEDDING_REQUEST_SECONDS = metrics.histogram(
+  "embedding_request_seconds",
+  "Embedding API call latency, including time waiting on the rate limiter",
+  ["outcome"],
+)
+EMBEDDING_TEXTS = metrics.counter(
+  "embedding_texts_total", "Texts sent for embedding by result", ["result"]
+)
+EMBEDDING_BREAKER_STATE = metrics.gauge(
+  "embedding_breaker_state", "Embedding circuit breaker: 0 closed, 1 half-open, 2 open"
+)
+EMBEDDING_RATE_SCALE = metrics.gauge(
+  "embedding_rate_scale", "Fraction of the configured embedding quota currently allowed"
+)
+EMBEDDING_THROTTLES = metrics.counter(
+  "embedding_throttles_total", "Throttle (HTTP 429) responses from the embedding API"
+)
+EMBEDDING_BREAKER_REJECTIONS = metrics.counter(
+  "embedding_breaker_rejections_total", "Embedding calls refused by the open breaker"
+)
+BREAKER_STATES = {
+  CircuitBreaker.CLOSED: 0,
+  CircuitBreaker.HALF_OPEN: 1,
+  CircuitBreaker.OPEN: 2,
+}
+
+
+def estimate_tokens(texts: List[str]) -> int:
+  """Rough token count (~4 characters per token) for the tokens/min quota."""
+  return sum(len(text) // 4 + 1 for text in texts)
+
+
+# Client errors that no retry or smaller batch will fix (bad key, API disabled,
+# unknown model); they count against the circuit breaker.
+FATAL_STATUS_CODES = {401, 403, 404}
+# ErrorInfo reasons Google reports as 400s that concern the request (its key,
+# project or region) rather than any input in it
+REQUEST_ERROR_REASONS = {
+  "API_KEY_INVALID",
+  "API_KEY_EXPIRED",
+  "API_KEY_SERVICE_BLOCKED",
+  "API_KEY_HTTP_REFERRER_BLOCKED",
+  "API_KEY_IP_ADDRESS_BLOCKED",
+  "BILLING_DISABLED",
+  "CONSUMER_INVALID",
+  "SERVICE_DISABLED",
+}
+
+
+def is_request_error(error: errors.APIError) -> bool:
+  """Whether a 400 rejects the request as a whole, so bisecting cannot help."""
+  if error.status and error.status != "INVALID_ARGUMENT":
+    return True  # e.g. FAILED_PRECONDITION: API unavailable in this region
+  reasons = re.findall(r"'reason': '(\w+)'", str(error.details))
+  return any(reason in REQUEST_ERROR_REASONS for reason in reasons)
+
+
+def retry_after_seconds(error: errors.APIError) -> Optional[float]:
+  """Retry hint from a throttled response: the Retry-After header or RetryInfo."""
+  headers = getattr(error.response, "headers", None)
+  if headers and headers.get("retry-after"):
+    try:
+      return float(headers["retry-after"])
+    except ValueError:
+      pass
+  match = re.search(r"'retryDelay': '([\d.]+)s'", str(error.details))
+  return float(match.group(1)) if match else None
+
+
+def parse_embeddings(response, count: int) -> List[Optional[np.ndarray]]:
+  results: List[Optional[np.ndarray]] = [None] * count
+  for j, embedding_obj in enumerate((response.embeddings or [])[:count]):
+    if getattr(embedding_obj, "values", None):
+      results[j] = np.array(embedding_obj.values, dtype=np.float32)
+  return results
 
 
 class EmbeddingService:
   def __init__(self):
     self.client = genai.Client(api_key=GEMINI_API_KEY).aio
+    self.config = types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM)
+    self.rate_limiter = AdaptiveRateLimiter(
+      EMBEDDING_REQUESTS_PER_MINUTE,
+      EMBEDDING_TOKENS_PER_MINUTE,
+      EMBEDDING_MAX_CONCURRENCY,
+    )
+    self.circuit_breaker = CircuitBreaker(
+      EMBEDDING_BREAKER_THRESHOLD, EMBEDDING_BREAKER_RESET_TIMEOUT
+    )
+    EMBEDDING_BREAKER_STATE.track(lambda: BREAKER_STATES[self.circuit_breaker.state])
+    EMBEDDING_RATE_SCALE.track(lambda: self.rate_limiter.scale)
+    EMBEDDING_THROTTLES.track(lambda: self.rate_limiter.throttled)
+    EMBEDDING_BREAKER_REJECTIONS.track(lambda: self.circuit_breaker.rejected)
 
   async def generate_embedding(self, text: str) -> Optional[np.ndarray]:
+    """Embed a search query, ahead of any indexing batches waiting on the quota."""
     if not text or not text.strip():
       return None
 
-    results = await self.generate_embeddings_batch([text])
+    results = await self.generate_embeddings_batch(
+      [text], priority=AdaptiveRateLimiter.INTERACTIVE
+    )
     return results[0] if results else None
 
   async def generate_embeddings_batch(
-    self, texts: List[str]
+    self, texts: List[str], priority: int = AdaptiveRateLimiter.BACKGROUND
   ) -> List[Optional[np.ndarray]]:
     if not texts:
       return []
@@ -30,38 +146,186 @@ class EmbeddingService:
       return [None] * len(texts)
 
     results = [None] * len(texts)
+    batches = [
+      valid_texts[i : i + EMBEDDING_BATCH_SIZE]
+      for i in range(0, len(valid_texts), EMBEDDING_BATCH_SIZE)
+    ]
+    # Batches run concurrently; the shared rate limiter bounds how many are
+    # in flight and paces them to the quota.
+    batch_results = await asyncio.gather(
+      *(self._embed_batch([text for _, text in batch], priority) for batch in batches)
+    )
+    for batch, embeddings in zip(batches, batch_results, strict=True):
+      for (index, _), embedding in zip(batch, embeddings, strict=True):
+        results[index] = embedding
 
-    for i in range(0, len(valid_texts), EMBEDDING_BATCH_SIZE):
-      batch = valid_texts[i : i + EMBEDDING_BATCH_SIZE]
-      batch_texts = [text for _, text in batch]
-      batch_indices = [idx for idx, _ in batch]
+    embedded = sum(embedding is not None for embedding in results)
+    EMBEDDING_TEXTS.inc(embedded, result="embedded")
+    EMBEDDING_TEXTS.inc(len(valid_texts) - embedded, result="failed")
+    return results
+
+  async def _embed_batch(
+    self, texts: List[str], priority: int, probe: bool = True
+  ) -> List[Optional[np.ndarray]]:
+    """Embed one batch, retrying transient failures with exponential backoff.
+
+    A batch the API rejects as invalid (400) is bisected so a bad input only
+    loses its own embedding, unless the error concerns the request itself (an
+    invalid key), which counts against the circuit breaker like a 403. While
+    the breaker is open nothing is sent and every text comes back None, to be
+    embedded later by the backfill.
+    """
+    throttles = 0
+    failures = 0
+
+    while True:
+      if not self.circuit_breaker.allow():
+        return [None] * len(texts)
+      is_trial = self.circuit_breaker.state == CircuitBreaker.HALF_OPEN
 
       try:
-        response = await self.client.models.embed_content(
-          model=EMBEDDING_MODEL,
-          contents=batch_texts,
+        response = await self._request(texts, priority)
+      except asyncio.CancelledError:
+        # e.g. a search gave up waiting; that says nothing about the API.
+        if is_trial:
+          self.circuit_breaker.release_trial()
+        raise
+      except errors.APIError as e:
+        if e.code == 429:
+          # Throttling means the API is up; the rate limiter handles it.
+          self.circuit_breaker.record_success()
+          throttles += 1
+          if throttles > EMBEDDING_THROTTLE_RETRIES:
+            logger.error(f"Embedding batch of {len(texts)} still throttled, giving up")
+            return [None] * len(texts)
+          retry_after = retry_after_seconds(e)
+          self.rate_limiter.on_throttle(retry_after)
+          logger.warning(
+            f"Embedding API throttled, rate scaled to {self.rate_limiter.scale:.2f}"
+            + (f", retrying after {retry_after:.1f}s" if retry_after else "")
+          )
+          continue
+        if e.code == 400 and not is_request_error(e):
+          if len(texts) > 1 and probe:
+            # Leave the breaker to the probe, which tells which kind of 400 this is.
+            if is_trial:
+              self.circuit_breaker.release_trial()
+            return await self._probe(texts, e, priority)
+          self.circuit_breaker.record_success()
+          return await self._bisect(texts, e, priority)
+        if e.code in FATAL_STATUS_CODES or e.code == 400:
+          self._record_failure()
+          logger.error(
+            f"Embedding API refused a batch of {len(texts)} ({e.code} {e.status}): "
+            f"{e.message}"
+          )
+          return [None] * len(texts)
+        error: Exception = e
+      except Exception as e:
+        error = e
+      else:
+        self.circuit_breaker.record_success()
+        self.rate_limiter.on_success()
+        return parse_embeddings(response, len(texts))
+
+      failures += 1
+      self._record_failure()
+      if failures > EMBEDDING_MAX_RETRIES:
+        logger.error(
+          f"Embedding batch of {len(texts)} failed after {failures} attempts: {error!r}"
         )
+        return [None] * len(texts)
+      delay = EMBEDDING_RETRY_BASE_DELAY * 2 ** (failures - 1) * random.uniform(0.5, 1.5)
+      logger.warning(f"Embedding request failed ({error!r}), retrying in {delay:.1f}s")
+      await asyncio.sleep(delay)
 
-        if hasattr(response, "embeddings") and response.embeddings:
-          for j, embedding_obj in enumerate(response.embeddings):
-            if j < len(batch_indices):
-              if hasattr(embedding_obj, "values"):
-                embedding_values = embedding_obj.values
-                if embedding_values:
-                  results[batch_indices[j]] = np.array(
-                    embedding_values, dtype=np.float32
-                  )
+  async def _request(self, texts: List[str], priority: int):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+      async with self.rate_limiter.acquire(estimate_tokens(texts), priority):
+        response = await asyncio.wait_for(
+          self.client.models.embed_content(
+            model=EMBEDDING_MODEL,
+            contents=texts,
+            config=self.config,
+          ),
+          timeout=EMBEDDING_REQUEST_TIMEOUT,
+        )
+      outcome = "ok"
+      return response
+    except asyncio.TimeoutError:
+      outcome = "timeout"
+      raise
+    except errors.APIError as e:
+      outcome = "throttled" if e.code == 429 else str(e.code)
+      raise
+    finally:
+      EMBEDDING_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
 
-        await asyncio.sleep(0.1)
+  async def _bisect(
+    self, texts: List[str], error: errors.APIError, priority: int
+  ) -> List[Optional[np.ndarray]]:
+    if len(texts) == 1:
+      logger.warning(f"Embedding rejected for input {texts[0][:50]!r}: {error.message}")
+      return [None]
+    mid = len(texts) // 2
+    left, right = await asyncio.gather(
+      self._embed_batch(texts[:mid], priority, probe=False),
+      self._embed_batch(texts[mid:], priority, probe=False),
+    )
+    return left + right
 
-      except Exception as e:
-        print(f"Error generating batch embeddings: {e}")
-        import traceback
+  async def _probe(
+    self, texts: List[str], error: errors.APIError, priority: int
+  ) -> List[Optional[np.ndarray]]:
+    """Split a rejected batch into its first text and the rest, sent as they are.
 
-        traceback.print_exc()
+    If both parts are rejected with the batch's own error, it concerns the
+    request rather than an input (a bad key reported without a known reason):
+    the batch is given up on and counts against the breaker. Otherwise each
+    part carries on like a batch of its own.
+    """
+    parts = [texts[:1], texts[1:]]
+    outcomes = await asyncio.gather(
+      *(self._request(part, priority) for part in parts), return_exceptions=True
+    )
+    rejections = [
+      outcome
+      for outcome in outcomes
+      if isinstance(outcome, errors.APIError) and outcome.code == 400
+    ]
+    if len(rejections) == len(parts) and all(e.message == error.message for e in rejections):
+      self._record_failure()
+      logger.error(
+        f"Embedding API refused a batch of {len(texts)} ({error.code} {error.status}): "
+        f"{error.message}"
+      )
+      return [None] * len(texts)
 
+    results: List[Optional[np.ndarray]] = []
+    for part, outcome in zip(parts, outcomes, strict=True):
+      if isinstance(outcome, errors.APIError) and outcome.code == 400:
+        self.circuit_breaker.record_success()
+        results += await self._bisect(part, outcome, priority)
+      elif isinstance(outcome, BaseException):
+        # Inconclusive (throttled, timed out); retry it the usual way.
+        results += await self._embed_batch(part, priority, probe=False)
+      else:
+        self.circuit_breaker.record_success()
+        self.rate_limiter.on_success()
+        results += parse_embeddings(outcome, len(part))
     return results
 
+  def _record_failure(self):
+    was_open = self.circuit_breaker.state == CircuitBreaker.OPEN
+    self.circuit_breaker.record_failure()
+    if not was_open and self.circuit_breaker.state == CircuitBreaker.OPEN:
+      logger.error(
+        f"⚡ Embedding API unhealthy, pausing calls for "
+        f"{self.circuit_breaker.reset_timeout:.0f}s"
+      )
+
   def embedding_to_bytes(self, embedding: np.ndarray) -> bytes:
     return embedding.tobytes()
 
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import discord
+
+from config import (
+  INDEX_COMPACT_INTERVAL,
+  INDEX_MAINTENANCE_INTERVAL,
+  INDEXING_SHUTDOWN_TIMEOUT,
+  TOMBSTONE_RETENTION,
+  VECTOR_COMPACT_DEAD_FRACTION,
+)
+from db import message_db
+from services.embedding_backfill import get_embedding_backfill_service
+from services.message_indexer import content_hash, get_message_indexer
+from utils.logging import get_logger
+
+logger = get_logger("maintenance")
+
+# Flushes an edit is retried for while its message is neither indexed nor
+# queued (it may have been stored between the two lookups). Edits to queued
+# messages are kept for as long as the job exists.
+EDIT_UNQUEUED_ROUNDS = 2
+
+
+class IndexMaintenanceService:
+  """Keeps the index in step with message edits and deletions.
+
+  Changes are buffered and applied in bulk every INDEX_MAINTENANCE_INTERVAL:
+  deletions as one transaction that tombstones the ids, edits as one update
+  that only touches messages whose content hash changed, followed by a
+  re-embed that reuses stored vectors for identical content. Vectors of
+  deleted and edited messages are masked out immediately and dropped from
+  the files by periodic compaction.
+  """
+
+  def __init__(self):
+    # message_id -> (content, content_hash, misses); a later edit replaces it
+    self._edits: Dict[str, Tuple[str, str, int]] = {}
+    self._deletes: set = set()
+    self._changed = asyncio.Event()
+    self.worker_task: Optional[asyncio.Task] = None
+    self._flush_task: Optional[asyncio.Task] = None
+    self.running = False
+    self.edited = 0
+    self.deleted = 0
+    self._last_compaction = time.monotonic()
+
+  def start(self):
+    if not self.running:
+      self.running = True
+      self.worker_task = asyncio.create_task(self._worker())
+
+  async def close(self):
+    """Stop the worker and apply whatever is still buffered."""
+    self.running = False
+    if self.worker_task:
+      self.worker_task.cancel()
+    try:
+      await asyncio.wait_for(self._drain(), timeout=INDEXING_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+      logger.warning("Shutting down with index edits still unapplied")
+
+  async def _drain(self):
+    # A flush the worker started has already taken its changes out of the
+    # buffers; let it finish before flushing what is left.
+    if self._flush_task is not None:
+      await asyncio.gather(self._flush_task, return_exceptions=True)
+    await self.flush()
+
+  def queue_edit(self, message: discord.Message):
+    content = message.content
+    if not content or not content.strip():
+      return
+    self._edits[str(message.id)] = (content, content_hash(content), 0)
+    self._changed.set()
+
+  def queue_deletes(self, message_ids: Iterable[int]):
+    self._deletes.update(str(message_id) for message_id in message_ids)
+    self._changed.set()
+
+  async def _worker(self):
+    while self.running:
+      try:
+        try:
+          await asyncio.wait_for(self._changed.wait(), timeout=INDEX_COMPACT_INTERVAL)
+          # Let a burst of changes (e.g. a purge) collect into one batch.
+          await asyncio.sleep(INDEX_MAINTENANCE_INTERVAL)
+        except asyncio.TimeoutError:
+          pass
+        self._changed.clear()
+        # Shielded so that close() can wait for it rather than cut it short.
+        self._flush_task = asyncio.create_task(self.flush())
+        await asyncio.shield(self._flush_task)
+
+        if time.monotonic() - self._last_compaction >= INDEX_COMPACT_INTERVAL:
+          await self.compact()
+
+      except asyncio.CancelledError:
+        break
+      except Exception as e:
+        logger.error(f"Index maintenance error: {e}")
+        await asyncio.sleep(INDEX_MAINTENANCE_INTERVAL)
+
+  async def flush(self):
+    deletes, self._deletes = self._deletes, set()
+    edits, self._edits = self._edits, {}
+    for message_id in deletes:
+      edits.pop(message_id, None)
+
+    if deletes:
+      try:
+        removed = await message_db.delete_messages(list(deletes))
+      except Exception:
+        self._requeue(deletes, edits)
+        raise
+      self.deleted += removed
+      if removed:
+        logger.info(f"🗑️ Removed {removed} deleted messages from the index")
+
+    if not edits:
+      return
+    try:
+      changed, missing = await message_db.update_message_contents(
+        [
+          (message_id, content, digest)
+          for message_id, (content, digest, _) in edits.items()
+        ]
+      )
+    except Exception:
+      self._requeue(set(), edits)
+      raise
+    if missing:
+      # Messages still waiting to be indexed get the new text in their job.
+      try:
+        jobs = await message_db.update_index_job_contents(
+          [(message_id, *edits[message_id][:2]) for message_id in missing]
+        )
+      except Exception:
+        self._requeue(set(), {message_id: edits[message_id] for message_id in missing})
+        raise
+      get_message_indexer().edit_queued(
+        {
+          job_id: edits[message_id][:2]
+          for message_id, job_ids in jobs.items()
+          for job_id in job_ids
+        }
+      )
+      for message_id in missing:
+        # A batch already being embedded stores the old text, so the edit is
+        # kept until the message is stored and it can be applied there.
+        content, digest, misses = edits[message_id]
+        if message_id in jobs:
+          self._edits.setdefault(message_id, (content, digest, 0))
+        elif misses + 1 < EDIT_UNQUEUED_ROUNDS:
+          self._edits.setdefault(message_id, (content, digest, misses + 1))
+    if self._edits:
+      self._changed.set()
+
+    if changed:
+      # Rows left unembedded here (API failing) are picked up by the backfill.
+      embedded = await get_embedding_backfill_service().embed_rows(changed)
+      self.edited += len(changed)
+      logger.info(f"✏️ Updated {len(changed)} edited messages ({embedded} re-embedded)")
+
+  def _requeue(self, deletes: set, edits: Dict[str, Tuple[str, str, int]]):
+    """Put changes a failed flush took back in the buffers (newer edits win)."""
+    self._deletes |= deletes
+    for message_id, edit in edits.items():
+      self._edits.setdefault(message_id, edit)
+
+  async def compact(self):
+    self._last_compaction = time.monotonic()
+    tombstones, files = await message_db.compact_index(
+      TOMBSTONE_RETENTION, VECTOR_COMPACT_DEAD_FRACTION
+    )
+    if tombstones or files:
+      logger.info(
+        f"🧹 Compaction: {tombstones} old tombstones dropped, {files} vector files rewritten"
+      )
+
+
+_index_maintenance: Optional[IndexMaintenanceService] = None
+
+
+def get_index_maintenance() -> IndexMaintenanceService:
+  global _index_maintenance
+  if _index_maintenance is None:
+    _index_maintenance = IndexMaintenanceService()
+  return _index_maintenance
@@ -1,140 +1,502 @@
 import asyncio
 import hashlib
-from typing import Optional
+import itertools
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Set, Tuple
 
 import discord
 
-from config import INDEXING_BATCH_SIZE, INDEXING_QUEUE_MAX_SIZE
+from config import (
+  EMBEDDING_BATCH_SIZE,
+  EMBEDDING_DIM,
+  INDEXING_BATCH_SIZE,
+  INDEXING_BULK_QUEUE_SIZE,
+  INDEXING_EMBED_WORKERS,
+  INDEXING_MAX_BATCH_AGE,
+  INDEXING_QUEUE_MAX_SIZE,
+  INDEXING_RETRY_DELAY,
+  INDEXING_SHUTDOWN_TIMEOUT,
+)
 from db import message_db
 from services.embedding_service import get_embedding_service
+from utils import metrics
+from utils.executors import run_in_process
 from utils.logging import get_logger
 
 logger = get_logger("indexer")
 
+LIVE_PRIORITY = 0
+BULK_PRIORITY = 1
+LANE_NAMES = {LIVE_PRIORITY: "live", BULK_PRIORITY: "bulk"}
+
+QUEUED = metrics.counter(
+  "indexer_messages_queued_total", "Messages durably queued for indexing", ["lane"]
+)
+SPILLED = metrics.counter(
+  "indexer_messages_spilled_total",
+  "Queued messages left on disk because the lane's memory queue was full",
+  ["lane"],
+)
+STORED = metrics.counter(
+  "indexer_messages_stored_total", "Indexed messages by insert result", ["result"]
+)
+REUSED = metrics.counter(
+  "indexer_embeddings_reused_total", "Messages that reused a stored embedding"
+)
+FAILED_BATCHES = metrics.counter(
+  "indexer_failed_batches_total", "Batches that could not be stored and were requeued"
+)
+QUEUE_DEPTH = metrics.gauge(
+  "indexer_queue_depth", "Messages waiting in a lane's memory queue", ["lane"]
+)
+LANE_SPILLED = metrics.gauge(
+  "indexer_lane_spilled", "1 while a lane has jobs on disk that are not in memory", ["lane"]
+)
+IN_FLIGHT = metrics.gauge("indexer_batches_in_flight", "Batches being embedded or stored")
+BATCH_SIZE = metrics.histogram(
+  "indexer_batch_size", "Messages per indexing batch", ["lane"], metrics.SIZE_BUCKETS
+)
+QUEUE_WAIT = metrics.histogram(
+  "indexer_queue_wait_seconds", "Time messages waited in memory before batching", ["lane"]
+)
+
+# Batches at least this large are hashed off the event loop.
+HASH_OFFLOAD_MIN_BATCH = 64
+
+
+def content_hash(content: str) -> str:
+  return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def hash_contents(contents: List[str]) -> List[str]:
+  return [content_hash(content) for content in contents]
+
+
+class IndexItem(NamedTuple):
+  """What the pipeline keeps of a discord.Message once it has been queued."""
+
+  message_id: str
+  channel_id: str
+  guild_id: str
+  author_id: str
+  author_name: str
+  content: str
+  content_hash: str
+  message_url: str
+  job_id: int = 0  # index_jobs row, deleted when the message is stored
+  queued_at: float = 0.0  # time.monotonic() when it entered the memory queue
+
+
+# (priority, sequence, items, embeddings by content hash)
+IndexBatch = Tuple[int, int, List[IndexItem], Dict[str, bytes]]
+
+
+class _Lane:
+  """One priority's in-memory queue, a hot cache over its index_jobs rows.
+
+  While `spilled` is set, rows exist on disk that are not in memory; new jobs
+  then go to disk only, so they are picked up in order after the older ones.
+  """
+
+  def __init__(self, priority: int, max_size: int):
+    self.priority = priority
+    self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+    self.spilled = True  # Replay whatever a previous run left behind
+    self.spill_epoch = 0
+    self.cursor = 0  # Highest job id read back from disk
+    self.pending: Set[int] = set()  # Job ids in memory or in flight
+    self.batch_target = INDEXING_BATCH_SIZE
+
+  def offer(self, item: IndexItem):
+    """Keep a just-persisted job in memory unless it has to wait its turn on disk."""
+    if not self.spilled and not self.queue.full():
+      self.queue.put_nowait(item._replace(queued_at=time.monotonic()))
+      self.pending.add(item.job_id)
+    else:
+      SPILLED.inc(lane=LANE_NAMES[self.priority])
+      self.spilled = True
+      self.spill_epoch += 1
+      self.cursor = min(self.cursor, item.job_id - 1)
+
+  async def load(self):
+    """Refill the empty memory queue from disk, in job order."""
+    epoch = self.spill_epoch
+    limit = self.queue.maxsize
+    jobs = await message_db.get_index_jobs(self.priority, self.cursor, limit)
+    for job in jobs:
+      self.cursor = max(self.cursor, job["id"])
+      if job["id"] in self.pending or self.queue.full():
+        continue
+      fields = (job[field] for field in IndexItem._fields[:-2])
+      self.queue.put_nowait(
+        IndexItem(*fields, job_id=job["id"], queued_at=time.monotonic())
+      )
+      self.pending.add(job["id"])
+    if len(jobs) < limit and epoch == self.spill_epoch:
+      self.spilled = False
+
+  def release(self, batch: List[IndexItem], failed: bool = False):
+    """Forget a finished batch; failed batches are read back from disk again."""
+    self.pending.difference_update(item.job_id for item in batch)
+    if failed and batch:
+      self.spilled = True
+      self.spill_epoch += 1
+      self.cursor = min(self.cursor, min(item.job_id for item in batch) - 1)
+
+  def adapt(self, batch_size: int):
+    """Grow batches toward EMBEDDING_BATCH_SIZE while a backlog remains, and
+    shrink them back once traffic no longer fills them."""
+    if batch_size >= self.batch_target and (self.queue.qsize() or self.spilled):
+      self.batch_target = min(EMBEDDING_BATCH_SIZE, self.batch_target * 2)
+    elif batch_size < self.batch_target:
+      self.batch_target = max(INDEXING_BATCH_SIZE, self.batch_target // 2)
+
 
 class MessageIndexer:
+  """Indexes messages through a staged pipeline joined by bounded queues.
+
+  queue_message normalizes and hashes each message into an IndexItem and
+  appends it to the durable index_jobs table; the in-memory queues only
+  cache the head of that table, and anything left over is replayed on
+  startup. A batcher groups items and looks up embeddings already stored for
+  identical content, INDEXING_EMBED_WORKERS workers embed the rest, and a
+  persister stores each batch and deletes its jobs in one transaction. Live
+  messages have their own lane and priority at every stage so they are never
+  stuck behind a bulk backfill.
+  """
+
   def __init__(self):
-    self.queue: asyncio.Queue = asyncio.Queue(maxsize=INDEXING_QUEUE_MAX_SIZE)
-    self.worker_task: Optional[asyncio.Task] = None
+    self.lanes = {
+      LIVE_PRIORITY: _Lane(LIVE_PRIORITY, INDEXING_QUEUE_MAX_SIZE),
+      BULK_PRIORITY: _Lane(BULK_PRIORITY, INDEXING_BULK_QUEUE_SIZE),
+    }
+    self.embed_queue: asyncio.PriorityQueue = asyncio.PriorityQueue(
+      maxsize=INDEXING_EMBED_WORKERS * 2
+    )
+    self.persist_queue: asyncio.PriorityQueue = asyncio.PriorityQueue(
+      maxsize=INDEXING_EMBED_WORKERS * 2
+    )
+    self.tasks: List[asyncio.Task] = []
     self.running = False
+    self.draining = False
+    self.in_flight = 0
     self.embedding_service = get_embedding_service()
+    self._has_items = asyncio.Event()
+    self._sequence = itertools.count()
+    # job id -> (content, content_hash) of edits to jobs already in memory
+    self._edits: Dict[int, Tuple[str, str]] = {}
+    self.batch_sizes: Deque[int] = deque(maxlen=200)
+    self.queue_waits: Deque[float] = deque(maxlen=2000)
+    for priority, lane in self.lanes.items():
+      QUEUE_DEPTH.track(lane.queue.qsize, lane=LANE_NAMES[priority])
+      LANE_SPILLED.track(lambda lane=lane: lane.spilled, lane=LANE_NAMES[priority])
+    IN_FLIGHT.track(lambda: self.in_flight)
+
+  @property
+  def backlog(self) -> int:
+    """Messages waiting in memory, plus one per lane with jobs left on disk."""
+    return sum(lane.queue.qsize() + lane.spilled for lane in self.lanes.values())
+
+  @property
+  def live_backlog(self) -> int:
+    """Like `backlog`, for the live lane only."""
+    lane = self.lanes[LIVE_PRIORITY]
+    return lane.queue.qsize() + lane.spilled
 
   def start(self):
     if not self.running:
       self.running = True
-      self.worker_task = asyncio.create_task(self._worker())
+      self.draining = False
+      self.tasks = [
+        asyncio.create_task(self._batcher()),
+        *(asyncio.create_task(self._embed_worker()) for _ in range(INDEXING_EMBED_WORKERS)),
+        asyncio.create_task(self._persister()),
+      ]
 
   def stop(self):
     self.running = False
-    if self.worker_task:
-      self.worker_task.cancel()
+    for task in self.tasks:
+      task.cancel()
 
-  async def queue_message(self, message: discord.Message):
-    try:
-      self.queue.put_nowait(message)
-      return True
-    except asyncio.QueueFull:
-      logger.warning(f"Queue full, dropping message {message.id}")
-      return False
+  async def close(self, timeout: float = INDEXING_SHUTDOWN_TIMEOUT):
+    """Let batches already being embedded finish, then stop.
 
-  def _calculate_hash(self, content: str) -> str:
-    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+    Queued jobs not yet started stay in index_jobs for the next run.
+    """
+    if not self.running:
+      return
+    self.draining = True
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while self.in_flight and loop.time() < deadline:
+      await asyncio.sleep(0.1)
+    self.stop()
+    await asyncio.gather(*self.tasks, return_exceptions=True)
+    if self.in_flight:
+      logger.warning(f"{self.in_flight} indexing batches left for the next start")
+
+  async def queue_message(self, message: discord.Message, live: bool = True) -> bool:
+    """Durably queue a message for indexing.
+
+    Live messages (from on_message) use the fast lane; history crawls pass
+    live=False. Nothing is dropped: when a lane's memory queue is full the
+    job waits in index_jobs.
+    """
+    return await self.queue_messages([message], live) == 1
+
+  async def queue_messages(self, messages: List[discord.Message], live: bool = True) -> int:
+    """Queue many messages with one index_jobs write; returns how many were queued."""
+    messages = [
+      message for message in messages if message.content and message.content.strip()
+    ]
+    if not messages:
+      return 0
+    contents = [message.content for message in messages]
+    if len(contents) >= HASH_OFFLOAD_MIN_BATCH:
+      hashes = await run_in_process(hash_contents, contents)
+    else:
+      hashes = hash_contents(contents)
+    items = [
+      self._to_item(message, hash_)
+      for message, hash_ in zip(messages, hashes, strict=True)
+    ]
+
+    lane = self.lanes[LIVE_PRIORITY if live else BULK_PRIORITY]
+    job_ids = await message_db.enqueue_index_jobs(
+      [{"priority": lane.priority, **item._asdict()} for item in items]
+    )
+    for item, job_id in zip(items, job_ids, strict=True):
+      lane.offer(item._replace(job_id=job_id))
+    self._has_items.set()
+    QUEUED.inc(len(items), lane=LANE_NAMES[lane.priority])
+    return len(items)
+
+  def edit_queued(self, edits: Dict[int, Tuple[str, str]]):
+    """New (content, content_hash) for queued jobs, by job id.
+
+    The index_jobs rows are updated by the caller; this covers jobs already
+    read into memory, which pick up the edit when they are batched.
+    """
+    for job_id, edit in edits.items():
+      if any(job_id in lane.pending for lane in self.lanes.values()):
+        self._edits[job_id] = edit
+
+  def _apply_edits(self, batch: List[IndexItem]) -> List[IndexItem]:
+    if not self._edits:
+      return batch
+    edited = []
+    for item in batch:
+      edit = self._edits.pop(item.job_id, None)
+      if edit is not None:
+        item = item._replace(content=edit[0], content_hash=edit[1])
+      edited.append(item)
+    return edited
 
   def _create_message_url(self, message: discord.Message) -> str:
     return f"https://discord.com/channels/{message.guild.id}/{message.channel.id}/{message.id}"
 
-  async def _worker(self):
-    batch = []
+  def _to_item(self, message: discord.Message, content_hash: str) -> IndexItem:
+    return IndexItem(
+      message_id=str(message.id),
+      channel_id=str(message.channel.id),
+      guild_id=str(message.guild.id) if message.guild else "DM",
+      author_id=str(message.author.id),
+      author_name=message.author.display_name,
+      content=message.content,
+      content_hash=content_hash,
+      message_url=self._create_message_url(message),
+    )
+
+  async def _next_batch(self) -> Tuple[List[IndexItem], int]:
+    live, bulk = self.lanes[LIVE_PRIORITY], self.lanes[BULK_PRIORITY]
+    while True:
+      for lane in (live, bulk):
+        if lane.queue.empty() and lane.spilled:
+          await lane.load()
+      if not (live.queue.empty() and bulk.queue.empty()):
+        break
+      self._has_items.clear()
+      await self._has_items.wait()
 
-    while self.running:
-      try:
+    lane = live if not live.queue.empty() else bulk
+    batch = [lane.queue.get_nowait()]
+    # Flush when full or once the oldest message has waited INDEXING_MAX_BATCH_AGE.
+    deadline = batch[0].queued_at + INDEXING_MAX_BATCH_AGE
+    try:
+      while len(batch) < lane.batch_target:
+        if lane.queue.empty() and lane.spilled:
+          await lane.load()
+        if not lane.queue.empty():
+          batch.append(lane.queue.get_nowait())
+          continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or (lane is bulk and not live.queue.empty()):
+          break
         try:
-          message = await asyncio.wait_for(self.queue.get(), timeout=1.0)
-          batch.append(message)
+          batch.append(await asyncio.wait_for(lane.queue.get(), timeout=remaining))
         except asyncio.TimeoutError:
-          if batch:
-            await self._process_batch(batch)
-            batch = []
-          continue
-
-        if len(batch) >= INDEXING_BATCH_SIZE:
-          await self._process_batch(batch)
-          batch = []
-
+          break
+    except BaseException:
+      # Items already taken off the queue are read back from disk later.
+      lane.release(batch, failed=True)
+      raise
+
+    lane.adapt(len(batch))
+    self._record_batch(batch, LANE_NAMES[lane.priority])
+    return batch, lane.priority
+
+  def _record_batch(self, batch: List[IndexItem], lane: str):
+    now = time.monotonic()
+    waits = [now - item.queued_at for item in batch]
+    self.batch_sizes.append(len(batch))
+    self.queue_waits.extend(waits)
+    BATCH_SIZE.observe(len(batch), lane=lane)
+    for wait in waits:
+      QUEUE_WAIT.observe(wait, lane=lane)
+
+  def batch_stats(self) -> Dict[str, float]:
+    """Recent batch sizes and seconds messages waited in memory before batching."""
+    sizes = sorted(self.batch_sizes)
+    waits = sorted(self.queue_waits)
+    return {
+      "batches": len(sizes),
+      "mean_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+      "live_batch_target": self.lanes[LIVE_PRIORITY].batch_target,
+      "bulk_batch_target": self.lanes[BULK_PRIORITY].batch_target,
+      "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+      "p95_wait": waits[int(len(waits) * 0.95)] if waits else 0.0,
+    }
+
+  async def _batcher(self):
+    while self.running and not self.draining:
+      batch, priority = [], LIVE_PRIORITY
+      try:
+        batch, priority = await self._next_batch()
+        batch = self._apply_edits(batch)
+        self.in_flight += 1
+        # Embeddings are content-addressed: text already embedded anywhere
+        # reuses that vector instead of a new API call.
+        embeddings_by_hash = await message_db.get_embeddings_by_hash(
+          [item.content_hash for item in batch], EMBEDDING_DIM
+        )
+        await self.embed_queue.put(
+          (priority, next(self._sequence), batch, embeddings_by_hash)
+        )
       except asyncio.CancelledError:
-        if batch:
-          await self._process_batch(batch)
         break
       except Exception as e:
-        logger.error(f"Worker error: {e}")
-
-    if batch:
-      await self._process_batch(batch)
-
-  async def _process_batch(self, batch: list):
-    valid_messages = []
-    message_data = []
-
-    for msg in batch:
-      if not msg.content or not msg.content.strip():
-        continue
-
-      content_hash = self._calculate_hash(msg.content)
-      message_data.append(
-        {
-          "message": msg,
-          "content_hash": content_hash,
-          "message_url": self._create_message_url(msg),
-        }
-      )
-      valid_messages.append(msg)
-
-    if not valid_messages:
-      return
-
-    content_hashes = [data["content_hash"] for data in message_data]
-    existing_hashes = await message_db.get_existing_hashes(content_hashes)
-
-    to_index = []
-    for data in message_data:
-      if data["content_hash"] in existing_hashes:
-        logger.debug(f"Skipping duplicate: {data['message'].id}")
-      else:
-        to_index.append(data)
+        logger.error(f"Batcher error: {e}")
+        if batch:
+          self._finish(priority, batch, failed=True)
+        try:
+          await asyncio.sleep(INDEXING_RETRY_DELAY)
+        except asyncio.CancelledError:
+          break
 
-    if not to_index:
+  async def _embed_worker(self):
+    while self.running:
+      try:
+        priority, sequence, batch, embeddings_by_hash = await self.embed_queue.get()
+      except asyncio.CancelledError:
+        break
+      handed_off = False
+      try:
+        await self._embed(batch, embeddings_by_hash)
+        await self.persist_queue.put((priority, sequence, batch, embeddings_by_hash))
+        handed_off = True
+      except asyncio.CancelledError:
+        break
+      except Exception as e:
+        logger.error(f"Embed worker error: {e}")
+      finally:
+        # A batch that never reached the persister goes back to disk.
+        if not handed_off:
+          self._finish(priority, batch, failed=True)
+
+  async def _embed(self, batch: List[IndexItem], embeddings_by_hash: Dict[str, bytes]):
+    """Embed each distinct text in `batch` that has no stored embedding yet."""
+    to_embed: Dict[str, str] = {}
+    for item in batch:
+      if item.content_hash not in embeddings_by_hash:
+        to_embed.setdefault(item.content_hash, item.content)
+
+    logger.info(
+      f"📝 Indexing batch of {len(batch)} messages "
+      f"({len(to_embed)} to embed, {len(batch) - len(to_embed)} reused)"
+    )
+    REUSED.inc(len(batch) - len(to_embed))
+    if not to_embed:
       return
 
-    logger.info(f"📝 Indexing batch of {len(to_index)} messages")
-
-    texts = [data["message"].content for data in to_index]
-    embeddings = await self.embedding_service.generate_embeddings_batch(texts)
+    embeddings = await self.embedding_service.generate_embeddings_batch(
+      list(to_embed.values())
+    )
+    for content_hash, embedding in zip(to_embed, embeddings, strict=True):
+      if embedding is not None:
+        embeddings_by_hash[content_hash] = self.embedding_service.embedding_to_bytes(
+          embedding
+        )
 
-    for data, embedding in zip(to_index, embeddings, strict=True):
+  def _finish(self, priority: int, batch: List[IndexItem], failed: bool):
+    """Release a batch that left the pipeline. A failed one is read back from
+    index_jobs after INDEXING_RETRY_DELAY, even if nothing new is queued."""
+    self.lanes[priority].release(batch, failed=failed)
+    self.in_flight -= 1
+    for item in batch:
+      self._edits.pop(item.job_id, None)
+    if failed and batch and self.running:
+      asyncio.get_running_loop().call_later(INDEXING_RETRY_DELAY, self._has_items.set)
+
+  async def _persister(self):
+    while self.running:
       try:
-        msg = data["message"]
-        embedding_bytes = None
-        if embedding is not None:
-          embedding_bytes = self.embedding_service.embedding_to_bytes(embedding)
-
-        inserted = await message_db.insert_message(
-          message_id=str(msg.id),
-          channel_id=str(msg.channel.id),
-          guild_id=str(msg.guild.id) if msg.guild else "DM",
-          author_id=str(msg.author.id),
-          content=msg.content,
-          content_hash=data["content_hash"],
-          embedding=embedding_bytes,
-          message_url=data["message_url"],
-        )
+        priority, _, batch, embeddings_by_hash = await self.persist_queue.get()
+        stored = False
+        try:
+          stored = await self._persist(batch, embeddings_by_hash)
+        finally:
+          self._finish(priority, batch, failed=not stored)
+      except asyncio.CancelledError:
+        break
+      except Exception as e:
+        logger.error(f"Persister error: {e}")
+
+  async def _persist(
+    self, batch: List[IndexItem], embeddings_by_hash: Dict[str, bytes]
+  ) -> bool:
+    rows = [
+      {
+        "message_id": item.message_id,
+        "channel_id": item.channel_id,
+        "guild_id": item.guild_id,
+        "author_id": item.author_id,
+        "content": item.content,
+        "content_hash": item.content_hash,
+        "embedding": embeddings_by_hash.get(item.content_hash),
+        "message_url": item.message_url,
+        "job_id": item.job_id,
+      }
+      for item in batch
+    ]
+
+    try:
+      inserted_flags = await message_db.insert_messages_bulk(rows)
+    except Exception as e:
+      logger.error(f"Error inserting batch of {len(rows)} messages: {e}")
+      FAILED_BATCHES.inc()
+      return False
 
-        if inserted:
-          logger.info(f"✅ Indexed: [{msg.author.display_name}] {msg.content[:50]}...")
-        else:
-          logger.warning(f"Failed to insert message {msg.id}")
+    inserted_count = sum(inserted_flags)
+    STORED.inc(inserted_count, result="inserted")
+    STORED.inc(len(rows) - inserted_count, result="duplicate")
 
-      except Exception as e:
-        logger.error(f"Error processing message {data['message'].id}: {e}")
+    for item, inserted in zip(batch, inserted_flags, strict=True):
+      if inserted:
+        logger.info(f"✅ Indexed: [{item.author_name}] {item.content[:50]}...")
+      else:
+        logger.debug(f"Already indexed: {item.message_id}")
+    return True
 
 
 _message_indexer: Optional[MessageIndexer] = None
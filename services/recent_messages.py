@@ -0,0 +1,119 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import discord
+
+from config import CHAT_CONTEXT_MAX_MESSAGES, RECENT_MESSAGES_PER_CHANNEL
+from utils.logging import get_logger
+
+logger = get_logger("recent")
+
+
+class RecentMessage(NamedTuple):
+  message_id: int
+  timestamp: datetime
+  author: str
+  content: str
+
+
+class RecentMessageBuffer:
+  """Bounded per-channel buffer of recent non-bot messages.
+
+  Filled from on_message as messages arrive. A channel's buffer is seeded from
+  its history once, the first time it is read, so /chat needs no Discord API
+  calls after that.
+  """
+
+  def __init__(self, per_channel: int = RECENT_MESSAGES_PER_CHANNEL):
+    self.per_channel = per_channel
+    self._channels: Dict[int, Deque[RecentMessage]] = {}
+    self._seeding: Dict[int, asyncio.Task] = {}
+    self._seeded: set = set()
+
+  def _buffer(self, channel_id: int) -> Deque[RecentMessage]:
+    buffer = self._channels.get(channel_id)
+    if buffer is None:
+      buffer = self._channels[channel_id] = deque(maxlen=self.per_channel)
+    return buffer
+
+  def record(self, message: discord.Message):
+    if message.author.bot:
+      return
+    self._buffer(message.channel.id).append(
+      RecentMessage(
+        message.id, message.created_at, message.author.display_name, message.content
+      )
+    )
+
+  def edit(self, channel_id: int, message_id: int, content: str):
+    buffer = self._channels.get(channel_id, ())
+    for i, entry in enumerate(buffer):
+      if entry.message_id == message_id:
+        buffer[i] = entry._replace(content=content)
+
+  def forget(self, channel_id: int, message_ids: Iterable[int]):
+    buffer = self._channels.get(channel_id)
+    if buffer:
+      message_ids = set(message_ids)
+      kept = [entry for entry in buffer if entry.message_id not in message_ids]
+      buffer.clear()
+      buffer.extend(kept)
+
+  async def _seed(self, channel: discord.TextChannel):
+    seeded = []
+    try:
+      async for msg in channel.history(limit=self.per_channel):
+        if not msg.author.bot:
+          seeded.append(
+            RecentMessage(msg.id, msg.created_at, msg.author.display_name, msg.content)
+          )
+    except discord.HTTPException as e:
+      logger.warning(f"Could not seed recent messages for #{channel.name}: {e}")
+
+    # Messages recorded while the history request was in flight may overlap.
+    buffer = self._buffer(channel.id)
+    merged = {entry.message_id: entry for entry in seeded}
+    merged.update((entry.message_id, entry) for entry in buffer)
+    buffer.clear()
+    buffer.extend(sorted(merged.values(), key=lambda entry: entry.timestamp))
+    self._seeded.add(channel.id)
+
+  async def _ensure_seeded(self, channel: discord.TextChannel):
+    if channel.id in self._seeded:
+      return
+    task = self._seeding.get(channel.id)
+    if task is None:
+      task = self._seeding[channel.id] = asyncio.create_task(self._seed(channel))
+      task.add_done_callback(lambda _: self._seeding.pop(channel.id, None))
+    await task
+
+  async def get_guild_recent(
+    self, guild: discord.Guild, limit: int = CHAT_CONTEXT_MAX_MESSAGES
+  ) -> List[Tuple[str, RecentMessage]]:
+    """(channel name, RecentMessage) pairs across readable channels, oldest first."""
+    channels = [
+      channel
+      for channel in guild.text_channels
+      if channel.permissions_for(guild.me).read_message_history
+    ]
+    await asyncio.gather(*(self._ensure_seeded(channel) for channel in channels))
+
+    entries = [
+      (channel.name, entry)
+      for channel in channels
+      for entry in self._channels.get(channel.id, ())
+    ]
+    entries.sort(key=lambda item: item[1].timestamp)
+    return entries[-limit:]
+
+
+_recent_messages: Optional[RecentMessageBuffer] = None
+
+
+def get_recent_messages() -> RecentMessageBuffer:
+  global _recent_messages
+  if _recent_messages is None:
+    _recent_messages = RecentMessageBuffer()
+  return _recent_messages
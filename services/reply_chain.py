@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+import discord
+
+from config import REPLY_CHAIN_CACHE_SIZE, REPLY_CHAIN_MAX_DEPTH
+from db import message_db
+from utils.logging import get_logger
+
+logger = get_logger("reply_chain")
+
+
+class ChainMessage(NamedTuple):
+  message_id: int
+  author_id: int
+  author_name: str
+  content: str
+  reply_to_id: Optional[int]
+
+
+def _from_message(message: discord.Message) -> ChainMessage:
+  reference = message.reference
+  return ChainMessage(
+    message.id,
+    message.author.id,
+    message.author.display_name,
+    message.content,
+    reference.message_id if reference else None,
+  )
+
+
+def _from_turn(turn: dict) -> ChainMessage:
+  reply_to_id = turn["reply_to_id"]
+  return ChainMessage(
+    int(turn["message_id"]),
+    int(turn["author_id"]),
+    turn["author_name"],
+    turn["content"],
+    int(reply_to_id) if reply_to_id else None,
+  )
+
+
+class ReplyChainResolver:
+  """Walks message.reference chains, fetching from Discord only as a last resort.
+
+  Each hop is looked up in order: a local LRU of recently seen and sent
+  messages, the resolved reference on the message, discord.py's message cache,
+  the persisted bot conversation turns, and finally channel.fetch_message.
+  """
+
+  def __init__(self, client: discord.Client, max_size: int = REPLY_CHAIN_CACHE_SIZE):
+    self.client = client
+    self.max_size = max_size
+    self._recent: "OrderedDict[int, ChainMessage]" = OrderedDict()
+    self.fetches = 0
+
+  def remember(self, message: discord.Message, content: Optional[str] = None):
+    entry = _from_message(message)
+    if content is not None:
+      entry = entry._replace(content=content)
+    self._recent[entry.message_id] = entry
+    self._recent.move_to_end(entry.message_id)
+    while len(self._recent) > self.max_size:
+      self._recent.popitem(last=False)
+
+  async def record_turn(self, prompt: discord.Message, reply: discord.Message, content: str):
+    """Remember and persist one exchange: the user's message and the bot's reply.
+
+    `content` is the full response, which may span several Discord messages.
+    """
+    self.remember(prompt)
+    self.remember(reply, content)
+    turns = [
+      {
+        "message_id": str(entry.message_id),
+        "channel_id": str(prompt.channel.id),
+        "author_id": str(entry.author_id),
+        "author_name": entry.author_name,
+        "content": entry.content,
+        "reply_to_id": str(entry.reply_to_id) if entry.reply_to_id else None,
+      }
+      for entry in (self._recent[prompt.id], self._recent[reply.id])
+    ]
+    try:
+      await message_db.save_conversation_turns(turns)
+    except Exception as e:
+      logger.error(f"Failed to persist conversation turn: {e}")
+
+  async def _lookup(
+    self, channel: discord.abc.Messageable, message_id: int
+  ) -> Optional[ChainMessage]:
+    entry = self._recent.get(message_id)
+    if entry is not None:
+      self._recent.move_to_end(message_id)
+      return entry
+
+    cached = discord.utils.get(self.client.cached_messages, id=message_id)
+    if cached is not None:
+      return _from_message(cached)
+
+    turn = await message_db.get_conversation_turn(str(message_id))
+    if turn is not None:
+      return _from_turn(turn)
+
+    try:
+      self.fetches += 1
+      fetched = await channel.fetch_message(message_id)
+    except (discord.NotFound, discord.Forbidden):
+      return None
+    self.remember(fetched)
+    return self._recent[message_id]
+
+  async def resolve(
+    self, message: discord.Message, max_depth: int = REPLY_CHAIN_MAX_DEPTH
+  ) -> List[ChainMessage]:
+    """Messages `message` replies to, oldest first, up to `max_depth` hops."""
+    chain: List[ChainMessage] = []
+    reference = message.reference
+    if not reference or not reference.message_id:
+      return chain
+
+    # The LRU holds the bot's full responses, not just their first chunk.
+    if reference.message_id not in self._recent and isinstance(
+      reference.resolved, discord.Message
+    ):
+      entry = _from_message(reference.resolved)
+    else:
+      entry = await self._lookup(message.channel, reference.message_id)
+
+    while entry is not None:
+      chain.append(entry)
+      if len(chain) >= max_depth or not entry.reply_to_id:
+        break
+      entry = await self._lookup(message.channel, entry.reply_to_id)
+
+    chain.reverse()
+    return chain
+
+
+_reply_chain_resolver: Optional[ReplyChainResolver] = None
+
+
+def get_reply_chain_resolver(client: discord.Client) -> ReplyChainResolver:
+  global _reply_chain_resolver
+  if _reply_chain_resolver is None:
+    _reply_chain_resolver = ReplyChainResolver(client)
+  return _reply_chain_resolver
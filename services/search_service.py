@@ -1,43 +1,186 @@
-from typing import List, Optional, Tuple
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
 
-from config import DEFAULT_SEARCH_LIMIT
+import numpy as np
+
+from config import (
+  DEFAULT_SEARCH_LIMIT,
+  QUERY_EMBEDDING_CACHE_SIZE,
+  QUERY_EMBEDDING_CACHE_TTL,
+  SEARCH_EMBEDDING_TIMEOUT,
+  SEARCH_MODE,
+  SEARCH_RESULT_CACHE_SIZE,
+  SEARCH_RESULT_CACHE_TTL,
+  SEARCH_RRF_K,
+)
 from db import message_db
 from services.embedding_service import get_embedding_service
+from utils import metrics, tracing
+from utils.cache import TTLCache
 from utils.logging import get_logger
 
 logger = get_logger("search")
 
+SEARCH_SECONDS = metrics.histogram(
+  "search_seconds", "End-to-end message search latency", ["mode", "result"]
+)
+SEARCH_CACHE_LOOKUPS = metrics.counter(
+  "search_cache_lookups_total", "Search cache lookups", ["cache", "result"]
+)
+SEARCH_CACHE_ENTRIES = metrics.gauge("search_cache_entries", "Search cache size", ["cache"])
+
+SearchResult = Tuple[str, str, float]
+
+
+def reciprocal_rank_fusion(
+  result_lists: List[List[SearchResult]], limit: int, k: int = SEARCH_RRF_K
+) -> List[SearchResult]:
+  """Merge ranked lists by summed 1 / (k + rank), keyed by message URL.
+
+  Scores are scaled so a result ranked first in every list scores 1.0.
+  """
+  fused: Dict[str, float] = {}
+  contents: Dict[str, str] = {}
+  for results in result_lists:
+    for rank, (url, content, _score) in enumerate(results, 1):
+      fused[url] = fused.get(url, 0.0) + 1.0 / (k + rank)
+      contents[url] = content
+
+  best_possible = len(result_lists) / (k + 1)
+  ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+  return [(url, contents[url], score / best_possible) for url, score in ranked]
+
+
+def normalize_query(query: str) -> str:
+  return " ".join(query.lower().split())
+
 
 class SearchService:
   def __init__(self):
     self.embedding_service = get_embedding_service()
+    self.embedding_cache = TTLCache(QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL)
+    # Keyed by the guild's index version, so any change to the guild's
+    # messages makes its old entries unreachable.
+    self.result_cache = TTLCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL)
+    for name, cache in (
+      ("query_embeddings", self.embedding_cache),
+      ("results", self.result_cache),
+    ):
+      SEARCH_CACHE_LOOKUPS.track(lambda cache=cache: cache.hits, cache=name, result="hit")
+      SEARCH_CACHE_LOOKUPS.track(lambda cache=cache: cache.misses, cache=name, result="miss")
+      SEARCH_CACHE_ENTRIES.track(lambda cache=cache: len(cache), cache=name)
 
   async def search_messages(
-    self, query: str, guild_id: Optional[str] = None, limit: int = DEFAULT_SEARCH_LIMIT
-  ) -> List[Tuple[str, str, float]]:
-    """Returns list of (message_url, content, similarity_score)."""
+    self,
+    query: str,
+    guild_id: Optional[str] = None,
+    limit: int = DEFAULT_SEARCH_LIMIT,
+    mode: str = SEARCH_MODE,
+  ) -> List[SearchResult]:
+    """Returns list of (message_url, content, similarity_score).
+
+    `mode` is "hybrid" (BM25 and vector results fused), "vector" or "lexical".
+    Hybrid search falls back to lexical results alone when the query cannot be
+    embedded in time.
+    """
     if not query or not query.strip():
       return []
 
-    logger.info(f"🔍 Searching: {query[:50]}...")
+    start = time.perf_counter()
+    cache_key = (
+      guild_id,
+      normalize_query(query),
+      limit,
+      mode,
+      message_db.get_index_version(guild_id),
+    )
+    cached = self.result_cache.get(cache_key)
+    if cached is not None:
+      logger.info(f"🔍 Cached results ({mode}): {query[:50]}...")
+      SEARCH_SECONDS.observe(time.perf_counter() - start, mode=mode, result="cached")
+      return cached
 
-    query_embedding = await self.embedding_service.generate_embedding(query)
-    if query_embedding is None:
-      logger.warning("Failed to generate query embedding")
-      return []
+    logger.info(f"🔍 Searching ({mode}): {query[:50]}...")
 
-    results = await message_db.search_similar_messages(
-      query_embedding=query_embedding,
-      guild_id=guild_id,
-      limit=limit,
-    )
+    # Degraded results (no query embedding) are not cached.
+    complete = True
+    if mode == "lexical":
+      results = await self._search_lexical(query, guild_id, limit)
+    elif mode == "vector":
+      vector = await self._search_vector(query, guild_id, limit)
+      complete = vector is not None
+      results = vector or []
+    else:
+      candidates = limit * 2
+      lexical, vector = await asyncio.gather(
+        self._search_lexical(query, guild_id, candidates),
+        self._search_vector(query, guild_id, candidates),
+      )
+      if vector is None:
+        logger.warning("Vector search unavailable, using lexical results only")
+        complete = False
+        results = lexical[:limit]
+      else:
+        results = reciprocal_rank_fusion([vector, lexical], limit)
 
+    if complete:
+      self.result_cache.set(cache_key, results)
+    SEARCH_SECONDS.observe(
+      time.perf_counter() - start, mode=mode, result="complete" if complete else "degraded"
+    )
     logger.info(f"🔍 Found {len(results)} results")
     return results
 
+  async def _embed_query(self, query: str) -> Optional[np.ndarray]:
+    key = query.strip()
+    embedding = self.embedding_cache.get(key)
+    if embedding is None:
+      embedding = await asyncio.wait_for(
+        self.embedding_service.generate_embedding(query),
+        timeout=SEARCH_EMBEDDING_TIMEOUT,
+      )
+      if embedding is not None:
+        self.embedding_cache.set(key, embedding)
+    return embedding
+
+  def cache_stats(self) -> Dict[str, Dict[str, float]]:
+    return {
+      "query_embeddings": self.embedding_cache.stats(),
+      "results": self.result_cache.stats(),
+    }
+
+  async def _search_vector(
+    self, query: str, guild_id: Optional[str], limit: int
+  ) -> Optional[List[SearchResult]]:
+    """Vector results, or None when the query embedding could not be generated."""
+    try:
+      with tracing.span("embed_query"):
+        query_embedding = await self._embed_query(query)
+    except asyncio.TimeoutError:
+      logger.warning("Query embedding timed out")
+      return None
+
+    if query_embedding is None:
+      logger.warning("Failed to generate query embedding")
+      return None
+
+    with tracing.span("vector"):
+      return await message_db.search_similar_messages(
+        query_embedding=query_embedding,
+        guild_id=guild_id,
+        limit=limit,
+      )
+
+  async def _search_lexical(
+    self, query: str, guild_id: Optional[str], limit: int
+  ) -> List[SearchResult]:
+    with tracing.span("lexical"):
+      return await message_db.search_lexical(query, guild_id=guild_id, limit=limit)
+
   async def search_messages_with_content(
     self, query: str, guild_id: Optional[str] = None, limit: int = DEFAULT_SEARCH_LIMIT
-  ) -> List[Tuple[str, str, float]]:
+  ) -> List[SearchResult]:
     """Alias for search_messages - returns (url, content, score)."""
     return await self.search_messages(query, guild_id, limit)
 
@@ -0,0 +1,40 @@
+import numpy as np
+
+from db.ann_index import IVFIndex
+from db.vector_file import VectorFile
+from db.vector_store import GuildVectors, normalize_rows
+
+DIM = 64
+ROWS = 4000
+NLIST = 64  # ~sqrt(ROWS), as ANN_NLIST = 0 picks
+NPROBE = 16  # config.ANN_NPROBE
+LIMIT = 10
+MIN_RECALL = 0.9
+
+
+def clustered_vectors(rng: np.random.Generator, count: int) -> np.ndarray:
+  """Points around random topic centres, like embeddings of chat messages."""
+  centres = rng.standard_normal((32, DIM)).astype(np.float32)
+  labels = rng.integers(0, len(centres), count)
+  noise = rng.standard_normal((count, DIM)).astype(np.float32) * 0.5
+  return normalize_rows(centres[labels] + noise)[0]
+
+
+def test_ivf_recall_against_exact_search(tmp_path):
+  rng = np.random.default_rng(7)
+  vectors = clustered_vectors(rng, ROWS)
+  vector_file = VectorFile.create(str(tmp_path / "guild.64"), DIM)
+  vector_file.append(np.arange(1, ROWS + 1), vectors)
+
+  guild = GuildVectors(vector_file, np.ones(ROWS, dtype=bool))
+  guild.ann = IVFIndex.build(vectors, NLIST)
+
+  queries = clustered_vectors(rng, 50)
+  hits = 0
+  for query in queries:
+    exact = {row_id for row_id, _ in guild.search(query, LIMIT)}
+    approximate = {row_id for row_id, _ in guild.search(query, LIMIT, nprobe=NPROBE)}
+    hits += len(exact & approximate)
+
+  recall = hits / (len(queries) * LIMIT)
+  assert recall >= MIN_RECALL, f"IVF recall@{LIMIT} is {recall:.2f}"
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+
+from config import EMBEDDING_DIM
+from db import message_db
+from services import embedding_backfill, embedding_service, message_indexer
+from services.index_maintenance import EDIT_UNQUEUED_ROUNDS, IndexMaintenanceService
+from services.message_indexer import MessageIndexer, content_hash
+
+# More maintenance flushes than any fixed retry cap, all while the message's
+# batch is still being embedded.
+FLUSHES_WHILE_EMBEDDING = EDIT_UNQUEUED_ROUNDS + 3
+TIMEOUT = 10.0
+
+
+class SlowEmbedder:
+  """Stands in for EmbeddingService; the first call waits until released."""
+
+  def __init__(self):
+    self.started = asyncio.Event()
+    self.release = asyncio.Event()
+
+  async def generate_embeddings_batch(self, texts, priority=None):
+    if not self.started.is_set():
+      self.started.set()
+      await self.release.wait()
+    return [np.ones(EMBEDDING_DIM, dtype=np.float32) for _ in texts]
+
+  def embedding_to_bytes(self, embedding: np.ndarray) -> bytes:
+    return embedding.tobytes()
+
+
+def discord_message(content: str) -> SimpleNamespace:
+  return SimpleNamespace(
+    id=1001,
+    content=content,
+    channel=SimpleNamespace(id=20),
+    guild=SimpleNamespace(id=30),
+    author=SimpleNamespace(id=40, display_name="author"),
+  )
+
+
+async def edit_while_embedding(indexer: MessageIndexer, embedder: SlowEmbedder):
+  await message_db.init_db()
+  maintenance = IndexMaintenanceService()
+  indexer.start()
+  try:
+    await indexer.queue_message(discord_message("before"))
+    await asyncio.wait_for(embedder.started.wait(), TIMEOUT)
+
+    # The batch is past the point where queued edits are applied to it.
+    maintenance.queue_edit(discord_message("after"))
+    for _ in range(FLUSHES_WHILE_EMBEDDING):
+      await maintenance.flush()
+
+    embedder.release.set()
+    async with asyncio.timeout(TIMEOUT):
+      while await message_db.count_index_jobs():
+        await asyncio.sleep(0.05)
+    await maintenance.flush()
+
+    stored = await message_db.get_message_by_hash(content_hash("after"))
+    assert stored is not None, "edit was dropped while its message was being embedded"
+    assert stored["content"] == "after"
+    assert await message_db.get_message_by_hash(content_hash("before")) is None
+    assert await message_db.count_messages_without_embeddings() == 0
+  finally:
+    await indexer.close(timeout=1.0)
+    await message_db.close_db()
+
+
+def test_edit_during_embedding_is_applied_once_stored(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)  # DB_PATH and VECTOR_DIR are relative
+  embedder = SlowEmbedder()
+  monkeypatch.setattr(embedding_service, "_embedding_service", embedder)
+  monkeypatch.setattr(embedding_backfill, "_embedding_backfill_service", None)
+  indexer = MessageIndexer()
+  monkeypatch.setattr(message_indexer, "_message_indexer", indexer)
+
+  asyncio.run(edit_while_embedding(indexer, embedder))
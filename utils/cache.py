@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+  """Bounded LRU cache whose entries also expire `ttl` seconds after insertion."""
+
+  def __init__(self, max_size: int, ttl: float):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def get(self, key: Hashable) -> Optional[Any]:
+    entry = self._entries.get(key)
+    if entry is None or entry[0] < time.monotonic():
+      if entry is not None:
+        del self._entries[key]
+      self.misses += 1
+      return None
+    self._entries.move_to_end(key)
+    self.hits += 1
+    return entry[1]
+
+  def set(self, key: Hashable, value: Any):
+    if self.max_size <= 0:
+      return
+    self._entries[key] = (time.monotonic() + self.ttl, value)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+  def clear(self):
+    self._entries.clear()
+
+  def stats(self) -> Dict[str, float]:
+    lookups = self.hits + self.misses
+    return {
+      "size": len(self._entries),
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": self.hits / lookups if lookups else 0.0,
+    }
@@ -0,0 +1,58 @@
+import time
+
+
+class CircuitBreaker:
+  """Stops calls to an unhealthy dependency until it has had time to recover.
+
+  After `failure_threshold` consecutive failures the circuit opens and
+  `allow()` refuses calls for `reset_timeout` seconds. Then a single trial
+  call is let through (half-open): success closes the circuit, failure opens
+  it again.
+  """
+
+  CLOSED = "closed"
+  OPEN = "open"
+  HALF_OPEN = "half_open"
+
+  def __init__(self, failure_threshold: int, reset_timeout: float):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.state = self.CLOSED
+    self.failures = 0
+    self.opened_at = 0.0
+    self.rejected = 0
+    self._trial_in_flight = False
+
+  def allow(self) -> bool:
+    if self.state == self.OPEN:
+      if time.monotonic() - self.opened_at < self.reset_timeout:
+        self.rejected += 1
+        return False
+      self.state = self.HALF_OPEN
+      self._trial_in_flight = False
+    if self.state == self.HALF_OPEN:
+      if self._trial_in_flight:
+        self.rejected += 1
+        return False
+      self._trial_in_flight = True
+    return True
+
+  def release_trial(self):
+    """Free the half-open trial slot after a trial that ended without a verdict.
+
+    E.g. the caller was cancelled; the next call gets to try instead.
+    """
+    if self.state == self.HALF_OPEN:
+      self._trial_in_flight = False
+
+  def record_success(self):
+    self.state = self.CLOSED
+    self.failures = 0
+    self._trial_in_flight = False
+
+  def record_failure(self):
+    self.failures += 1
+    if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+      self.state = self.OPEN
+      self.opened_at = time.monotonic()
+    self._trial_in_flight = False
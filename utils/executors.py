@@ -0,0 +1,60 @@
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from config import CPU_PROCESS_WORKERS, CPU_THREAD_WORKERS
+
+T = TypeVar("T")
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+  global _thread_pool
+  if _thread_pool is None:
+    _thread_pool = ThreadPoolExecutor(
+      max_workers=CPU_THREAD_WORKERS, thread_name_prefix="cpu"
+    )
+  return _thread_pool
+
+
+def _get_process_pool() -> Optional[ProcessPoolExecutor]:
+  global _process_pool
+  if _process_pool is None and CPU_PROCESS_WORKERS > 0:
+    _process_pool = ProcessPoolExecutor(max_workers=CPU_PROCESS_WORKERS)
+  return _process_pool
+
+
+async def run_cpu(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+  """Run NumPy/BLAS work on the CPU thread pool.
+
+  Kept apart from the default executor so file I/O in asyncio.to_thread
+  never queues behind a long scan, and sized so concurrent searches cannot
+  oversubscribe the cores BLAS is already using.
+  """
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(
+    _get_thread_pool(), functools.partial(func, *args, **kwargs)
+  )
+
+
+async def run_in_process(func: Callable[..., T], *args: Any) -> T:
+  """Run pure-Python work in the process pool (the thread pool without one).
+
+  `func` must be a module-level function and its arguments picklable.
+  """
+  pool = _get_process_pool()
+  if pool is None:
+    return await run_cpu(func, *args)
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(pool, func, *args)
+
+
+def shutdown_executors():
+  global _thread_pool, _process_pool
+  for pool in (_thread_pool, _process_pool):
+    if pool is not None:
+      pool.shutdown(wait=False, cancel_futures=True)
+  _thread_pool = _process_pool = None
@@ -1,12 +1,25 @@
+import contextvars
 import logging
 import sys
 
+# Id of the traced request being handled, set by utils.tracing
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="")
+
+
+class RequestIdFilter(logging.Filter):
+  """Prefixes lines logged while handling a traced request with its id."""
+
+  def filter(self, record: logging.LogRecord) -> bool:
+    current = request_id.get()
+    record.request = f"[{current}] " if current else ""
+    return True
+
 
 def setup_logging() -> logging.Logger:
   """Configure application-wide logging."""
   # Create formatter
   formatter = logging.Formatter(
-    fmt="%(asctime)s │ %(levelname)-7s │ %(name)-20s │ %(message)s",
+    fmt="%(asctime)s │ %(levelname)-7s │ %(name)-20s │ %(request)s%(message)s",
     datefmt="%H:%M:%S",
   )
 
@@ -14,6 +27,7 @@ def setup_logging() -> logging.Logger:
   console_handler = logging.StreamHandler(sys.stdout)
   console_handler.setFormatter(formatter)
   console_handler.setLevel(logging.DEBUG)
+  console_handler.addFilter(RequestIdFilter())
 
   # Root logger
   root_logger = logging.getLogger()
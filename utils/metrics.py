@@ -0,0 +1,231 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from utils.logging import get_logger
+
+logger = get_logger("metrics")
+
+# Seconds; spans a cached search (~1ms) to a slow model call (~1min).
+DEFAULT_BUCKETS = (
+  0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+# For counts such as batch sizes and rows scanned.
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000, 10000, 100000, 1000000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+  value = float(value)
+  if math.isnan(value):
+    return "NaN"
+  if math.isinf(value):
+    return "+Inf" if value > 0 else "-Inf"
+  return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+  """A named metric family; samples are keyed by label values.
+
+  Updates may come from worker threads (searches run off the event loop), so
+  every metric guards its samples with a lock.
+  """
+
+  kind = ""
+
+  def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+    self.name = name
+    self.documentation = documentation
+    self.labels = tuple(labels)
+    self._lock = threading.Lock()
+    self._callbacks: Dict[LabelValues, Callable[[], float]] = {}
+
+  def _key(self, labels: Dict[str, str]) -> LabelValues:
+    if set(labels) != set(self.labels):
+      raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+    return tuple(str(labels[label]) for label in self.labels)
+
+  def _label_text(self, key: LabelValues, extra: str = "") -> str:
+    pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key, strict=True)]
+    if extra:
+      pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+  def track(self, function: Callable[[], float], **labels: str):
+    """Read this sample from `function` at scrape time instead of storing it."""
+    self._callbacks[self._key(labels)] = function
+
+  def _samples(self) -> List[Tuple[LabelValues, float]]:
+    """Stored samples; subclasses that keep values override this."""
+    return []
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+    samples = self._samples()
+    for key, function in list(self._callbacks.items()):
+      try:
+        samples.append((key, float(function())))
+      except Exception as e:
+        logger.debug(f"Metric callback for {self.name} failed: {e}")
+    lines.extend(
+      f"{self.name}{self._label_text(key)} {_format_value(value)}" for key, value in samples
+    )
+    return lines
+
+
+class Counter(_Metric):
+  kind = "counter"
+
+  def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+    super().__init__(name, documentation, labels)
+    self._values: Dict[LabelValues, float] = {}
+
+  def inc(self, amount: float = 1, **labels: str):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0.0) + amount
+
+  def _samples(self) -> List[Tuple[LabelValues, float]]:
+    with self._lock:
+      return list(self._values.items())
+
+
+class Gauge(Counter):
+  kind = "gauge"
+
+  def set(self, value: float, **labels: str):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = value
+
+
+class Histogram(_Metric):
+  kind = "histogram"
+
+  def __init__(
+    self,
+    name: str,
+    documentation: str,
+    labels: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+  ):
+    super().__init__(name, documentation, labels)
+    self.buckets = tuple(sorted(buckets))
+    # label values -> (per-bucket counts incl. +Inf, sum, count)
+    self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+  def observe(self, value: float, **labels: str):
+    key = self._key(labels)
+    index = bisect.bisect_left(self.buckets, value)
+    with self._lock:
+      if key not in self._values:
+        self._values[key] = ([0] * (len(self.buckets) + 1), 0.0, 0)
+      counts, total, count = self._values[key]
+      counts[index] += 1
+      self._values[key] = (counts, total + value, count + 1)
+
+  @contextmanager
+  def time(self, **labels: str) -> Iterator[None]:
+    """Observe the seconds the block took, whether or not it raised."""
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start, **labels)
+
+  def render(self) -> List[str]:
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+    with self._lock:
+      values = [
+        (key, list(counts), total, count)
+        for key, (counts, total, count) in self._values.items()
+      ]
+    for key, counts, total, count in values:
+      cumulative = 0
+      for bound, bucket_count in zip((*self.buckets, math.inf), counts, strict=True):
+        cumulative += bucket_count
+        le = f'le="{_format_value(bound)}"'
+        lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+      lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(total)}")
+      lines.append(f"{self.name}_count{self._label_text(key)} {count}")
+    return lines
+
+
+_registry: Dict[str, _Metric] = {}
+
+
+def _register(metric_type: type, name: str, *args, **kwargs) -> _Metric:
+  metric = _registry.get(name)
+  if metric is None:
+    metric = _registry[name] = metric_type(name, *args, **kwargs)
+  elif type(metric) is not metric_type:
+    raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+  return metric
+
+
+def counter(name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+  return _register(Counter, name, documentation, labels)
+
+
+def gauge(name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+  return _register(Gauge, name, documentation, labels)
+
+
+def histogram(
+  name: str,
+  documentation: str,
+  labels: Sequence[str] = (),
+  buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+  return _register(Histogram, name, documentation, labels, buckets)
+
+
+def render() -> str:
+  """Every registered metric in the Prometheus text exposition format."""
+  lines: List[str] = []
+  for name in sorted(_registry):
+    lines.extend(_registry[name].render())
+  return "\n".join(lines) + "\n"
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+  return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int):
+  """Serve /metrics for Prometheus to scrape (once; later calls are no-ops)."""
+  global _runner
+  if _runner is not None:
+    return
+  app = web.Application()
+  app.router.add_get("/metrics", _handle_metrics)
+  runner = web.AppRunner(app, access_log=None)
+  await runner.setup()
+  try:
+    await web.TCPSite(runner, host, port).start()
+  except OSError as e:
+    logger.error(f"Could not serve metrics on {host}:{port}: {e}")
+    await runner.cleanup()
+    return
+  _runner = runner
+  logger.info(f"📈 Metrics at http://{host}:{port}/metrics")
+
+
+async def stop_server():
+  global _runner
+  if _runner is not None:
+    await _runner.cleanup()
+    _runner = None
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+
+# AIMD: halve the allowed rate on every throttle signal, win back this much of
+# the configured rate per successful call, never dropping below MIN_RATE_SCALE.
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_STEP = 0.05
+MIN_RATE_SCALE = 0.05
+# Pause after a throttle signal that carried no retry-after hint
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class TokenBucket:
+  """Continuously refilling budget of `per_minute` units, bursting to `capacity`."""
+
+  def __init__(self, per_minute: float, capacity: float):
+    self.rate = per_minute / 60.0
+    self.capacity = capacity
+    self.level = capacity
+    self.updated = time.monotonic()
+
+  def refill(self, now: float, scale: float):
+    self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * scale)
+    self.updated = now
+
+  def wait_time(self, amount: float, scale: float) -> float:
+    """Seconds until `amount` units are available (after `refill`)."""
+    amount = min(amount, self.capacity)
+    if self.level >= amount:
+      return 0.0
+    return (amount - self.level) / (self.rate * scale)
+
+
+class AdaptiveRateLimiter:
+  """Shared limiter for an API with requests/min and tokens/min quotas.
+
+  Callers hold a slot for the duration of a call (at most `max_concurrency`
+  in flight) and take one request plus their estimated tokens from the
+  buckets. Waiting callers are admitted by priority, then in arrival order,
+  so an INTERACTIVE call (a search query) goes ahead of every BACKGROUND
+  call still queued. Throttle signals from the API cut the refill rate
+  multiplicatively and pause all callers for the retry-after hint; each
+  success restores it additively.
+  """
+
+  INTERACTIVE = 0
+  BACKGROUND = 1
+
+  def __init__(
+    self,
+    requests_per_minute: float,
+    tokens_per_minute: float,
+    max_concurrency: int,
+    burst_seconds: float = 15.0,
+  ):
+    self.requests = TokenBucket(
+      requests_per_minute, max(1.0, requests_per_minute * burst_seconds / 60.0)
+    )
+    self.tokens = TokenBucket(
+      tokens_per_minute, max(1.0, tokens_per_minute * burst_seconds / 60.0)
+    )
+    self.scale = 1.0
+    self.throttled = 0
+    self.max_concurrency = max_concurrency
+    self.in_flight = 0
+    self._blocked_until = 0.0
+    # (priority, arrival, tokens, future) of callers waiting to be admitted
+    self._waiters: List[Tuple[int, int, int, asyncio.Future]] = []
+    self._arrivals = itertools.count()
+    self._wakeup: Optional[asyncio.TimerHandle] = None
+
+  @asynccontextmanager
+  async def acquire(self, tokens: int = 1, priority: int = BACKGROUND) -> AsyncIterator[None]:
+    admitted = asyncio.get_running_loop().create_future()
+    heapq.heappush(self._waiters, (priority, next(self._arrivals), tokens, admitted))
+    self._admit()
+    try:
+      await admitted
+    except asyncio.CancelledError:
+      if admitted.done() and not admitted.cancelled():
+        self._release()  # Admitted just as the caller gave up
+      else:
+        admitted.cancel()
+        self._admit()
+      raise
+    try:
+      yield
+    finally:
+      self._release()
+
+  def _release(self):
+    self.in_flight -= 1
+    self._admit()
+
+  def _admit(self):
+    """Admit waiters from the head of the queue while slots and budget allow."""
+    if self._wakeup is not None:
+      self._wakeup.cancel()
+      self._wakeup = None
+    while self._waiters:
+      _, _, tokens, admitted = self._waiters[0]
+      if admitted.done():  # Cancelled while waiting
+        heapq.heappop(self._waiters)
+        continue
+      if self.in_flight >= self.max_concurrency:
+        return  # The next release admits it
+      now = time.monotonic()
+      self.requests.refill(now, self.scale)
+      self.tokens.refill(now, self.scale)
+      wait = max(
+        self._blocked_until - now,
+        self.requests.wait_time(1, self.scale),
+        self.tokens.wait_time(tokens, self.scale),
+      )
+      if wait > 0:
+        self._wakeup = asyncio.get_running_loop().call_later(wait, self._admit)
+        return
+      heapq.heappop(self._waiters)
+      self.requests.level -= 1
+      self.tokens.level -= min(tokens, self.tokens.capacity)
+      self.in_flight += 1
+      admitted.set_result(None)
+
+  def on_success(self):
+    self.scale = min(1.0, self.scale + RATE_INCREASE_STEP)
+
+  def on_throttle(self, retry_after: Optional[float] = None):
+    now = time.monotonic()
+    self.throttled += 1
+    pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+    self._blocked_until = max(self._blocked_until, now + pause)
+    # Start again from empty buckets so traffic resumes gradually.
+    for bucket in (self.requests, self.tokens):
+      bucket.refill(now, self.scale)
+      bucket.level = min(bucket.level, 0.0)
+    self.scale = max(MIN_RATE_SCALE, self.scale * RATE_DECREASE_FACTOR)
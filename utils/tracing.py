@@ -0,0 +1,248 @@
+import asyncio
+import contextvars
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from config import (
+  LOOP_LAG_CHECK_INTERVAL,
+  LOOP_LAG_THRESHOLD_MS,
+  PROFILE_DIR,
+  PROFILE_TOP_FUNCTIONS,
+  SLOW_REQUEST_THRESHOLD,
+)
+from utils import metrics
+from utils.logging import get_logger, request_id
+
+logger = get_logger("tracing")
+
+REQUEST_SECONDS = metrics.histogram(
+  "request_seconds", "Traced request latency", ["request"]
+)
+STAGE_SECONDS = metrics.histogram(
+  "request_stage_seconds", "Time spent in each stage of a traced request", ["request", "stage"]
+)
+LOOP_LAG_SECONDS = metrics.histogram(
+  "event_loop_lag_seconds", "How late the event loop ran a scheduled wake-up"
+)
+LOOP_STALLS = metrics.counter(
+  "event_loop_stalls_total", f"Event loop blocked longer than {LOOP_LAG_THRESHOLD_MS}ms"
+)
+
+_request_ids = itertools.count(1)
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar(
+  "current_trace", default=None
+)
+# Per task, so spans in concurrently gathered coroutines nest correctly.
+_span_path: contextvars.ContextVar[str] = contextvars.ContextVar("span_path", default="")
+
+
+class Trace:
+  """Timing of one request: a request id plus (stage path, seconds) spans.
+
+  Nested spans are recorded under slash-joined paths ("context/search"), so
+  the breakdown shows where inside a stage the time went. Concurrent spans
+  may overlap, so stage times can add up to more than the total.
+  """
+
+  def __init__(self, name: str):
+    self.name = name
+    self.request_id = f"{os.getpid() % 1000:03d}-{next(_request_ids):06d}"
+    self.started = time.perf_counter()
+    self.spans: List[Tuple[str, float]] = []
+
+  @property
+  def elapsed(self) -> float:
+    return time.perf_counter() - self.started
+
+  def record(self, stage: str, seconds: float):
+    self.spans.append((stage, seconds))
+
+  def breakdown(self) -> str:
+    return ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in self.spans)
+
+
+def current_trace() -> Optional[Trace]:
+  return _current_trace.get()
+
+
+@contextmanager
+def trace(name: str) -> Iterator[Trace]:
+  """Trace a request: spans opened inside it are attributed to it.
+
+  Logs a per-stage breakdown when the request takes longer than
+  SLOW_REQUEST_THRESHOLD seconds, and profiles it if /profile armed capture.
+  """
+  current = Trace(name)
+  token = _current_trace.set(current)
+  path_token = _span_path.set("")
+  id_token = request_id.set(current.request_id)
+  profile = get_profiler().begin()
+  try:
+    yield current
+  finally:
+    elapsed = current.elapsed
+    request_id.reset(id_token)
+    _span_path.reset(path_token)
+    _current_trace.reset(token)
+    if profile is not None:
+      get_profiler().finish(profile, current)
+
+    REQUEST_SECONDS.observe(elapsed, request=current.name)
+    for stage, seconds in current.spans:
+      STAGE_SECONDS.observe(seconds, request=current.name, stage=stage)
+    if elapsed >= SLOW_REQUEST_THRESHOLD:
+      logger.warning(
+        f"🐢 Slow {current.name} [{current.request_id}]: {elapsed:.2f}s "
+        f"({current.breakdown() or 'no spans'})"
+      )
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+  """Time a stage of the current request; a no-op outside a trace."""
+  current = _current_trace.get()
+  if current is None:
+    yield
+    return
+  parent = _span_path.get()
+  path = f"{parent}/{stage}" if parent else stage
+  token = _span_path.set(path)
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    current.record(path, time.perf_counter() - start)
+    _span_path.reset(token)
+
+
+class RequestProfiler:
+  """cProfile capture for the next N traced requests, armed by /profile.
+
+  cProfile sees the whole event-loop thread, so a capture also includes
+  whatever else ran while the request awaited. Only one request is profiled
+  at a time; the top functions are logged and the raw stats are saved under
+  PROFILE_DIR for snakeviz or pstats.
+  """
+
+  def __init__(self):
+    self.remaining = 0
+    self._active = False
+
+  def arm(self, count: int):
+    self.remaining = max(0, count)
+
+  def begin(self) -> Optional[cProfile.Profile]:
+    if self.remaining <= 0 or self._active:
+      return None
+    self.remaining -= 1
+    self._active = True
+    profile = cProfile.Profile()
+    try:
+      profile.enable()
+    except ValueError:  # Another profiler is already running
+      self._active = False
+      return None
+    return profile
+
+  def finish(self, profile: cProfile.Profile, current: Trace):
+    profile.disable()
+    self._active = False
+    try:
+      os.makedirs(PROFILE_DIR, exist_ok=True)
+      path = os.path.join(PROFILE_DIR, f"{current.name}-{current.request_id}.prof")
+      profile.dump_stats(path)
+      output = io.StringIO()
+      pstats.Stats(profile, stream=output).sort_stats("cumulative").print_stats(
+        PROFILE_TOP_FUNCTIONS
+      )
+      logger.info(
+        f"🔬 Profile of {current.name} [{current.request_id}] saved to {path}\n"
+        f"{output.getvalue()}"
+      )
+    except Exception as e:
+      logger.error(f"Could not save profile for {current.request_id}: {e}")
+
+
+class LoopLagMonitor:
+  """Watches for event-loop stalls.
+
+  A task on the loop wakes every LOOP_LAG_CHECK_INTERVAL seconds and records
+  how late it ran. A watchdog thread checks that the task keeps beating; when
+  the loop has been blocked for LOOP_LAG_THRESHOLD_MS it logs the loop
+  thread's stack, which names the callback doing the blocking.
+  """
+
+  def __init__(self):
+    self.task: Optional[asyncio.Task] = None
+    self._thread: Optional[threading.Thread] = None
+    self._stop = threading.Event()
+    self._beat = time.monotonic()
+    self._loop_thread_id = 0
+
+  def start(self):
+    if self.task is not None and not self.task.done():
+      return
+    self._loop_thread_id = threading.get_ident()
+    self._beat = time.monotonic()
+    self._stop.clear()
+    self.task = asyncio.create_task(self._heartbeat())
+    self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self.task:
+      self.task.cancel()
+
+  async def _heartbeat(self):
+    while True:
+      expected = time.monotonic() + LOOP_LAG_CHECK_INTERVAL
+      await asyncio.sleep(LOOP_LAG_CHECK_INTERVAL)
+      now = time.monotonic()
+      self._beat = now
+      lag = max(0.0, now - expected)
+      LOOP_LAG_SECONDS.observe(lag)
+      if lag * 1000 >= LOOP_LAG_THRESHOLD_MS:
+        LOOP_STALLS.inc()
+        logger.warning(f"⏱️ Event loop was blocked for {lag * 1000:.0f}ms")
+
+  def _watch(self):
+    threshold = LOOP_LAG_THRESHOLD_MS / 1000
+    reported_beat = None
+    while not self._stop.wait(threshold / 2):
+      beat = self._beat
+      if beat == reported_beat or time.monotonic() - beat < LOOP_LAG_CHECK_INTERVAL + threshold:
+        continue
+      frame = sys._current_frames().get(self._loop_thread_id)
+      if frame is None:
+        continue
+      reported_beat = beat
+      stack = "".join(traceback.format_stack(frame, limit=15))
+      logger.warning(f"⏱️ Event loop blocked, currently running:\n{stack}")
+
+
+_profiler: Optional[RequestProfiler] = None
+_loop_monitor: Optional[LoopLagMonitor] = None
+
+
+def get_profiler() -> RequestProfiler:
+  global _profiler
+  if _profiler is None:
+    _profiler = RequestProfiler()
+  return _profiler
+
+
+def get_loop_monitor() -> LoopLagMonitor:
+  global _loop_monitor
+  if _loop_monitor is None:
+    _loop_monitor = LoopLagMonitor()
+  return _loop_monitor